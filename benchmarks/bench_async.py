@@ -0,0 +1,40 @@
+import time
+from absl import app, flags
+from gemba.gpt_api import GptApi, AsyncGptApi
+from gemba.prompt import prompts, validate_number
+from benchmarks.fake_server import FakeAnthropicServer
+
+
+flags.DEFINE_integer('prompts', 2000, 'Number of prompts per run.')
+flags.DEFINE_float('latency', 0.05, 'Simulated server latency in seconds.')
+flags.DEFINE_list('concurrency', ['4', '16', '64', '256'], 'Concurrency levels to measure.')
+
+
+def main(argv):
+    FLAGS = flags.FLAGS
+    template = prompts["GEMBA-DA"]["prompt"]
+    data = {"source_lang": "English", "target_lang": "German", "source_seg": "Hello.", "target_seg": "Hallo."}
+    # make every prompt unique so nothing can be served from a cache
+    batch = [template.format(**data) + str(i) for i in range(FLAGS.prompts)]
+
+    with FakeAnthropicServer(latency=FLAGS.latency) as server:
+        print("engine\tconcurrency\tprompts\tseconds\tprompts/s")
+
+        gptapi = GptApi(num_workers=4, api_key="fake", base_url=server.url)
+        start = time.time()
+        gptapi.bulk_request(batch, "fake", validate_number, cache=None)
+        elapsed = time.time() - start
+        print(f"threads\t4\t{len(batch)}\t{elapsed:.2f}\t{len(batch) / elapsed:.1f}")
+
+        for concurrency in FLAGS.concurrency:
+            concurrency = int(concurrency)
+            gptapi = AsyncGptApi(max_concurrent=concurrency, api_key="fake", base_url=server.url)
+            start = time.time()
+            answers = gptapi.bulk_request(batch, "fake", validate_number, cache=None)
+            elapsed = time.time() - start
+            assert all(answer["answer"] == 85 for answer in answers)
+            print(f"asyncio\t{concurrency}\t{len(batch)}\t{elapsed:.2f}\t{len(batch) / elapsed:.1f}")
+
+
+if __name__ == "__main__":
+    app.run(main)
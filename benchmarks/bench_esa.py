@@ -0,0 +1,69 @@
+import time
+import random
+import threading
+from absl import app, flags
+from gemba.gpt_api import GptApi, AsyncGptApi
+from gemba.prompt import validate_number
+from gemba.gemba_esa import TEMPLATE_GEMBA_ESA_ERROR_SPANS, TEMPLATE_GEMBA_ESA_RANKING
+from gemba.gemba_mqm_utils import apply_template
+from gemba.utils import pipelined_esa
+from benchmarks.fake_server import FakeAnthropicServer
+
+
+flags.DEFINE_integer('segments', 300, 'Number of segments per run.')
+flags.DEFINE_float('latency', 0.3, 'Median simulated server latency in seconds.')
+flags.DEFINE_float('sigma', 0.5, 'Sigma of the lognormal latency distribution.')
+flags.DEFINE_float('straggler_rate', 0.02, 'Share of requests taking `straggler_latency` seconds.')
+flags.DEFINE_float('straggler_latency', 3.0, 'Latency of a straggler in seconds.')
+flags.DEFINE_list('concurrency', ['16', '64'], 'Concurrency levels to measure.')
+
+
+def barrier_esa(gptapi, rows, model):
+    """GEMBA-ESA as before the pipeline: no ranking request before every error span annotation returned"""
+    error_spans = gptapi.bulk_request([apply_template(TEMPLATE_GEMBA_ESA_ERROR_SPANS, row) for row in rows], model, lambda x: x, cache=None)
+    for row, answer in zip(rows, error_spans):
+        row["error_spans"] = answer["answer"]
+    return gptapi.bulk_request([apply_template(TEMPLATE_GEMBA_ESA_RANKING, row) for row in rows], model, validate_number, cache=None)
+
+
+def main(argv):
+    FLAGS = flags.FLAGS
+    rng = random.Random(0)
+    lock = threading.Lock()
+
+    def latency(body):
+        with lock:
+            if rng.random() < FLAGS.straggler_rate:
+                return FLAGS.straggler_latency
+            return rng.lognormvariate(0, FLAGS.sigma) * FLAGS.latency
+
+    def rows():
+        # unique segments so nothing is deduplicated
+        return [{"source_lang": "English", "target_lang": "German", "source_seg": f"Hello {i}.", "target_seg": f"Hallo {i}."} for i in range(FLAGS.segments)]
+
+    engines = {
+        "threads": lambda concurrency, url: GptApi(num_workers=concurrency, api_key="fake", base_url=url),
+        "asyncio": lambda concurrency, url: AsyncGptApi(max_concurrent=concurrency, api_key="fake", base_url=url),
+    }
+
+    with FakeAnthropicServer(latency=latency) as server:
+        print("engine\tconcurrency\tsegments\tbarrier s\tpipelined s\tspeedup")
+        for name, engine in engines.items():
+            for concurrency in FLAGS.concurrency:
+                concurrency = int(concurrency)
+
+                start = time.time()
+                answers = barrier_esa(engine(concurrency, server.url), rows(), "fake")
+                barrier = time.time() - start
+                assert all(answer["answer"] == 85 for answer in answers)
+
+                start = time.time()
+                answers = [answers[0] for row, answers in pipelined_esa(engine(concurrency, server.url), rows(), "fake", None)]
+                pipelined = time.time() - start
+                assert len(answers) == FLAGS.segments and all(answer["answer"] == 85 for answer in answers)
+
+                print(f"{name}\t{concurrency}\t{FLAGS.segments}\t{barrier:.2f}\t{pipelined:.2f}\t{barrier / pipelined:.2f}x")
+
+
+if __name__ == "__main__":
+    app.run(main)
@@ -0,0 +1,119 @@
+import os
+import sys
+import json
+import time
+import resource
+import tempfile
+import multiprocessing
+from absl import app, flags
+from gemba.cache import ResponseStore
+from gemba.telemetry import Telemetry, QUANTILES
+from gemba.utils import get_gemba_scores
+from benchmarks.fake_server import FakeAnthropicServer, gemba_answer, lognormal_latency
+
+
+flags.DEFINE_list('methods', ['GEMBA-DA', 'GEMBA-SQM', 'GEMBA-stars', 'GEMBA-classes', 'GEMBA-MQM', 'GEMBA-ESA'], 'Methods to benchmark.')
+flags.DEFINE_list('sizes', ['source', '100000'], 'Input sizes in segments, "source" for the length of --source.')
+flags.DEFINE_string('source', 'source.txt', 'Source segments, repeated up to the input size.')
+flags.DEFINE_string('hypothesis', 'hypothesis.txt', 'Translated segments, repeated up to the input size.')
+flags.DEFINE_enum('backend', 'async', ['threads', 'async', 'batch'], 'Execution backend.')
+flags.DEFINE_integer('pack_size', 1, 'Segments per request for the score methods.')
+flags.DEFINE_float('latency', 0.02, 'Median simulated server latency in seconds.')
+flags.DEFINE_float('sigma', 0.5, 'Sigma of the lognormal latency distribution.')
+flags.DEFINE_float('straggler_rate', 0.0, 'Share of requests taking --straggler_latency seconds.')
+flags.DEFINE_float('straggler_latency', 1.0, 'Latency of a straggler in seconds.')
+flags.DEFINE_float('throttle_rate', 0.0, 'Share of requests answered with 429.')
+flags.DEFINE_float('error_rate', 0.0, 'Share of requests answered with 500.')
+flags.DEFINE_string('json', None, 'Also write the results as JSON lines to this file, e.g. as the --baseline of a later run.')
+flags.DEFINE_string('baseline', None, 'JSON lines of an earlier run (--json), exit with an error when a method regressed against it.')
+flags.DEFINE_float('tolerance', 0.25, 'Relative loss of throughput or growth of peak memory against --baseline that counts as a regression.')
+
+
+def segments(size):
+    FLAGS = flags.FLAGS
+    with open(FLAGS.source) as f:
+        source = [x.strip() for x in f]
+    with open(FLAGS.hypothesis) as f:
+        hypothesis = [x.strip() for x in f]
+    size = len(source) if size == "source" else int(size)
+    # repetitions are numbered, identical segments would be deduplicated instead of requested
+    suffix = lambda i: "" if i < len(source) else f" ({i // len(source)})"
+    return ([source[i % len(source)] + suffix(i) for i in range(size)],
+            [hypothesis[i % len(hypothesis)] + suffix(i) for i in range(size)])
+
+
+def run(method, size, url):
+    """Score one input in a child process, so peak memory is measured per run"""
+    FLAGS = flags.FLAGS
+    os.environ["ANTHROPIC_BASE_URL"] = url
+    os.environ["ANTHROPIC_API_KEY"] = "fake"
+    source, hypothesis = segments(size)
+    telemetry = Telemetry(method=method)
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.time()
+        answers = get_gemba_scores(source, hypothesis, "Tibetan", "English", method, "fake", backend=FLAGS.backend, pack_size=FLAGS.pack_size,
+                                   store=ResponseStore(directory), telemetry=telemetry)
+        elapsed = time.time() - start
+
+    # latencies of both GEMBA-ESA stages together
+    latencies = sorted(value for series in telemetry.samples.values() if "latency" in series for value in series["latency"].reservoir)
+    quantiles = {f"p{int(q * 100)}": latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else 0.0 for q in QUANTILES}
+    return {
+        "method": method, "segments": len(source), "seconds": elapsed, "segments_per_second": len(source) / elapsed,
+        "answered": sum(answer is not None for answer in answers), "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        **quantiles,
+    }
+
+
+def regressions(result, baseline, tolerance):
+    """What got worse than the baseline run of the same method and input size"""
+    found = []
+    if result["segments_per_second"] < (1 - tolerance) * baseline["segments_per_second"]:
+        found.append(f"{baseline['segments_per_second']:.1f} -> {result['segments_per_second']:.1f} segments/s")
+    if result["max_rss_mb"] > (1 + tolerance) * baseline["max_rss_mb"]:
+        found.append(f"{baseline['max_rss_mb']:.0f} -> {result['max_rss_mb']:.0f} MB max RSS")
+    if result["answered"] < baseline["answered"]:
+        found.append(f"{baseline['answered']} -> {result['answered']} answered")
+    return [f"{result['method']} ({result['segments']} segments): {regression}" for regression in found]
+
+
+def main(argv):
+    FLAGS = flags.FLAGS
+    latency = lognormal_latency(FLAGS.latency, FLAGS.sigma, FLAGS.straggler_rate, FLAGS.straggler_latency)
+    # forked, the children see the parsed flags and reach the server of the parent
+    context = multiprocessing.get_context("fork")
+    output = open(FLAGS.json, "w") if FLAGS.json else None
+    baseline = {}
+    if FLAGS.baseline:
+        with open(FLAGS.baseline) as f:
+            for line in f:
+                result = json.loads(line)
+                baseline[(result["method"], result["segments"])] = result
+    found = []
+
+    with FakeAnthropicServer(latency=latency, answer=gemba_answer, throttle_rate=FLAGS.throttle_rate, error_rate=FLAGS.error_rate) as server:
+        print("method\tsegments\trequests\tseconds\tsegments/s\tp50 s\tp95 s\tp99 s\tmax RSS MB\tanswered")
+        for size in FLAGS.sizes:
+            for method in FLAGS.methods:
+                requests = server.requests
+                with context.Pool(1) as pool:
+                    result = pool.apply(run, (method, size, server.url))
+                result["requests"] = server.requests - requests
+                print(f"{method}\t{result['segments']}\t{result['requests']}\t{result['seconds']:.2f}\t{result['segments_per_second']:.1f}\t"
+                      f"{result['p50']:.3f}\t{result['p95']:.3f}\t{result['p99']:.3f}\t{result['max_rss_mb']:.0f}\t{result['answered']}/{result['segments']}")
+                sys.stdout.flush()
+                if output is not None:
+                    output.write(json.dumps(result) + "\n")
+                if (method, result["segments"]) in baseline:
+                    found += regressions(result, baseline[(method, result["segments"])], FLAGS.tolerance)
+
+    if output is not None:
+        output.close()
+    if found:
+        print("Regressions against the baseline:\n" + "\n".join(found), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    app.run(main)
@@ -0,0 +1,62 @@
+import os
+import time
+import tempfile
+import numpy as np
+import pandas as pd
+from absl import app, flags
+from gemba.columnar import ColumnStore
+
+
+flags.DEFINE_integer('metrics', 112, 'Metric files in the language pair.')
+flags.DEFINE_integer('systems', 15, 'Systems per file.')
+flags.DEFINE_integer('segments', 2500, 'Segments per system, 15 x 2500 = 37,500 lines per file as in WMT22 en-de.')
+
+
+def write_metric_scores(folder, metrics, systems, segments):
+    """Synthetic metric-scores folder, integer scores as GEMBA-DA gives them and MQM-like ones"""
+    rng = np.random.default_rng(0)
+    for m in range(metrics):
+        values = rng.integers(0, 101, systems * segments) if m % 2 else np.round(rng.uniform(-25, 0, systems * segments), 1)
+        with open(f"{folder}/GEMBA-{m}-refA.seg.score", "w") as f:
+            f.writelines(f"system{i // segments}\t{value}\n" for i, value in enumerate(values.tolist()))
+
+
+def read_tsvs(folder):
+    # what mt-metrics-eval and Scores did on every load
+    columns = {}
+    for name in sorted(os.listdir(folder)):
+        if name.endswith(".seg.score"):
+            df = pd.read_csv(f"{folder}/{name}", sep="\t", names=["system", "value"], index_col=False, dtype={"system": str}, keep_default_na=False)
+            columns[name[:-len(".seg.score")]] = {system: group["value"].to_numpy(dtype=float) for system, group in df.groupby("system", sort=False)}
+    return columns
+
+
+def main(argv):
+    FLAGS = flags.FLAGS
+    with tempfile.TemporaryDirectory() as folder:
+        write_metric_scores(folder, FLAGS.metrics, FLAGS.systems, FLAGS.segments)
+
+        start = time.perf_counter()
+        tsvs = read_tsvs(folder)
+        tsv_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        ColumnStore(folder).load_all()
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        columns = {name: column.by_system() for name, column in ColumnStore(folder).load_all().items()}
+        load_time = time.perf_counter() - start
+
+        identical = tsvs.keys() == columns.keys() and all(
+            tsvs[name].keys() == columns[name].keys() and all(np.array_equal(tsvs[name][system], columns[name][system]) for system in tsvs[name])
+            for name in tsvs)
+        sidecar_mb = sum(os.path.getsize(f"{folder}/.columnar/{name}") for name in os.listdir(f"{folder}/.columnar")) / 1e6
+        tsv_mb = sum(os.path.getsize(f"{folder}/{name}") for name in os.listdir(folder) if name.endswith(".score")) / 1e6
+
+        print("metrics\tlines/file\tread_csv s\tbuild s\tload ms\tTSV MB\tsidecar MB\tidentical")
+        print(f"{FLAGS.metrics}\t{FLAGS.systems * FLAGS.segments}\t{tsv_time:.2f}\t{build_time:.2f}\t{load_time * 1000:.1f}\t{tsv_mb:.1f}\t{sidecar_mb:.1f}\t{identical}")
+
+
+if __name__ == "__main__":
+    app.run(main)
@@ -0,0 +1,54 @@
+import re
+import time
+import random
+import pandas as pd
+from absl import app, flags
+from gemba.gpt_api import AsyncGptApi
+from gemba.packing import packed_bulk_request
+from gemba.prompt import prompts
+from benchmarks.fake_server import FakeAnthropicServer
+
+
+flags.DEFINE_string('method', 'GEMBA-DA', 'Method to benchmark.')
+flags.DEFINE_string('source', 'source.txt', 'Source segments.')
+flags.DEFINE_string('hypothesis', 'hypothesis.txt', 'Translated segments.')
+flags.DEFINE_list('pack_sizes', ['1', '5', '10', '20'], 'Segments per request to compare.')
+flags.DEFINE_float('drop_rate', 0.02, 'Fraction of items the fake model leaves out of a packed answer.')
+
+
+def fake_answer(body, drop_rate, rng=random.Random(0)):
+    text = body["messages"][-1]["content"]
+    items = re.findall(r"^Item (\d+):$", text, re.MULTILINE)
+    if not items:
+        return "85"
+    return "\n".join(f"Item {number}: 85" for number in items if rng.random() >= drop_rate)
+
+
+def main(argv):
+    FLAGS = flags.FLAGS
+    with open(FLAGS.source) as f:
+        source = [x.strip() for x in f]
+    with open(FLAGS.hypothesis) as f:
+        hypothesis = [x.strip() for x in f]
+    df = pd.DataFrame({'source_seg': source, 'target_seg': hypothesis, 'source_lang': 'Tibetan', 'target_lang': 'English'})
+
+    server = FakeAnthropicServer(latency=0.05, answer=lambda body: fake_answer(body, FLAGS.drop_rate))
+    print("pack_size\tcalls\tinput_tokens\toutput_tokens\tseconds\tanswered")
+    with server:
+        for pack_size in FLAGS.pack_sizes:
+            pack_size = int(pack_size)
+            gptapi = AsyncGptApi(max_concurrent=16, api_key="fake", base_url=server.url)
+            start = time.time()
+            if pack_size == 1:
+                single_prompts = [prompts[FLAGS.method]["prompt"].format(**row) for row in df.to_dict("records")]
+                answers = gptapi.bulk_request(single_prompts, "fake", prompts[FLAGS.method]["validate_answer"], cache=None, max_tokens=500)
+            else:
+                answers = packed_bulk_request(gptapi, df, FLAGS.method, "fake", None, pack_size, max_tokens=500)
+            elapsed = time.time() - start
+            usage = gptapi.usage
+            answered = sum(answer["answer"] is not None for answer in answers)
+            print(f"{pack_size}\t{usage['requests']}\t{usage['input_tokens']}\t{usage['output_tokens']}\t{elapsed:.2f}\t{answered}/{len(df)}")
+
+
+if __name__ == "__main__":
+    app.run(main)
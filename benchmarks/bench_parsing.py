@@ -0,0 +1,76 @@
+import json
+import time
+import random
+import numpy as np
+from absl import app, flags
+from gemba.gemba_mqm_utils import few_shots, parse_mqm_answer, parse_mqm_answers, mqm_score
+from gemba.gemba_esa import esa_few_shots
+from gemba.prompt import prompts, validate_answers, validate_stars, parse_numerical_answer
+from benchmarks.fake_server import CLASSES, error_spans, score_answer
+
+
+flags.DEFINE_string('answers', None, 'JSON-lines export of a response store (python -m gemba.cache_cli export), otherwise a synthetic corpus is used.')
+flags.DEFINE_integer('size', 200000, 'Answers in the synthetic corpus.')
+flags.DEFINE_float('distinct', 0.2, 'Share of distinct MQM answers in the synthetic corpus, cached answers repeat a lot.')
+flags.DEFINE_integer('repeat', 3, 'Timed repetitions, the best one is reported.')
+
+
+def synthetic_corpus(size, distinct):
+    """MQM span lists from the few-shot examples and the fake server, and score answers as the models give them"""
+    rng = random.Random(0)
+    targets = [shot["target_seg"] for shot in list(few_shots.values()) + list(esa_few_shots.values())]
+    unique = [shot["answer"] for shot in few_shots.values()]
+    unique += [error_spans(rng, rng.choice(targets), ["Critical", "Major", "Minor"]) for _ in range(max(1, int(size * distinct)))]
+    return {
+        "mqm": [rng.choice(unique) for _ in range(size)],
+        "scores": [score_answer(rng, "Score") for _ in range(size)],
+        "stars": [score_answer(rng, "Stars") for _ in range(size)],
+        "classes": [rng.choice(CLASSES) for _ in range(size)],
+    }
+
+
+def exported_corpus(path):
+    # the method of an exported answer is unknown, every answer goes through every parser
+    with open(path) as f:
+        answers = [answer[0] for line in f for answer in json.loads(line)["answers"]]
+    return {"mqm": answers, "scores": answers, "stars": answers, "classes": answers}
+
+
+def best_time(fn, repeat, clear):
+    times = []
+    for _ in range(repeat):
+        clear()
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main(argv):
+    FLAGS = flags.FLAGS
+    corpus = exported_corpus(FLAGS.answers) if FLAGS.answers else synthetic_corpus(FLAGS.size, FLAGS.distinct)
+
+    def clear():
+        # every repetition starts cold
+        for cached in [mqm_score, validate_stars, parse_numerical_answer]:
+            cached.cache_clear()
+
+    benchmarks = [
+        ("mqm", parse_mqm_answer, lambda answers: parse_mqm_answers(answers)["score"]),
+        ("scores", prompts["GEMBA-DA"]["validate_answer"], lambda answers: validate_answers(answers, prompts["GEMBA-DA"]["validate_answer"])),
+        ("stars", prompts["GEMBA-stars"]["validate_answer"], lambda answers: validate_answers(answers, prompts["GEMBA-stars"]["validate_answer"])),
+        ("classes", prompts["GEMBA-classes"]["validate_answer"], lambda answers: validate_answers(answers, prompts["GEMBA-classes"]["validate_answer"])),
+    ]
+
+    print("parser\tanswers\tscalar s\tbatch s\tspeedup\tidentical")
+    for name, scalar, batch in benchmarks:
+        answers = corpus[name]
+        scalar_time, scalar_results = best_time(lambda: [scalar(answer) for answer in answers], FLAGS.repeat, clear)
+        batch_time, batch_results = best_time(lambda: batch(answers), FLAGS.repeat, clear)
+        expected = np.array([np.nan if result is None else result for result in scalar_results], dtype=float)
+        identical = np.array_equal(expected, batch_results, equal_nan=True)
+        print(f"{name}\t{len(answers)}\t{scalar_time:.3f}\t{batch_time:.3f}\t{scalar_time / batch_time:.2f}x\t{identical}")
+
+
+if __name__ == "__main__":
+    app.run(main)
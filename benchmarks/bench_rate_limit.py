@@ -0,0 +1,38 @@
+import time
+from absl import app, flags
+from gemba.gpt_api import AsyncGptApi
+from gemba.prompt import prompts, validate_number
+from gemba.rate_limiter import RateLimiter
+from benchmarks.fake_server import FakeAnthropicServer
+
+
+flags.DEFINE_integer('prompts', 600, 'Number of prompts.')
+flags.DEFINE_integer('concurrency', 64, 'Maximum concurrency.')
+flags.DEFINE_integer('server_rpm', 1200, 'Requests-per-minute limit enforced by the fake server.')
+flags.DEFINE_float('throttle_rate', 0.05, 'Fraction of random 429 responses.')
+flags.DEFINE_float('overload_rate', 0.02, 'Fraction of random 529 responses.')
+
+
+def main(argv):
+    FLAGS = flags.FLAGS
+    template = prompts["GEMBA-DA"]["prompt"]
+    data = {"source_lang": "English", "target_lang": "German", "source_seg": "Hello.", "target_seg": "Hallo."}
+    batch = [template.format(**data) + str(i) for i in range(FLAGS.prompts)]
+
+    server = FakeAnthropicServer(latency=0.05, requests_per_minute=FLAGS.server_rpm,
+                                 throttle_rate=FLAGS.throttle_rate, overload_rate=FLAGS.overload_rate)
+    with server:
+        limiter = RateLimiter(max_concurrent=FLAGS.concurrency, backoff_base=0.2)
+        gptapi = AsyncGptApi(max_concurrent=FLAGS.concurrency, api_key="fake", base_url=server.url, rate_limiter=limiter)
+        start = time.time()
+        answers = gptapi.bulk_request(batch, "fake", validate_number, cache=None)
+        elapsed = time.time() - start
+
+    answered = sum(answer["answer"] is not None for answer in answers)
+    print(f"answered {answered}/{len(batch)} prompts in {elapsed:.1f}s ({answered / elapsed:.1f} prompts/s)")
+    print(f"server: {server.requests} requests, {server.throttled} throttled")
+    print(f"limiter: {limiter.summary()}")
+
+
+if __name__ == "__main__":
+    app.run(main)
@@ -0,0 +1,67 @@
+import os
+import time
+import tempfile
+import numpy as np
+from absl import app, flags
+from gemba.testset import Testset
+from gemba.scores import Scores
+
+
+flags.DEFINE_list('segments', ['1000', '10000', '100000'], 'Segments per system to measure.')
+flags.DEFINE_integer('systems', 20, 'Number of systems.')
+
+
+def write_testset(basepath, segments, systems):
+    """Synthetic mt-metrics-eval layout with one source, reference and document file"""
+    dataset = f"{basepath}/bench"
+    for folder in ["sources", "references", "documents", "system-outputs/en-de"]:
+        os.makedirs(f"{dataset}/{folder}", exist_ok=True)
+    lines = "".join(f"segment {i}\n" for i in range(segments))
+    for path in ["sources/en-de.txt", "references/en-de.refA.txt"] + [f"system-outputs/en-de/system{s}.txt" for s in range(systems)]:
+        with open(f"{dataset}/{path}", "w") as f:
+            f.write(lines)
+    with open(f"{dataset}/documents/en-de.docs", "w") as f:
+        f.write("".join(f"domain{i % 4}\tdoc{i // 10}\n" for i in range(segments)))
+    return Testset(basepath, "bench", "en-de")
+
+
+def main(argv):
+    FLAGS = flags.FLAGS
+    rng = np.random.default_rng(0)
+    print("segments\tsystems\tassign+get us/segment\tbulk assign us/segment\tsave s\tload s")
+    for segments in FLAGS.segments:
+        segments = int(segments)
+        with tempfile.TemporaryDirectory() as basepath:
+            testset = write_testset(basepath, segments, FLAGS.systems)
+            scores = Scores("bench", testset, None)
+            total = testset.segments_count()
+            answers = rng.integers(0, 101, total).tolist()
+
+            # the gemba_da.py loop: one lookup and one assignment per hypothesis
+            start = time.perf_counter()
+            hypothesis_index = -1
+            for _, _, _, system in testset.iterate_over_all():
+                hypothesis_index += 1
+                if not scores.has_score(system, hypothesis_index):
+                    scores.assign_score(system, hypothesis_index, answers[hypothesis_index], 0)
+            single = (time.perf_counter() - start) / total * 1e6
+
+            start = time.perf_counter()
+            for s, system in enumerate(testset.systems):
+                scores.assign_scores(system, range(s * segments, (s + 1) * segments), answers[s * segments:(s + 1) * segments])
+            bulk = (time.perf_counter() - start) / total * 1e6
+
+            start = time.perf_counter()
+            scores.save()
+            save = time.perf_counter() - start
+
+            start = time.perf_counter()
+            loaded = Scores("bench", testset, None)
+            load = time.perf_counter() - start
+            assert np.array_equal(loaded.scores, scores.scores)
+
+            print(f"{segments}\t{FLAGS.systems}\t{single:.2f}\t{bulk:.3f}\t{save:.2f}\t{load:.2f}")
+
+
+if __name__ == "__main__":
+    app.run(main)
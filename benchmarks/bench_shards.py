@@ -0,0 +1,52 @@
+import os
+import time
+import tempfile
+import multiprocessing
+from absl import app, flags
+from gemba.gpt_api import AsyncGptApi
+from gemba.prompt import prompts, validate_number
+from gemba.rate_limiter import RateLimiter, RateCoordinator
+from gemba.shards import shard_of
+from benchmarks.fake_server import FakeAnthropicServer
+
+
+flags.DEFINE_integer('prompts', 1600, 'Number of prompts over all shards.')
+flags.DEFINE_integer('shards', 4, 'Number of shard processes sharing the API key.')
+flags.DEFINE_integer('server_rpm', 1200, 'Requests-per-minute limit of the API key, enforced by the fake server.')
+flags.DEFINE_integer('concurrency', 32, 'Concurrency of every shard.')
+
+
+def score_shard(url, shard, shards, count, concurrency, rpm, coordinator_path):
+    template = prompts["GEMBA-DA"]["prompt"]
+    data = {"source_lang": "English", "target_lang": "German", "source_seg": "Hello.", "target_seg": "Hallo."}
+    batch = [template.format(**data) + str(i) for i in range(count)]
+    batch = [prompt for prompt in batch if shard_of(prompt, shards) == shard]
+
+    coordinator = RateCoordinator(coordinator_path, interval=1.0) if coordinator_path else None
+    # every shard is given the budget of the whole API key, as with --requests_per_minute
+    limiter = RateLimiter(requests_per_minute=rpm, max_concurrent=concurrency, backoff_base=0.2, coordinator=coordinator)
+    gptapi = AsyncGptApi(max_concurrent=concurrency, api_key="fake", base_url=url, rate_limiter=limiter)
+    answers = gptapi.bulk_request(batch, "fake", validate_number, cache=None)
+    if coordinator is not None:
+        coordinator.close()
+    return sum(answer["answer"] is not None for answer in answers), limiter.summary()
+
+
+def main(argv):
+    FLAGS = flags.FLAGS
+    print("coordinator\tshards\tprompts\tseconds\tanswered\tserver 429s\tlimiter retries")
+    for coordinated in [False, True]:
+        with tempfile.TemporaryDirectory() as directory, FakeAnthropicServer(latency=0.05, requests_per_minute=FLAGS.server_rpm) as server:
+            coordinator_path = os.path.join(directory, "coordinator.db") if coordinated else None
+            # one process per shard, as on separate machines
+            with multiprocessing.get_context("spawn").Pool(FLAGS.shards) as pool:
+                start = time.time()
+                results = pool.starmap(score_shard, [(server.url, shard, FLAGS.shards, FLAGS.prompts, FLAGS.concurrency, FLAGS.server_rpm, coordinator_path) for shard in range(FLAGS.shards)])
+                elapsed = time.time() - start
+            answered = sum(count for count, _ in results)
+            retries = sum(summary["retries"] for _, summary in results)
+            print(f"{'yes' if coordinated else 'no'}\t{FLAGS.shards}\t{FLAGS.prompts}\t{elapsed:.1f}\t{answered}\t{server.throttled}\t{retries}")
+
+
+if __name__ == "__main__":
+    app.run(main)
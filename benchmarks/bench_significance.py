@@ -0,0 +1,72 @@
+import time
+import numpy as np
+from absl import app, flags
+from scipy import stats
+from gemba.significance import bootstrap_indices, compare_metrics, rank_metrics
+
+flags.DEFINE_integer('systems', 15, 'Systems per language pair.')
+flags.DEFINE_integer('segments', 2000, 'Segments per system.')
+flags.DEFINE_integer('metrics', 112, 'Metrics compared in every task.')
+flags.DEFINE_integer('k', 1000, 'Bootstrap resamples.')
+flags.DEFINE_integer('loop_k', 20, 'Resamples of the scipy loop, its time is extrapolated to --k.')
+
+
+def synthetic_scores(rng, systems, segments, metrics):
+    """Gold scores with per-system offsets, and metrics agreeing with gold to a decreasing degree"""
+    gold = rng.normal(size=(systems, 1)) + rng.normal(size=(systems, segments))
+    noise = np.linspace(0.2, 3.0, metrics)[:, None, None]
+    return gold, gold[None] + noise * rng.normal(size=(metrics, systems, segments))
+
+
+def looped_samples(gold, metrics, corr, average_by, indices):
+    """Correlations of explicit resamples, one scipy call per resample, metric and group"""
+    corr_fcn = {"pearson": stats.pearsonr, "kendall": stats.kendalltau}[corr]
+    if average_by == "item":
+        gold, metrics = gold.T, metrics.transpose(0, 2, 1)
+    samples = np.zeros((len(indices), len(metrics)))
+    for i, draw in enumerate(indices):
+        for j, metric in enumerate(metrics):
+            if average_by == "none":
+                samples[i, j] = corr_fcn(gold[:, draw].ravel(), metric[:, draw].ravel())[0]
+            else:
+                samples[i, j] = np.mean([corr_fcn(gold[g], metric[g])[0] for g in draw])
+    return samples
+
+
+def main(argv):
+    FLAGS = flags.FLAGS
+    rng = np.random.default_rng(0)
+    gold, metrics = synthetic_scores(rng, FLAGS.systems, FLAGS.segments, FLAGS.metrics)
+    names = [f"metric-{i}" for i in range(FLAGS.metrics)]
+    levels = {"seg": (gold, metrics), "sys": (gold.mean(axis=1, keepdims=True), metrics.mean(axis=2, keepdims=True))}
+
+    print("level\tcorrelation\taverage\tvectorized s\tloop s (extrapolated)\tspeedup\tsame p-values")
+    for level, (level_gold, level_metrics) in levels.items():
+        for corr in ["pearson", "kendall"]:
+            for average_by in (["none", "sys", "item"] if level == "seg" else ["none"]):
+                if level == "seg" and corr == "kendall" and average_by == "none":
+                    # too many pairs to vectorize, gemba.significance loops over the resamples as well
+                    continue
+                start = time.perf_counter()
+                vectorized, _ = compare_metrics(names, level_gold, level_metrics, corr, average_by, k=FLAGS.k, seed=0)
+                vectorized_time = time.perf_counter() - start
+
+                # the first loop_k draws of compare_metrics, recomputed resample by resample
+                sample_gold, sample_metrics = level_gold, level_metrics
+                if level == "sys":
+                    sample_gold, sample_metrics = level_gold.T, level_metrics.transpose(0, 2, 1)
+                units = sample_gold.shape[0] if average_by == "sys" else sample_gold.shape[1]
+                indices = bootstrap_indices(np.random.default_rng(0), units, FLAGS.k)[:FLAGS.loop_k]
+                start = time.perf_counter()
+                samples = looped_samples(sample_gold, sample_metrics, corr, average_by, indices)
+                loop_time = (time.perf_counter() - start) * FLAGS.k / FLAGS.loop_k
+
+                scores = np.array([vectorized[name][0] for name in names])
+                _, vectorized_sig = compare_metrics(names, level_gold, level_metrics, corr, average_by, k=FLAGS.loop_k, seed=0)
+                _, looped_sig = rank_metrics(names, scores, samples, 0.05)
+                same = np.allclose(vectorized_sig, looped_sig)
+                print(f"{level}\t{corr}\t{average_by}\t{vectorized_time:.2f}\t{loop_time:.1f}\t{loop_time / vectorized_time:.0f}x\t{same}")
+
+
+if __name__ == "__main__":
+    app.run(main)
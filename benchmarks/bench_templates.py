@@ -0,0 +1,81 @@
+import time
+import pandas as pd
+from absl import app, flags
+from gemba.gemba_mqm_utils import TEMPLATE_GEMBA_MQM, compile_template, has_placeholders
+from gemba.gemba_esa import TEMPLATE_GEMBA_ESA_ERROR_SPANS, TEMPLATE_GEMBA_ESA_RANKING
+from gemba.prompt import prompts
+
+
+flags.DEFINE_list('rows', ['10000', '100000', '1000000'], 'Input sizes in segments.')
+flags.DEFINE_list('templates', ['GEMBA-MQM', 'GEMBA-ESA', 'GEMBA-ESA_ranking', 'GEMBA-DA', 'GEMBA-stars'], 'Templates to render.')
+flags.DEFINE_integer('apply_rows', 100000, 'DataFrame.apply is timed on at most this many rows and extrapolated above, 1M rows take minutes.')
+
+TEMPLATES = {
+    "GEMBA-MQM": TEMPLATE_GEMBA_MQM,
+    "GEMBA-ESA": TEMPLATE_GEMBA_ESA_ERROR_SPANS,
+    "GEMBA-ESA_ranking": TEMPLATE_GEMBA_ESA_RANKING,
+    **{method: prompts[method]["prompt"] for method in prompts},
+}
+
+
+def format_template(template, data):
+    """Rendering before templates were compiled: every turn is copied and formatted for every row"""
+    if isinstance(template, str):
+        return template.format(**data)
+    prompt = []
+    for conversation_turn in template:
+        p = conversation_turn.copy()
+        p['content'] = p['content'].format(**data)
+        prompt.append(p)
+    static_turns = 0
+    for conversation_turn in template:
+        if has_placeholders(conversation_turn['content']):
+            break
+        static_turns += 1
+    if 0 < static_turns < len(prompt) and prompt[static_turns - 1]['role'] != 'system':
+        prompt[static_turns - 1]['cache_control'] = {"type": "ephemeral"}
+    return prompt
+
+
+def frame(rows):
+    return pd.DataFrame({
+        "source_seg": [f"Source segment number {i}, long enough to look like a sentence." for i in range(rows)],
+        "target_seg": [f"Translated segment number {i}, about as long as its source." for i in range(rows)],
+        "reference_seg": [f"Reference segment number {i}." for i in range(rows)],
+        "source_lang": "English",
+        "target_lang": "Czech",
+        "error_spans": "No errors.",
+    })
+
+
+def shared_turns(rendered):
+    # turns held by the same dict in every prompt, i.e. stored once however many rows there are
+    if not rendered or isinstance(rendered[0], str):
+        return 0
+    return sum(all(prompt[i] is rendered[0][i] for prompt in rendered) for i in range(len(rendered[0])))
+
+
+def main(argv):
+    FLAGS = flags.FLAGS
+    print("template\trows\tapply s\tcompiled s\tspeedup\tshared turns\tidentical")
+    for rows in map(int, FLAGS.rows):
+        df = frame(rows)
+        for name in FLAGS.templates:
+            template = TEMPLATES[name]
+
+            start = time.perf_counter()
+            rendered = compile_template(template).render_columns(df)
+            compiled_time = time.perf_counter() - start
+
+            sample = df.iloc[:min(rows, FLAGS.apply_rows)]
+            start = time.perf_counter()
+            applied = sample.apply(lambda x: format_template(template, x), axis=1).tolist()
+            apply_time = (time.perf_counter() - start) * rows / len(sample)
+
+            identical = applied == rendered[:len(sample)]
+            print(f"{name}\t{rows}\t{apply_time:.2f}\t{compiled_time:.2f}\t{apply_time / compiled_time:.1f}x\t{shared_turns(rendered)}/{len(template) if isinstance(template, list) else 0}\t{identical}")
+            del rendered, applied
+
+
+if __name__ == "__main__":
+    app.run(main)
@@ -0,0 +1,75 @@
+import os
+import time
+import tempfile
+import tracemalloc
+from absl import app, flags
+from gemba.testset import Testset
+
+
+flags.DEFINE_integer('segments', 2000, 'Segments per file.')
+flags.DEFINE_integer('systems', 150, 'Number of systems.')
+flags.DEFINE_integer('references', 4, 'Number of references.')
+flags.DEFINE_integer('selected', 3, 'Systems of the filtered run.')
+
+
+def write_testset(basepath, segments, systems, references):
+    """Synthetic mt-metrics-eval layout with WMT-sized segments"""
+    dataset = f"{basepath}/bench"
+    for folder in ["sources", "references", "documents", "system-outputs/en-de"]:
+        os.makedirs(f"{dataset}/{folder}", exist_ok=True)
+    paths = ["sources/en-de.txt"] + [f"references/en-de.ref{chr(65 + r)}.txt" for r in range(references)]
+    paths += [f"system-outputs/en-de/system{s:03d}.txt" for s in range(systems)]
+    for path in paths:
+        with open(f"{dataset}/{path}", "w") as f:
+            f.write("".join(f"{path} segment {i}: " + "Ein Satz mit einigen Wörtern. " * 5 + "\n" for i in range(segments)))
+    with open(f"{dataset}/documents/en-de.docs", "w") as f:
+        f.write("".join(f"domain{i % 4}\tdoc{i // 10}\n" for i in range(segments)))
+
+
+def eager_load(basepath, index_dir):
+    # what Testset.load used to do: every file into a list of strings
+    testset = Testset(basepath, "bench", "en-de", index_dir=index_dir)
+    loaded = []
+    for segments in [testset.sources, testset.documents, *testset.references.values(), *testset.systems.values()]:
+        with open(segments.path, "r") as fh:
+            loaded.append([line.rstrip() for line in fh])
+    return loaded
+
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 2**20
+
+
+def main(argv):
+    FLAGS = flags.FLAGS
+    with tempfile.TemporaryDirectory() as basepath:
+        write_testset(basepath, FLAGS.segments, FLAGS.systems, FLAGS.references)
+        index_dir = f"{basepath}/offsets"
+        selected = [f"system{s:03d}" for s in range(FLAGS.selected)]
+
+        def iterate(testset):
+            for _ in testset.iterate_over_all(testset.main_ref):
+                pass
+
+        runs = [
+            ("eager, all files", lambda: eager_load(basepath, index_dir)),
+            ("lazy, open", lambda: Testset(basepath, "bench", "en-de", index_dir=index_dir).segments_count()),
+            ("lazy, iterate all systems, first run (builds the offsets)", lambda: iterate(Testset(basepath, "bench", "en-de", index_dir=index_dir))),
+            ("lazy, iterate all systems", lambda: iterate(Testset(basepath, "bench", "en-de", index_dir=index_dir))),
+            (f"lazy, iterate {FLAGS.selected} systems, 1 reference", lambda: iterate(Testset(basepath, "bench", "en-de", index_dir=index_dir, systems=selected, references=["refA"]))),
+        ]
+        print(f"{FLAGS.systems} systems, {FLAGS.references} references, {FLAGS.segments} segments")
+        print("run\tseconds\tpeak Python heap MB")
+        for name, fn in runs:
+            elapsed, peak = measure(fn)
+            print(f"{name}\t{elapsed:.3f}\t{peak:.1f}")
+
+
+if __name__ == "__main__":
+    app.run(main)
@@ -0,0 +1,300 @@
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# answers of the GEMBA-classes prompts
+CLASSES = ["No meaning preserved", "Some meaning preserved, but not understandable", "Some meaning preserved and understandable", "Most meaning preserved, minor issues", "Perfect translation"]
+
+# error spans drawn for MQM and ESA answers
+ERROR_TYPES = ["accuracy/mistranslation", "accuracy/omission", "fluency/grammar", "fluency/punctuation", "style/awkward", "terminology/inappropriate for context"]
+
+
+def last_user_text(body):
+    content = body["messages"][-1]["content"]
+    if isinstance(content, list):
+        return "".join(block.get("text", "") for block in content)
+    return content
+
+
+def error_spans(rng, target, severities):
+    words = target.split() or ["-"]
+    lines = []
+    for severity in severities:
+        lines.append(f"{severity}:")
+        count = rng.choice([0, 0, 1, 1, 2])
+        if count == 0:
+            lines.append("no-error")
+        for _ in range(count):
+            lines.append(f'{rng.choice(ERROR_TYPES)} - "{rng.choice(words)}"')
+    return "\n".join(lines) + "\n"
+
+
+def score_answer(rng, label):
+    if label.startswith("Stars"):
+        return rng.choice(["★★★", "★★★★", "4 stars", "five stars", "3"])
+    if label.startswith("Class"):
+        return rng.choice(CLASSES)
+    return str(rng.randint(0, 100))
+
+
+def gemba_answer(body):
+    """
+    Canned GEMBA-style answer to a request, deterministic in its prompt.
+
+    MQM prompts get critical/major/minor span lists, ESA error span prompts major/minor
+    span lists, score prompts a number, stars or a class depending on their answer label,
+    and packed prompts one "Item <number>: <answer>" line per item.
+    """
+    text = last_user_text(body)
+    rng = random.Random(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest())
+
+    packed = re.search(r'Answer with exactly one line per item in the form "Item <number>: <(.*?)>", for items 1 to (\d+)\.', text)
+    if packed is not None:
+        return "\n".join(f"Item {number}: {score_answer(rng, packed.group(1))}" for number in range(1, int(packed.group(2)) + 1))
+
+    target = text.rsplit("```", 2)[-2] if text.count("```") >= 2 else text
+    if "critical, major, and minor" in text:
+        return error_spans(rng, target, ["Critical", "Major", "Minor"])
+    if "major or minor" in text:
+        return error_spans(rng, target, ["Major", "Minor"])
+    return score_answer(rng, text.rstrip().rsplit("\n", 1)[-1])
+
+
+def lognormal_latency(median, sigma=0.5, straggler_rate=0.0, straggler_latency=3.0, seed=0):
+    """Latency callable for `FakeAnthropicServer`: lognormal around `median`, with a share of stragglers"""
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    def latency(body):
+        with lock:
+            if rng.random() < straggler_rate:
+                return straggler_latency
+            return rng.lognormvariate(0, sigma) * median
+    return latency
+
+
+class FakeAnthropicServer:
+    """
+    Local stand-in for the Anthropic Messages endpoint, used by the benchmarks.
+
+    Every request sleeps for `latency` seconds and returns `answer`, so the measured
+    throughput reflects how many requests the client keeps in flight. `latency` may be
+    a callable receiving the request body, e.g. to simulate stragglers.
+
+    `answer` may also be a callable receiving the request body, `gemba_answer` answers
+    every GEMBA prompt in its format. The Message Batches endpoints are served as well,
+    a batch ends `batch_delay` seconds after submission.
+
+    Throttling can be simulated either randomly (`throttle_rate` of 429s, `overload_rate`
+    of 529s) or with a real sliding-window `requests_per_minute` limit, which also
+    reports the anthropic-ratelimit-* headers on every response. `error_rate` of the
+    requests fail with a 500 api_error.
+    """
+
+    def __init__(self, latency=0.05, answer="85", host="127.0.0.1", port=0,
+                 throttle_rate=0.0, overload_rate=0.0, requests_per_minute=None, retry_after=1, seed=0, batch_delay=0.0, error_rate=0.0):
+        self.latency = latency
+        self.batch_delay = batch_delay
+        self.batches = {}
+        self.cached_prefixes = set()
+        self.answer = answer
+        self.throttle_rate = throttle_rate
+        self.overload_rate = overload_rate
+        self.error_rate = error_rate
+        self.requests_per_minute = requests_per_minute
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.window = deque()
+        self.requests = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                parts = self.path.split("?")[0].strip("/").split("/")
+                if parts[:3] != ["v1", "messages", "batches"] or len(parts) < 4 or parts[3] not in server.batches:
+                    self.send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": self.path}})
+                    return
+                if len(parts) == 5 and parts[4] == "results":
+                    data = "".join(json.dumps(line) + "\n" for line in server.batches[parts[3]]["results"]).encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("content-type", "application/binary")
+                    self.send_header("content-length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                    return
+                self.send_json(200, server.batch_object(parts[3]))
+
+            def do_POST(self):
+                length = int(self.headers.get("content-length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if self.path.split("?")[0] == "/v1/messages/batches":
+                    self.send_json(200, server.batch_object(server.submit_batch(body["requests"])))
+                    return
+                if self.path.split("?")[0] != "/v1/messages":
+                    self.send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": self.path}})
+                    return
+                status, headers = server.admit()
+                if status == 429:
+                    self.send_json(429, {"type": "error", "error": {"type": "rate_limit_error", "message": "Rate limited"}}, headers)
+                    return
+                if status == 529:
+                    self.send_json(529, {"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}}, headers)
+                    return
+                if status == 500:
+                    self.send_json(500, {"type": "error", "error": {"type": "api_error", "message": "Internal server error"}}, headers)
+                    return
+                time.sleep(server.latency(body) if callable(server.latency) else server.latency)
+                self.send_json(200, server.message(body), headers)
+
+            def send_json(self, status, payload, headers=None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    def admit(self):
+        """Decide whether a request is served, returns (status, headers)"""
+        with self.lock:
+            self.requests += 1
+            now = time.time()
+            headers = {}
+            status = 200
+
+            if self.requests_per_minute is not None:
+                while self.window and self.window[0] <= now - 60:
+                    self.window.popleft()
+                reset = self.window[0] + 60 if self.window else now + 60
+                if len(self.window) >= self.requests_per_minute:
+                    status = 429
+                    headers["retry-after"] = str(max(1, int(reset - now + 0.999)))
+                else:
+                    self.window.append(now)
+                headers["anthropic-ratelimit-requests-limit"] = str(self.requests_per_minute)
+                headers["anthropic-ratelimit-requests-remaining"] = str(max(0, self.requests_per_minute - len(self.window)))
+                headers["anthropic-ratelimit-requests-reset"] = datetime.fromtimestamp(reset, timezone.utc).isoformat().replace("+00:00", "Z")
+
+            if status == 200:
+                draw = self.random.random()
+                if draw < self.throttle_rate:
+                    status = 429
+                    headers["retry-after"] = str(self.retry_after)
+                elif draw < self.throttle_rate + self.overload_rate:
+                    status = 529
+                elif draw < self.throttle_rate + self.overload_rate + self.error_rate:
+                    status = 500
+
+            if status in (429, 529):
+                self.throttled += 1
+            return status, headers
+
+    def submit_batch(self, requests):
+        batch_id = f"msgbatch_{uuid.uuid4().hex}"
+        results = []
+        for request in requests:
+            with self.lock:
+                self.requests += 1
+            params = request["params"]
+            if not 0 <= params.get("temperature", 0) <= 1:
+                result = {"type": "errored", "error": {"type": "error", "error": {"type": "invalid_request_error", "message": "temperature: range: 0..1"}}}
+            else:
+                result = {"type": "succeeded", "message": self.message(params)}
+            results.append({"custom_id": request["custom_id"], "result": result})
+        with self.lock:
+            self.batches[batch_id] = {"created": time.time(), "results": results}
+        return batch_id
+
+    def batch_object(self, batch_id):
+        batch = self.batches[batch_id]
+        ended = time.time() >= batch["created"] + self.batch_delay
+        count = len(batch["results"])
+        timestamp = datetime.fromtimestamp(batch["created"], timezone.utc).isoformat()
+        return {
+            "id": batch_id,
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {"processing": 0 if ended else count, "succeeded": count if ended else 0, "errored": 0, "canceled": 0, "expired": 0},
+            "created_at": timestamp,
+            "expires_at": timestamp,
+            "ended_at": timestamp if ended else None,
+            "cancel_initiated_at": None,
+            "archived_at": None,
+            "results_url": f"{self.url}/v1/messages/batches/{batch_id}/results" if ended else None,
+        }
+
+    def usage(self, body):
+        """Token usage of a request, with prompt caching simulated on the marked prefix"""
+        blocks = list(body.get("system") or []) if isinstance(body.get("system"), list) else [body.get("system") or ""]
+        for turn in body.get("messages", []):
+            blocks.extend(turn["content"] if isinstance(turn["content"], list) else [turn["content"]])
+        sizes = [len(json.dumps(block, ensure_ascii=False)) // 4 for block in blocks]
+        marked = [i for i, block in enumerate(blocks) if isinstance(block, dict) and "cache_control" in block]
+
+        usage = {"input_tokens": sum(sizes), "output_tokens": 1, "cache_read_input_tokens": 0, "cache_creation_input_tokens": 0}
+        if marked:
+            prefix_end = marked[-1] + 1
+            prefix = json.dumps([body.get("model"), blocks[:prefix_end]], ensure_ascii=False)
+            prefix_tokens = sum(sizes[:prefix_end])
+            with self.lock:
+                hit = prefix in self.cached_prefixes
+                self.cached_prefixes.add(prefix)
+            usage["input_tokens"] -= prefix_tokens
+            usage["cache_read_input_tokens" if hit else "cache_creation_input_tokens"] = prefix_tokens
+        return usage
+
+    def message(self, body):
+        answer = self.answer(body) if callable(self.answer) else self.answer
+        usage = self.usage(body)
+        usage["output_tokens"] = max(1, len(answer) // 4)
+        return {
+            "id": f"msg_{uuid.uuid4().hex}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "fake"),
+            "content": [{"type": "text", "text": answer}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": usage,
+        }
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -1,6 +1,5 @@
 import sys
-from mt_metrics_eval import data
-from gemba.mtme_tools import eval_metrics
+from gemba.mtme_tools import eval_metrics, load_eval_set
 
 
 dataset = "wmt22"
@@ -8,18 +7,24 @@ focus_lps = ['en-de', 'en-ru', 'zh-en']
 FINAL_MODELS = []
 path = "scores/mt-metrics-eval-v2"
 
-eval_sets = {}
-for lp in focus_lps:
-    print(lp, file=sys.stderr)
-    eval_sets[lp] = data.EvalSet(dataset, lp, True, path=path)
 
-appraise_results = eval_metrics(
-    eval_sets, focus_lps, ['sys'], primary_only=False, k=0,
-    gold_name="mqm", include_domains=False, seg_level_no_avg=True,
-    include_human_with_acc=False)
-results = appraise_results[list(appraise_results.keys())[0]]
+def main():
+    eval_sets = {}
+    for lp in focus_lps:
+        print(lp, file=sys.stderr)
+        eval_sets[lp] = load_eval_set(dataset, lp, path)
 
-print(f"Accuracy results")
-for key in results.keys():
-    print(f"{key}\t{results[key][1]:.3f}")
+    appraise_results = eval_metrics(
+        eval_sets, focus_lps, ['sys'], primary_only=False, k=0,
+        gold_name="mqm", include_domains=False, seg_level_no_avg=True,
+        include_human_with_acc=False)
+    results = appraise_results[list(appraise_results.keys())[0]]
 
+    print("Accuracy results")
+    for key in results.keys():
+        print(f"{key}\t{results[key][1]:.3f}")
+
+
+# eval_metrics may start worker processes, which import this module again under spawn/forkserver
+if __name__ == "__main__":
+    main()
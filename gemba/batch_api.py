@@ -0,0 +1,212 @@
+import sys
+import time
+import itertools
+from contextlib import contextmanager
+from termcolor import colored
+from tqdm import tqdm
+from gemba.gpt_api import GptApi
+from gemba.dedup import dedup_prompts
+
+# Message Batches limit on the number of requests in one submission
+MAX_BATCH_REQUESTS = 100000
+
+# error types that fail the same way when resubmitted
+PERMANENT_ERRORS = ["invalid_request_error", "authentication_error", "permission_error", "not_found_error"]
+
+
+class AnthropicBatchTransport:
+    """
+    Transport talking to the Anthropic Message Batches API.
+
+    Any object with the same three methods can be passed to `BatchGptApi`, which is
+    how the backend is exercised against a local fake batch service.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def submit(self, requests):
+        """Submit a list of {"custom_id", "params"} requests and return the batch id"""
+        batch = self.client.messages.batches.create(requests=requests)
+        return batch.id
+
+    def is_done(self, batch_id):
+        batch = self.client.messages.batches.retrieve(batch_id)
+        return batch.processing_status == "ended"
+
+    def results(self, batch_id):
+        """
+        Yield (custom_id, answer, error_type) for every request of the batch;
+        answer is {"answer", "finish_reason", "usage"} when the request succeeded, otherwise None.
+        """
+        for entry in self.client.messages.batches.results(batch_id):
+            result = entry.result
+            if result.type == "succeeded":
+                message = result.message
+                yield entry.custom_id, {
+                    "answer": message.content[0].text.strip(),
+                    "finish_reason": message.stop_reason,
+                    "usage": message.usage,
+                }, None
+            elif result.type == "errored":
+                yield entry.custom_id, None, result.error.error.type
+            else:
+                # expired or canceled
+                yield entry.custom_id, None, result.type
+
+
+class BatchGptApi(GptApi):
+    """
+    Offline backend that scores prompts through Message Batches.
+
+    Prompts missing from the cache are packed into batch submissions, the batch is
+    polled until it ends and the answers go through the same parse_response validators
+    and cache as `GptApi.request`. Unparsable answers are resubmitted at the next
+    attempt of the retry schedule, transient errors at the same temperature, until `max_attempts`.
+    """
+
+    def __init__(self, verbose=False, api_key=None, base_url=None, transport=None, poll_interval=30, max_batch_requests=MAX_BATCH_REQUESTS, max_attempts=3, retry_schedule=None, rate_limiter=None,
+                 telemetry=None):
+        super().__init__(verbose=verbose, api_key=api_key, base_url=base_url, retry_schedule=retry_schedule, rate_limiter=rate_limiter, telemetry=telemetry)
+        self.transport = transport if transport is not None else AnthropicBatchTransport(self.client)
+        self.poll_interval = poll_interval
+        self.max_batch_requests = max_batch_requests
+        self.max_attempts = max_attempts
+
+    def run_batch(self, items, model, max_tokens):
+        """Submit items {custom_id: (prompt, temperature)} and return {custom_id: (answer, error_type)}"""
+        requests = [
+            {"custom_id": custom_id, "params": self.build_parameters(prompt, model, temperature, max_tokens)}
+            for custom_id, (prompt, temperature) in items.items()
+        ]
+
+        batch_ids = []
+        for start in range(0, len(requests), self.max_batch_requests):
+            batch_ids.append(self.transport.submit(requests[start:start + self.max_batch_requests]))
+        if self.verbose:
+            print(f"Submitted {len(requests)} requests in {len(batch_ids)} batches", file=sys.stderr)
+
+        results = {}
+        for batch_id in batch_ids:
+            while not self.transport.is_done(batch_id):
+                time.sleep(self.poll_interval)
+            for custom_id, answer, error_type in self.transport.results(batch_id):
+                results[custom_id] = (answer, error_type)
+        return results
+
+    def bulk_request_unique(self, prompts, model, parse_mqm_answer, cache, max_tokens=None, max_concurrent=None):
+        """
+        Process distinct prompts through Message Batches, `GptApi.bulk_request` deduplicates them
+
+        Args:
+            prompts: List of distinct prompts
+            model: Model to use for generation
+            parse_mqm_answer: Function to parse the responses
+            cache: Cache to use for storing responses
+            max_tokens: Maximum tokens for generation
+            max_concurrent: Unused, batches are processed server side
+
+        Returns:
+            List with the parsed answers of every prompt
+        """
+        results = [None] * len(prompts)
+        answer_ids = [-1] * len(prompts)
+        # position in the retry schedule and number of failed submissions of every prompt
+        schedule_attempts = [0] * len(prompts)
+        attempts = [0] * len(prompts)
+        pending = list(range(len(prompts)))
+
+        pbar = tqdm(total=len(prompts), desc="Processing prompts", file=sys.stderr)
+        # cache hits, parse outcomes and tokens are counted for the method of parse_mqm_answer
+        with self.telemetry.scope(parse_mqm_answer):
+            while pending:
+                # serve what we can from the cache, the rest goes into the next submission
+                to_submit = {}
+                for i in pending:
+                    temperature = self.retry_schedule.temperature(schedule_attempts[i])
+                    answers = self.lookup_answers(self.cache_key(prompts[i], model, temperature, max_tokens), model, schedule_attempts[i], cache)
+                    if answers is not None:
+                        self.accept(i, answers, prompts, model, parse_mqm_answer, results, answer_ids, schedule_attempts)
+                    else:
+                        to_submit[str(i)] = (prompts[i], temperature)
+
+                if to_submit:
+                    batch_results = self.run_batch(to_submit, model, max_tokens)
+                    for custom_id in to_submit:
+                        i = int(custom_id)
+                        answer, error_type = batch_results.get(custom_id, (None, "missing"))
+                        if answer is not None:
+                            usage = answer.pop("usage")
+                            self.record_usage(usage)
+                            self.telemetry.record_usage(model, usage)
+                            # compared with the local estimate as in `GptApi.report_success`, for the "Token estimates" summary
+                            self.record_estimate(usage, self.estimate_tokens(prompts[i], model, max_tokens))
+                            answers = self.collect_answers([answer])
+                            self.store_answers(self.cache_key(prompts[i], model, to_submit[custom_id][1], max_tokens), cache, answers)
+                            self.accept(i, answers, prompts, model, parse_mqm_answer, results, answer_ids, schedule_attempts)
+                            continue
+
+                        self.telemetry.count(model, "errors")
+                        attempts[i] += 1
+                        if error_type in PERMANENT_ERRORS or attempts[i] >= self.max_attempts:
+                            print(colored(f"Error, giving up on prompt {i}: {error_type}", "red"), file=sys.stderr)
+                            self.accept(i, [], prompts, model, parse_mqm_answer, results, answer_ids, schedule_attempts)
+
+                done = [i for i in pending if results[i] is not None]
+                pbar.update(len(done))
+                pending = [i for i in pending if results[i] is None]
+        pbar.close()
+        return results
+
+    @contextmanager
+    def attempt_runner(self, max_concurrent):
+        # requests run server side, there is nothing to run locally
+        yield None
+
+    def iter_tasks(self, tasks, window=None, ordered=True, max_concurrent=None, dedup=True, runner=None):
+        """
+        Stream tasks through Message Batches, `window` tasks (default: one full batch) at a time.
+
+        Answers of a window are yielded in input order once its batches ended, `ordered`,
+        `max_concurrent` and `runner` are accepted for compatibility with `GptApi.iter_tasks`.
+        """
+        window = window or self.max_batch_requests
+        tasks = iter(tasks)
+        start = 0
+        while True:
+            chunk = list(itertools.islice(tasks, window))
+            if not chunk:
+                return
+
+            # tasks sharing model, parser, cache and max_tokens are submitted together
+            groups = {}
+            for offset, (prompt, model, parse_response, cache, max_tokens) in enumerate(chunk):
+                groups.setdefault((model, id(parse_response), id(cache), max_tokens), []).append(offset)
+
+            results = [None] * len(chunk)
+            for offsets in groups.values():
+                _, model, parse_response, cache, max_tokens = chunk[offsets[0]]
+                prompts = [chunk[offset][0] for offset in offsets]
+                if dedup:
+                    unique_prompts, inverse = dedup_prompts(prompts)
+                    self.record_dedup(len(prompts), len(unique_prompts))
+                else:
+                    unique_prompts, inverse = prompts, list(range(len(prompts)))
+                answers = self.bulk_request_unique(unique_prompts, model, parse_response, cache, max_tokens=max_tokens)
+                for offset, position in zip(offsets, inverse):
+                    results[offset] = [dict(answer) for answer in answers[position]]
+
+            for offset, result in enumerate(results):
+                yield start + offset, result
+            start += len(chunk)
+
+    def accept(self, i, answers, prompts, model, parse_response, results, answer_ids, schedule_attempts):
+        """Parse the answers of prompt i, or schedule it for its next attempt"""
+        attempt = schedule_attempts[i]
+        parsed_answers, answer_ids[i] = self.parse_attempt(answers, prompts[i], model, parse_response, attempt, answer_ids[i])
+        if parsed_answers is not None:
+            results[i] = parsed_answers
+        elif self.retry_schedule.has_attempt(attempt + 1):
+            schedule_attempts[i] += 1
+        else:
+            results[i] = self.no_answer(prompts[i], model, self.retry_schedule.temperature(attempt), answer_ids[i])
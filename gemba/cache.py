@@ -0,0 +1,192 @@
+import os
+import glob
+import json
+import sqlite3
+import hashlib
+import diskcache as dc
+
+
+def canonical(value):
+    """Drop prompt-caching marks, they do not change the answer"""
+    if isinstance(value, dict):
+        value = {key: canonical(item) for key, item in value.items() if key != "cache_control"}
+        content = value.get("content")
+        # a turn marked for caching is sent as a single text block, key it like the plain string
+        if isinstance(content, list) and len(content) == 1 and set(content[0]) == {"type", "text"} and content[0]["type"] == "text":
+            value["content"] = content[0]["text"]
+        return value
+    if isinstance(value, (list, tuple)):
+        return [canonical(item) for item in value]
+    return value
+
+
+def request_digest(parameters):
+    """
+    Stable key of an API request: sha256 over the canonical JSON of the request parameters
+    (model, temperature, max_tokens, system prompt and messages).
+    """
+    data = json.dumps(canonical(parameters), sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+# eviction policies accepted on the command line, see diskcache.EVICTION_POLICY
+EVICTION_POLICIES = {
+    "none": "none",
+    "lru": "least-recently-used",
+    "lfu": "least-frequently-used",
+    "lrs": "least-recently-stored",
+}
+
+DEFAULT_STORE = "cache/responses"
+DEFAULT_SIZE_LIMIT = int(10e10)
+
+
+class ResponseCache:
+    """
+    Response cache keyed by `request_digest`.
+
+    A lookup is a single `get` on the underlying diskcache, and answers are stored
+    as compact (answer, finish_reason) tuples instead of the full request dict.
+    The cache is split into SQLite shards, so several scoring processes can use it at once.
+    """
+
+    def __init__(self, directory, shards=8, eviction="none", size_limit=DEFAULT_SIZE_LIMIT, timeout=60):
+        policy = EVICTION_POLICIES[eviction]
+        self.directory = directory
+        self.cache = dc.FanoutCache(
+            directory, shards=shards, timeout=timeout, size_limit=size_limit,
+            # without eviction nothing is ever culled, otherwise cull on every write like diskcache does
+            eviction_policy=policy, cull_limit=0 if policy == "none" else 10,
+        )
+
+    def get(self, key):
+        record = self.cache.get(key, retry=True)
+        if not record:
+            return None
+        return [{"answer": answer, "finish_reason": finish_reason} for answer, finish_reason in record]
+
+    def set(self, key, answers):
+        self.cache.set(key, tuple((answer["answer"], answer["finish_reason"]) for answer in answers), retry=True)
+
+    def __len__(self):
+        return len(self.cache)
+
+    def close(self):
+        self.cache.close()
+
+
+class ResponseStore:
+    """
+    Response store shared by all methods and runs.
+
+    Keys already contain the model and the full prompt, so methods that send the same
+    request (e.g. GEMBA-ESA error spans) share one entry. Every model gets its own sharded
+    cache under `directory`, which lets each model have its own quota; when a quota is
+    exceeded, entries are evicted by the configured policy.
+    """
+
+    def __init__(self, directory=DEFAULT_STORE, shards=8, eviction="none", size_limit=DEFAULT_SIZE_LIMIT, model_quotas=None):
+        if eviction not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown eviction policy {eviction}, use one of {list(EVICTION_POLICIES)}")
+        self.directory = directory
+        self.shards = shards
+        self.eviction = eviction
+        self.size_limit = size_limit
+        self.model_quotas = model_quotas or {}
+        self.caches = {}
+
+    def model_directory(self, model):
+        return os.path.join(self.directory, model.replace("/", "_"))
+
+    def for_model(self, model):
+        if model not in self.caches:
+            quota = self.model_quotas.get(model, self.size_limit)
+            self.caches[model] = ResponseCache(self.model_directory(model), shards=self.shards, eviction=self.eviction, size_limit=quota)
+        return self.caches[model]
+
+    def models(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory) if os.path.isdir(os.path.join(self.directory, name)))
+
+    def stats(self):
+        stats = {}
+        for model in self.models():
+            cache = self.for_model(model).cache
+            stats[model] = {
+                "entries": len(cache),
+                "bytes": cache.volume(),
+                "quota": self.model_quotas.get(model, self.size_limit),
+                "eviction": self.eviction,
+            }
+        return stats
+
+    def compact(self):
+        """Evict entries over quota, repair the shards and reclaim free pages; run it while no job writes"""
+        removed = {}
+        for model in self.models():
+            cache = self.for_model(model).cache
+            before = len(cache)
+            cache.cull(retry=True)
+            cache.check(fix=True, retry=True)
+            for shard in glob.glob(os.path.join(self.model_directory(model), "*", "cache.db")):
+                with sqlite3.connect(shard, timeout=60) as connection:
+                    connection.execute("VACUUM")
+            removed[model] = before - len(cache)
+        return removed
+
+    def export(self, output, model=None):
+        """Write every entry as a JSON line {"model", "key", "answers"}"""
+        count = 0
+        for name in ([model] if model else self.models()):
+            cache = self.for_model(name).cache
+            for key in cache:
+                record = cache.get(key, retry=True)
+                if record is None:
+                    continue
+                output.write(json.dumps({"model": name, "key": key, "answers": [list(answer) for answer in record]}, ensure_ascii=False) + "\n")
+                count += 1
+        return count
+
+    def close(self):
+        for cache in self.caches.values():
+            cache.close()
+
+
+def migrate(source, store, max_tokens, model=None, remove_old=False):
+    """
+    Import a per-method cache directory (cache/{model}_{method}) into the shared store.
+
+    Entries keyed by {"model", "temperature", "prompt"} dicts are re-keyed with `request_digest`
+    assuming `max_tokens`, a number or a function of the prompt (for caches shared by several
+    stages of a method); digest-keyed entries are copied to the store of `model`.
+    """
+    # imported here, gemba.gpt_api depends on this module
+    from gemba.gpt_api import build_parameters
+
+    if os.path.isfile(os.path.join(source, "cache.db")):
+        old = dc.Cache(source)
+    else:
+        old = dc.FanoutCache(source)
+
+    migrated = skipped = 0
+    for key in list(old):
+        answers = old.get(key)
+        if not answers:
+            skipped += 1
+            continue
+        if isinstance(key, dict) and {"model", "temperature", "prompt"} <= set(key):
+            budget = max_tokens(key["prompt"]) if callable(max_tokens) else max_tokens
+            parameters = build_parameters(key["prompt"], key["model"], key["temperature"], budget)
+            store.for_model(key["model"]).set(request_digest(parameters), answers)
+        elif isinstance(key, str) and model is not None:
+            # already a digest with compact records
+            store.for_model(model).cache.set(key, answers, retry=True)
+        else:
+            skipped += 1
+            continue
+        if remove_old:
+            del old[key]
+        migrated += 1
+
+    return migrated, skipped
@@ -0,0 +1,86 @@
+import os
+import sys
+from absl import app, flags
+from gemba.cache import ResponseStore, DEFAULT_STORE, EVICTION_POLICIES, migrate
+from gemba.tokens import OUTPUT_BUDGETS, prompt_budget
+
+USAGE = """Usage: python -m gemba.cache_cli <command> [flags]
+
+Commands:
+  stats     entries, size and quota of every model in the shared store
+  compact   evict entries over quota and reclaim disk space (run while no job is writing)
+  export    write all entries as JSON lines to --output (or stdout)
+  migrate   import a per-method cache directory, e.g. --source=cache/{model}_{method}
+"""
+
+flags.DEFINE_string('directory', DEFAULT_STORE, 'Directory of the shared response store.')
+flags.DEFINE_enum('eviction', "none", list(EVICTION_POLICIES), 'Eviction policy applied by compact.')
+flags.DEFINE_float('quota_gb', None, 'Quota of --model in GB, applied by compact.')
+flags.DEFINE_string('model', None, 'Model to export, or model of a digest-keyed source cache when migrating (default: inferred from the directory name).')
+flags.DEFINE_string('output', None, 'Output file of export.')
+flags.DEFINE_string('source', None, 'Cache directory to migrate, e.g. cache/{model}_{method}.')
+flags.DEFINE_integer('max_tokens', None, 'max_tokens to re-key the cached requests with (default: the current budget of the method, gemba.tokens.OUTPUT_BUDGETS).')
+flags.DEFINE_bool('remove_old', False, 'Remove migrated entries from the source cache.')
+
+
+def main(argv):
+    FLAGS = flags.FLAGS
+    if len(argv) < 2 or argv[1] not in ["stats", "compact", "export", "migrate"]:
+        print(USAGE, file=sys.stderr)
+        sys.exit(1)
+    command = argv[1]
+
+    quotas = {}
+    if FLAGS.quota_gb is not None:
+        assert FLAGS.model is not None, "A quota applies to the model given by --model."
+        quotas[FLAGS.model] = int(FLAGS.quota_gb * 1e9)
+    store = ResponseStore(FLAGS.directory, eviction=FLAGS.eviction, model_quotas=quotas)
+
+    if command == "stats":
+        total_entries = total_bytes = 0
+        print("model\tentries\tMB\tquota MB")
+        for model, stats in store.stats().items():
+            print(f"{model}\t{stats['entries']}\t{stats['bytes'] / 1e6:.1f}\t{stats['quota'] / 1e6:.0f}")
+            total_entries += stats["entries"]
+            total_bytes += stats["bytes"]
+        print(f"total\t{total_entries}\t{total_bytes / 1e6:.1f}\t")
+
+    elif command == "compact":
+        for model, removed in store.compact().items():
+            print(f"{model}: evicted {removed} entries")
+
+    elif command == "export":
+        if FLAGS.output is None:
+            count = store.export(sys.stdout, FLAGS.model)
+        else:
+            with open(FLAGS.output, "w") as f:
+                count = store.export(f, FLAGS.model)
+        print(f"Exported {count} entries.", file=sys.stderr)
+
+    elif command == "migrate":
+        assert FLAGS.source is not None, "Source cache directory must be provided."
+        if not os.path.isdir(FLAGS.source):
+            print(f"Cache directory {FLAGS.source} does not exist.")
+            sys.exit(1)
+
+        # per-method caches were named cache/{model}_{method}, all methods start with GEMBA
+        name = os.path.basename(os.path.normpath(FLAGS.source))
+        model = FLAGS.model if FLAGS.model is not None else name.rsplit("_GEMBA", 1)[0]
+
+        max_tokens = FLAGS.max_tokens
+        if max_tokens is None:
+            # the answers were requested with 500 tokens (the default of 1024 for GEMBA-ESA), they are
+            # re-keyed with the current budget of the method so that scoring runs find them; the
+            # GEMBA-ESA cache holds both stages, each entry gets the budget of its stage
+            method = "GEMBA" + name.rsplit("_GEMBA", 1)[-1]
+            if method not in OUTPUT_BUDGETS:
+                print(f"Cannot infer the method of {FLAGS.source}, pass --max_tokens.")
+                sys.exit(1)
+            max_tokens = lambda prompt: prompt_budget(method, prompt)
+
+        migrated, skipped = migrate(FLAGS.source, store, max_tokens, model, FLAGS.remove_old)
+        print(f"Migrated {migrated} entries from {FLAGS.source} to {FLAGS.directory}, skipped {skipped}.")
+
+
+if __name__ == "__main__":
+    app.run(main)
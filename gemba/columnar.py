@@ -0,0 +1,148 @@
+import fcntl
+import os
+import numpy as np
+import pandas as pd
+
+# sidecar directory next to the TSVs, hidden so mt-metrics-eval does not list it as scores
+COLUMNAR_FOLDER = ".columnar"
+
+
+class ScoreColumn:
+    """
+    Values of one `system<TAB>value` TSV, with the systems as runs of consecutive lines.
+
+    `values` is memory-mapped from the sidecar when it was read from disk; `system_values`
+    returns views into it, copies only for a system whose lines are not consecutive.
+    """
+
+    def __init__(self, systems, counts, values):
+        self.systems = systems
+        self.counts = counts
+        self.values = values
+        self.starts = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    def __len__(self):
+        return len(self.values)
+
+    def by_system(self):
+        """Map from system to its values, in the order systems first appear"""
+        result = {}
+        for system, start, end in zip(self.systems, self.starts[:-1].tolist(), self.starts[1:].tolist()):
+            if system in result:
+                result[system] = np.concatenate([result[system], self.values[start:end]])
+            else:
+                result[system] = self.values[start:end]
+        return result
+
+
+class ColumnStore:
+    """
+    Compiled sidecars of the metric-scores TSVs of one folder (one language pair).
+
+    Every `system<TAB>value` file (`*.seg.score`, `*.sys.score`, `*.seg.meta`) is parsed once
+    into `.columnar/<file>.values.npy`, one float32 column (float64 when a value would not
+    survive float32 exactly), and `.columnar/<file>.runs.npy` with the size and modification
+    time of the TSV followed by (system id, line count) runs. System ids point into
+    `.columnar/systems.txt`, a dictionary shared by all files of the folder and only ever
+    appended to. A sidecar of another version of the TSV is rebuilt, an unwritable one is
+    kept in memory only.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.columnar_folder = os.path.join(folder, COLUMNAR_FOLDER)
+        self.systems = []
+        self.system_ids = {}
+
+    def sidecar_paths(self, path):
+        name = os.path.join(self.columnar_folder, os.path.basename(path))
+        return f"{name}.values.npy", f"{name}.runs.npy"
+
+    def load(self, path):
+        """ScoreColumn of a TSV in the folder, None if the file does not exist"""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        column = self.load_sidecar(path, stat)
+        if column is None:
+            column = self.build(path, stat)
+        return column
+
+    def load_all(self, suffix=".seg.score"):
+        """ScoreColumns of every file of the folder ending with `suffix`, by file name without the suffix"""
+        names = sorted(name for name in os.listdir(self.folder) if name.endswith(suffix))
+        return {name[:-len(suffix)]: self.load(os.path.join(self.folder, name)) for name in names}
+
+    def load_sidecar(self, path, stat):
+        values_path, runs_path = self.sidecar_paths(path)
+        try:
+            runs = np.load(runs_path)
+            values = np.load(values_path, mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        # the first two values identify the TSV the sidecar was built from
+        if len(runs) < 2 or runs[0] != stat.st_size or runs[1] != stat.st_mtime_ns:
+            return None
+        ids, counts = runs[2::2], runs[3::2]
+        if counts.sum() != len(values):
+            return None
+        if len(ids) and ids.max() >= len(self.systems):
+            self.read_systems()
+            if ids.max() >= len(self.systems):
+                return None
+        return ScoreColumn([self.systems[i] for i in ids.tolist()], counts, values)
+
+    def build(self, path, stat):
+        df = pd.read_csv(path, sep="\t", names=["system", "value"], index_col=False, dtype={"system": str}, keep_default_na=False)
+        # None placeholders and unparsable answers become NaN, as in Scores
+        values = pd.to_numeric(df["value"], errors="coerce").to_numpy(dtype=np.float64)
+        if np.array_equal(values.astype(np.float32).astype(np.float64), values, equal_nan=True):
+            values = values.astype(np.float32)
+
+        system_names = df["system"].to_numpy(dtype=object)
+        boundaries = np.flatnonzero(system_names[1:] != system_names[:-1]) + 1
+        starts = np.concatenate([[0], boundaries]).astype(np.int64) if len(system_names) else np.zeros(0, dtype=np.int64)
+        counts = np.diff(np.append(starts, len(system_names)))
+        systems = [system_names[start] for start in starts.tolist()]
+
+        try:
+            ids = self.add_systems(systems)
+            runs = np.concatenate([[stat.st_size, stat.st_mtime_ns], np.column_stack([ids, counts]).ravel()]).astype(np.int64)
+            values_path, runs_path = self.sidecar_paths(path)
+            # values first, runs last: runs that match the TSV always describe the values next to them
+            for sidecar, array in [(values_path, values), (runs_path, runs)]:
+                with open(f"{sidecar}.tmp", "wb") as f:
+                    np.save(f, array)
+                os.replace(f"{sidecar}.tmp", sidecar)
+        except OSError:
+            # read-only data, the column is kept in memory only
+            pass
+        return ScoreColumn(systems, counts, values)
+
+    def dictionary_path(self):
+        return os.path.join(self.columnar_folder, "systems.txt")
+
+    def read_systems(self):
+        try:
+            with open(self.dictionary_path(), encoding="utf-8") as f:
+                self.systems = f.read().split("\n")[:-1]
+        except FileNotFoundError:
+            self.systems = []
+        self.system_ids = {system: i for i, system in enumerate(self.systems)}
+
+    def add_systems(self, systems):
+        """Ids of the systems, new ones are appended to the dictionary under a lock shared with other processes"""
+        if any(system not in self.system_ids for system in systems):
+            os.makedirs(self.columnar_folder, exist_ok=True)
+            with open(self.dictionary_path(), "a", encoding="utf-8") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    self.read_systems()
+                    new = [system for system in dict.fromkeys(systems) if system not in self.system_ids]
+                    f.write("".join(f"{system}\n" for system in new))
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+            self.read_systems()
+        return np.array([self.system_ids[system] for system in systems], dtype=np.int64)
@@ -0,0 +1,112 @@
+import json
+import asyncio
+import threading
+
+
+def prompt_key(prompt):
+    # prompts are strings or lists of turns, which are not hashable
+    if isinstance(prompt, str):
+        return prompt
+    return json.dumps(prompt, sort_keys=True, ensure_ascii=False)
+
+
+def dedup_prompts(prompts):
+    """
+    Collapse identical rendered prompts.
+
+    Returns (unique_prompts, inverse) where prompts[i] == unique_prompts[inverse[i]].
+    """
+    unique_prompts = []
+    positions = {}
+    inverse = []
+    for prompt in prompts:
+        key = prompt_key(prompt)
+        if key not in positions:
+            positions[key] = len(unique_prompts)
+            unique_prompts.append(prompt)
+        inverse.append(positions[key])
+    return unique_prompts, inverse
+
+
+def fan_out(results, inverse):
+    """Flatten the per-prompt results of the unique prompts back into one answer list per original prompt"""
+    all_answers = []
+    for position in inverse:
+        # copies, so later changes to one answer do not leak into its duplicates
+        all_answers.extend(dict(answer) for answer in results[position])
+    return all_answers
+
+
+class SingleFlight:
+    """
+    Run at most one call per key at a time across threads.
+
+    A caller arriving while the same key is in flight waits for that call and
+    gets its result (or its exception) instead of running it again.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        # number of callers served by a call already in flight
+        self.shared = 0
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            if call is None:
+                call = {"done": threading.Event(), "result": None, "error": None}
+                self.calls[key] = call
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+
+        try:
+            call["result"] = fn()
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call["done"].set()
+
+
+class AsyncSingleFlight:
+    """`SingleFlight` for coroutines running on one event loop"""
+
+    def __init__(self):
+        self.calls = {}
+        self.shared = 0
+
+    async def do(self, key, fn):
+        future = self.calls.get(key)
+        if future is not None:
+            self.shared += 1
+            # shielded, a cancelled follower must not cancel the call of the others
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.calls[key] = future
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # retrieved here, otherwise asyncio warns when no follower was waiting
+            future.exception()
+            raise
+        finally:
+            del self.calls[key]
@@ -1,62 +1,205 @@
-import diskcache as dc
+import os
+import sys
+from absl import app, flags
+from tqdm import tqdm
+from gemba.cache import ResponseStore
 from gemba.prompt import prompts, language_codes
-from gemba.gpt_api import GptApi
+from gemba.gpt_api import GptApi, AsyncGptApi
+from gemba.rate_limiter import RateLimiter, RateCoordinator
+from gemba.shards import parse_shard, shard_of, shard_name
+from gemba.tokens import output_budget
+from gemba.telemetry import Telemetry
 from gemba.testset import Testset
 from gemba.scores import Scores
+from gemba.sampling import SequentialSampler
 
+flags.DEFINE_enum('backend', "async", ["threads", "async"], 'Execution backend shared by all scenarios.')
+flags.DEFINE_integer('max_concurrent', 32, 'Requests in flight over all scenarios.')
+flags.DEFINE_integer('window', None, 'Segments read ahead of the results (default: 4x --max_concurrent).')
+flags.DEFINE_string('mtme_path', "mt-metrics-eval-v2", 'Path of the mt-metrics-eval data.')
+flags.DEFINE_string('shard', None, 'Score only shard i/N of the segments (e.g. 0/4), written under <mtme_path>/shards.')
+flags.DEFINE_integer('merge_shards', None, 'Merge the scores of N finished shards into the metric-scores instead of scoring.')
+flags.DEFINE_string('coordinator', None, 'SQLite database through which all shards of the API key split its rate budget.')
+flags.DEFINE_integer('requests_per_minute', None, 'Requests-per-minute budget of the API key (default: adopted from the rate-limit headers).')
+flags.DEFINE_integer('tokens_per_minute', None, 'Tokens-per-minute budget of the API key (default: adopted from the rate-limit headers).')
+flags.DEFINE_integer('input_tokens_per_minute', None, 'Input-tokens-per-minute budget of the API key (default: adopted from the rate-limit headers).')
+flags.DEFINE_integer('output_tokens_per_minute', None, 'Output-tokens-per-minute budget of the API key (default: adopted from the rate-limit headers).')
+flags.DEFINE_string('telemetry', None, 'JSON-lines file receiving every telemetry event (cache hits, latencies, tokens, ...).')
+flags.DEFINE_integer('metrics_port', None, 'Serve the telemetry in the Prometheus text format on http://127.0.0.1:<port>/metrics.')
+flags.DEFINE_bool('sampling', False, 'Score segments in randomized rounds and stop once the order of every system pair is significant.')
+flags.DEFINE_integer('sampling_round', 100, 'Segments per system in every round of --sampling.')
+flags.DEFINE_float('sampling_confidence', 0.95, 'Confidence level at which --sampling takes the order of a system pair as settled.')
+flags.DEFINE_integer('sampling_min_segments', 200, 'Common segments a system pair needs before --sampling tests its order.')
+flags.DEFINE_integer('sampling_seed', 0, 'Seed of the segment order of --sampling, keep it to resume a sampled run.')
 
-def main():
+
+def shard_path(shard):
+    # outside the testsets, so mt-metrics-eval does not take the partial scores for metrics
+    return os.path.join(flags.FLAGS.mtme_path, "shards", shard_name(shard))
+
+
+def main(argv):
+    FLAGS = flags.FLAGS
     scenarios = [
         ["text-davinci-003", "GEMBA-DA", [["wmt22", "en-de"], ["wmt22", "zh-en"], ["wmt22", "en-ru"]], ],
         ["text-davinci-003", "GEMBA-DA_ref", [["wmt22", "en-de"], ["wmt22", "zh-en"], ["wmt22", "en-ru"]], ],
     ]
 
-    gptapi = GptApi()
-    for scenario in scenarios:
-        use_model = scenario[0]
-        annotation = scenario[1]
-        cache = dc.Cache(f'cache/{use_model}_{annotation}', expire=None, size_limit=int(10e10), cull_limit=0, eviction_policy='none')
-
-        scoring_name = f"{annotation}_{use_model}"
+    if FLAGS.merge_shards:
+        merge_shards(scenarios, FLAGS.merge_shards)
+        return
+    shard = parse_shard(FLAGS.shard)
+    if FLAGS.sampling and shard is not None:
+        raise Exception("--sampling cannot be combined with --shard, the sampler needs the scores of all systems.")
 
-        if use_model not in credentials["deployments"].keys():
-            print(f"Model {use_model} not supported by credentials")
-            continue
+    # one engine and rate limiter for every scenario, so they share the concurrency and the API quota
+    coordinator = RateCoordinator(FLAGS.coordinator) if FLAGS.coordinator else None
+    rate_limiter = RateLimiter(requests_per_minute=FLAGS.requests_per_minute, tokens_per_minute=FLAGS.tokens_per_minute,
+                               input_tokens_per_minute=FLAGS.input_tokens_per_minute, output_tokens_per_minute=FLAGS.output_tokens_per_minute,
+                               max_concurrent=FLAGS.max_concurrent, coordinator=coordinator)
+    # the scenarios share the engine, their methods are told apart by their answer validators
+    telemetry = Telemetry(FLAGS.telemetry)
+    for annotation in {annotation for _, annotation, _ in scenarios}:
+        telemetry.name_method(prompts[annotation]["validate_answer"], annotation)
+    if FLAGS.metrics_port:
+        telemetry.serve(FLAGS.metrics_port)
+    if FLAGS.backend == "async":
+        gptapi = AsyncGptApi(max_concurrent=FLAGS.max_concurrent, rate_limiter=rate_limiter, telemetry=telemetry)
+    else:
+        gptapi = GptApi(num_workers=FLAGS.max_concurrent, rate_limiter=rate_limiter, telemetry=telemetry)
+    store = ResponseStore()
 
-        for dataset, lp in scenario[2]:
-            testset = Testset("mt-metrics-eval-v2", dataset, lp)
+    # every (scenario, lp, system, segment) still missing a score goes into one work queue
+    jobs = []
+    for use_model, annotation, datasets in scenarios:
+        scoring_name = f"{annotation}_{use_model}"
+        for dataset, lp in datasets:
+            testset = Testset(FLAGS.mtme_path, dataset, lp)
             if prompts[annotation]["use_ref"]:
                 refname = testset.main_ref
             else:
                 refname = None
 
             scores = Scores(scoring_name, testset, refname)
+            missing = sum(int(scores.missing_mask(system).sum()) for system in testset.systems)
+            # a shard writes its own scores, segments merged from earlier runs are skipped as well
+            merged = None
+            if shard is not None:
+                merged = scores
+                scores = Scores(scoring_name, testset, refname, output_path=shard_path(shard))
+                # the size of a shard is only known once the segments have been hashed
+                missing = None
+            sampler = None
+            if FLAGS.sampling:
+                sampler = SequentialSampler(testset.systems, len(testset.sources), round_size=FLAGS.sampling_round, confidence=FLAGS.sampling_confidence,
+                                            min_segments=FLAGS.sampling_min_segments, seed=FLAGS.sampling_seed)
+                # how many segments get sampled is only known at the end
+                missing = None
+            jobs.append({
+                "model": use_model, "annotation": annotation,
+                "testset": testset, "refname": refname, "scores": scores, "merged": merged, "cache": store.for_model(use_model), "sampler": sampler,
+                "progress": tqdm(total=missing, desc=f"{scoring_name} {dataset}/{lp}", position=len(jobs), file=sys.stderr),
+            })
+
+    # where the answer of every task in flight belongs, by task index
+    destinations = {}
+
+    def segment_task(job, src, hyp, ref):
+        lp = job["testset"].lp
+        annotation = job["annotation"]
+        data = {
+            "source_seg": src,
+            "target_seg": hyp,
+            "reference_seg": ref,
+            "source_lang": language_codes[lp.split("-")[0]],
+            "target_lang": language_codes[lp.split("-")[1]],
+        }
+        prompt = prompts[annotation]["prompt"].format(**data)
+        return prompt, job["model"], prompts[annotation]["validate_answer"], job["cache"], output_budget(annotation)
 
+    def tasks():
+        task = 0
+        for job in jobs:
+            testset = job["testset"]
+            lp = testset.lp
             # starts with -1 as it is incremented before the first request
             hypothesis_index = -1
-            total = testset.segments_count()
-            for src, hyp, ref, system in testset.iterate_over_all(refname):
+            for src, hyp, ref, system in testset.iterate_over_all(job["refname"]):
                 hypothesis_index += 1
 
-                if scores.get_score(system, hypothesis_index) != 'None':
+                if job["scores"].has_score(system, hypothesis_index):
                     continue
+                if shard is not None:
+                    if job["merged"].has_score(system, hypothesis_index) or shard_of(f"{lp}\t{src}\t{hyp}\t{ref}", shard[1]) != shard[0]:
+                        continue
 
-                print(f"Processing hypothesis {hypothesis_index}/{total} for {scoring_name} on {dataset}/{lp}")
+                destinations[task] = (job, system, hypothesis_index)
+                task += 1
+                yield segment_task(job, src, hyp, ref)
 
-                data = {
-                    "source_seg": src,
-                    "target_seg": hyp,
-                    "reference_seg": ref,
-                    "source_lang": language_codes[lp.split("-")[0]],
-                    "target_lang": language_codes[lp.split("-")[1]],
-                }
-                prompt = prompts[annotation]["prompt"].format(**data)
-                parsed_answers = gptapi.request(prompt, use_model, prompts[annotation]["validate_answer"], cache=cache)
+    def sampled_tasks(selection):
+        # segments picked by the samplers, read by index
+        for task, (job, system, index) in enumerate(selection):
+            testset = job["testset"]
+            ref = testset.references[job["refname"]][index] if job["refname"] is not None else None
+            destinations[task] = (job, system, index)
+            yield segment_task(job, testset.sources[index], testset.systems[system][index], ref)
 
-                scores.assign_score(system, hypothesis_index, parsed_answers[0]['answer'], parsed_answers[0]['temperature'])
+    def score(task_iter):
+        for task, parsed_answers in gptapi.iter_tasks(task_iter, window=FLAGS.window, ordered=False):
+            job, system, hypothesis_index = destinations.pop(task)
+            job["scores"].assign_score(system, hypothesis_index, parsed_answers[0]['answer'], parsed_answers[0]['temperature'])
+            job["progress"].update(1)
 
+    try:
+        if FLAGS.sampling:
+            # the rounds of all scenarios are scored together, every sampler decides on its next round once this one is done
+            while not all(job["sampler"].done for job in jobs):
+                running = [job for job in jobs if not job["sampler"].done]
+                score(sampled_tasks([(job, system, index) for job in running for system, index in job["sampler"].next_round(job["scores"])]))
+                for job in running:
+                    job["sampler"].update(job["scores"])
+        else:
+            score(tasks())
+    finally:
+        # on an error or Ctrl-C the scores since the last checkpoint go to the delta log, only the requests in flight are lost
+        for job in jobs:
+            job["scores"].checkpoint()
+        telemetry.close()
+        if coordinator is not None:
+            coordinator.close()
+
+    for job in jobs:
+        job["progress"].close()
+        job["scores"].save()
+        if job["sampler"] is not None:
+            job["sampler"].save(job["scores"])
+            print(f"{job['progress'].desc}: {job['sampler'].summary_line(job['scores'])}", file=sys.stderr)
+
+    if shard is not None:
+        print(f"Shard {FLAGS.shard} done. Once all shards are done, merge them with --merge_shards={shard[1]}.", file=sys.stderr)
+
+    print(f"Token usage: {gptapi.usage_summary()}", file=sys.stderr)
+    print(f"Token estimates: {gptapi.estimate_summary()}", file=sys.stderr)
+    print(f"Telemetry:\n{telemetry.summary()}", file=sys.stderr)
+    print(f"Deduplication: {gptapi.dedup_summary()}", file=sys.stderr)
+
+
+def merge_shards(scenarios, count):
+    """Merge the scores written by `count` shards into the metric-scores of every scenario"""
+    FLAGS = flags.FLAGS
+    for use_model, annotation, datasets in scenarios:
+        scoring_name = f"{annotation}_{use_model}"
+        for dataset, lp in datasets:
+            testset = Testset(FLAGS.mtme_path, dataset, lp)
+            refname = testset.main_ref if prompts[annotation]["use_ref"] else None
+            scores = Scores(scoring_name, testset, refname)
+            for index in range(count):
+                scores.merge(Scores(scoring_name, testset, refname, output_path=shard_path((index, count))))
             scores.save()
+            missing = sum(int(scores.missing_mask(system).sum()) for system in testset.systems)
+            print(f"{scoring_name} {dataset}/{lp}: merged {count} shards, {missing} segments still missing", file=sys.stderr)
 
 
 if __name__ == '__main__':
-    main()
+    app.run(main)
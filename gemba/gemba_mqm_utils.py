@@ -1,20 +1,109 @@
 import ipdb
 import json
 import re
+import string
+import numpy as np
+from functools import lru_cache
 from collections import defaultdict
 
-def apply_template(template, data):
-    if isinstance(template, str):
-        return template.format(**data)
-    elif isinstance(template, list):
-        prompt = []
+
+def has_placeholders(text):
+    return any(field is not None for _, field, _, _ in string.Formatter().parse(text))
+
+
+def positional_format(text):
+    """`text` as a format string with positional fields, and the names of its fields in order"""
+    parts = []
+    fields = []
+    for literal, field, format_spec, conversion in string.Formatter().parse(text):
+        parts.append(literal.replace("{", "{{").replace("}", "}}"))
+        if field is not None:
+            parts.append("{" + str(len(fields)) + ("!" + conversion if conversion else "") + (":" + format_spec if format_spec else "") + "}")
+            fields.append(field)
+    return "".join(parts), fields
+
+
+class CompiledTemplate:
+    """
+    A template split once into the parts shared by every segment and the parts filled per segment.
+
+    The leading turns without placeholders (the few-shot prefix) are rendered at compile time
+    and the same dicts are shared by every prompt, they must not be modified. The remaining
+    turns are formatted per segment from positional format strings. `render` gives the same
+    prompt as formatting the template with a row, `render_columns` renders whole columns.
+    """
+
+    def __init__(self, template):
+        if isinstance(template, str):
+            self.format, self.fields = positional_format(template)
+            self.static = None
+            self.dynamic = []
+            return
+        if not isinstance(template, list):
+            raise ValueError(f"Unknown template type {type(template)}")
+
+        static_turns = 0
         for conversation_turn in template:
+            if has_placeholders(conversation_turn['content']):
+                break
+            static_turns += 1
+
+        self.static = []
+        for conversation_turn in template[:static_turns]:
+            p = conversation_turn.copy()
+            # a literal brace is written doubled in a template, also in turns without placeholders
+            p['content'] = p['content'].format()
+            self.static.append(p)
+        # the few-shot turns before the first segment-specific turn are identical for every
+        # segment, mark the end of that prefix so the API can cache it between requests
+        if 0 < static_turns < len(template) and self.static[-1]['role'] != 'system':
+            self.static[-1]['cache_control'] = {"type": "ephemeral"}
+
+        self.dynamic = []
+        self.fields = []
+        for conversation_turn in template[static_turns:]:
+            content, fields = positional_format(conversation_turn['content'])
+            # each turn reads its fields from a slice of the combined field list
+            self.dynamic.append((conversation_turn, content, len(self.fields), len(self.fields) + len(fields)))
+            self.fields += fields
+
+    def build(self, values):
+        if self.static is None:
+            return self.format.format(*values)
+        prompt = self.static.copy()
+        for conversation_turn, content, start, end in self.dynamic:
             p = conversation_turn.copy()
-            p['content'] = p['content'].format(**data)
+            p['content'] = content.format(*values[start:end])
             prompt.append(p)
         return prompt
-    else:
-        raise ValueError(f"Unknown template type {type(template)}")
+
+    def render(self, data):
+        return self.build([data[field] for field in self.fields])
+
+    def render_columns(self, columns):
+        """Prompts for every row of a DataFrame or a dict of equally long columns"""
+        # plain lists, indexing pandas columns per row costs more than formatting
+        values = [columns[field].tolist() if hasattr(columns[field], "tolist") else list(columns[field]) for field in self.fields]
+        if not values:
+            rows = len(columns) if hasattr(columns, "index") else len(next(iter(columns.values()), []))
+            return [self.build([]) for _ in range(rows)]
+        if self.static is None:
+            return list(map(self.format.format, *values))
+        return [self.build(row) for row in zip(*values)]
+
+
+def compile_template(template):
+    # keyed by content, a template that is edited or built on the fly is compiled again
+    return compile_serialized_template(json.dumps(template))
+
+
+@lru_cache(maxsize=256)
+def compile_serialized_template(serialized):
+    return CompiledTemplate(json.loads(serialized))
+
+
+def apply_template(template, data):
+    return compile_template(template).render(data)
 
 def parse_broken_json(x):
     improved_translation = ""
@@ -45,38 +134,118 @@ def parse_broken_json(x):
     return {"improved translation": improved_translation, "errors": errors}
 
 
+# error categories and their subclasses, a later subclass wins over an earlier one
+ERROR_CLASSES = [
+    ("accuracy", ["addition", "mistranslation", "omission", "untranslated text"]),
+    ("fluency", ["character encoding", "grammar", "inconsistency", "punctuation", "register", "spelling"]),
+    ("locale convention", ["currency", "date", "name", "telephone", "time"]),
+    ("style", []),
+    ("terminology", ["inappropriate", "inconsistent"]),
+    ("non-translation", []),
+    ("other", []),
+]
+
+ERROR_LEVELS = ['critical', 'major', 'minor']
+# points of an error by level, at most MAX_COUNTED_ERRORS errors count and the total is capped at MAX_PENALTY
+ERROR_WEIGHTS = {'critical': 25, 'major': 5, 'minor': 1}
+MAX_COUNTED_ERRORS = 5
+MAX_PENALTY = 25
+
+NEWLINES = re.compile(r'\n+')
+# lines of an error section that are not errors
+NOT_AN_ERROR = re.compile("|".join(re.escape(phrase) for phrase in [
+    "no-error",
+    "no error",
+    "the translation appears to be",
+    "it correctly conveys",
+    "the grammar and terminology",
+    "there are no obvious errors",
+]))
+
+
 def parse_error_class(error):
     # parse error from error description, errors are ['accuracy', 'fluency', 'locale convention', 'style', 'terminology', 'non-translation', 'other']
     #  locale convention (currency, date, name, telephone, or time format), style (awkward), terminology (inappropriate for context, inconsistent use),
-    class_name = "unknown"
-    if "accuracy" in error:
-        class_name = "accuracy"
-        for subclass in ["addition", "mistranslation", "omission", "untranslated text"]:
-            if subclass in error:
-                class_name = f"accuracy-{subclass}"
-    elif "fluency" in error:
-        class_name = "fluency"
-        for subclass in ["character encoding", "grammar", "inconsistency", "punctuation", "register", "spelling"]:
-            if subclass in error:
-                class_name = f"fluency-{subclass}"
-    elif "locale convention" in error:
-        class_name = "locale convention"
-        for subclass in ["currency", "date", "name", "telephone", "time"]:
-            if subclass in error:
-                class_name = f"locale convention-{subclass}"
-    elif "style" in error:
-        class_name = "style"
-    elif "terminology" in error:
-        class_name = "terminology"
-        for subclass in ["inappropriate", "inconsistent"]:
-            if subclass in error:
-                class_name = f"terminology-{subclass}"
-    elif "non-translation" in error:
-        class_name = "non-translation"
-    elif "other" in error:
-        class_name = "other"
-
-    return class_name
+    for category, subclasses in ERROR_CLASSES:
+        if category in error:
+            class_name = category
+            for subclass in subclasses:
+                if subclass in error:
+                    class_name = f"{category}-{subclass}"
+            return class_name
+
+    return "unknown"
+
+
+def parse_error_sections(x):
+    """Split a lowercased "Critical:/Major:/Minor:" answer into (errors, section_errors) by level"""
+    errors = {'critical': [], 'major': [], 'minor': []}
+    error_level = None
+    section_errors = {
+        'critical': False,
+        'major': False,
+        'minor': False
+    }
+
+    # Split by any number of consecutive newlines
+    for line in NEWLINES.split(x):
+        line = line.strip()
+
+        if not line:
+            continue
+
+        if line.endswith(':'):
+            current_section = line[:-1]
+            if current_section in errors:
+                error_level = current_section
+            continue
+
+        if error_level is not None:
+            if NOT_AN_ERROR.search(line) is not None:
+                continue
+
+            if "non-translation" in line:
+                errors["critical"].append(line)
+                section_errors['critical'] = True
+            else:
+                errors[error_level].append(line)
+                section_errors[error_level] = True
+
+    return errors, section_errors
+
+
+def mqm_penalty(errors, section_errors):
+    final_score = 0
+    error_counter = 0
+    for error_level in ERROR_LEVELS:
+        if not section_errors[error_level]:
+            continue
+        for _ in errors[error_level]:
+            if error_counter >= MAX_COUNTED_ERRORS:
+                break
+            final_score += ERROR_WEIGHTS[error_level]
+            error_counter += 1
+    return min(final_score, MAX_PENALTY)
+
+
+def mqm_errors(x):
+    """(errors, section_errors) of an answer, either "Critical:/Major:/Minor:" sections or JSON"""
+    if not x.startswith('{"improved translation"'):
+        return parse_error_sections(x.lower())
+
+    try:
+        answer = json.loads(x)
+    except:
+        answer = parse_broken_json(x)
+    errors = {error_level: answer["errors"].get(error_level, []) for error_level in ERROR_LEVELS}
+    return errors, {error_level: len(errors[error_level]) > 0 for error_level in ERROR_LEVELS}
+
+
+@lru_cache(maxsize=65536)
+def mqm_score(x):
+    """Score and per-level error counts of an answer, cached as the same answers come back many times"""
+    errors, section_errors = mqm_errors(x)
+    return -mqm_penalty(errors, section_errors), *(len(errors[error_level]) for error_level in ERROR_LEVELS)
 
 
 def parse_mqm_answer(x, list_mqm_errors=False, full_desc=True):
@@ -84,88 +253,35 @@ def parse_mqm_answer(x, list_mqm_errors=False, full_desc=True):
         return None
 
     x = str(x)
-    if x.startswith('{"improved translation"'):
-        try:
-            x = json.loads(x)
-        except:
-            x = parse_broken_json(x)
-        errors = x["errors"]
-    else:
-        x = x.lower()
-        errors = {'critical': [], 'major': [], 'minor': []}
-        error_level = None
-        section_errors = {
-            'critical': False,
-            'major': False,
-            'minor': False
-        }
-        
-        # Split by any number of consecutive newlines
-        import re
-        lines = re.split(r'\n+', x)
-        
-        for line in lines:
-            line = line.strip()
-            
-            if not line:
-                continue
-                
-            if line.endswith(':'):
-                current_section = line[:-1].lower()
-                if current_section in ['critical', 'major', 'minor']:
-                    error_level = current_section
-                continue
-            
-            if error_level is not None:
-                if "no-error" in line or "no error" in line:
-                    continue
-                
-                if any(phrase in line for phrase in [
-                    "the translation appears to be",
-                    "it correctly conveys",
-                    "the grammar and terminology",
-                    "there are no obvious errors"
-                ]):
-                    continue
-                    
-                if "non-translation" in line:
-                    errors["critical"].append(line)
-                    section_errors['critical'] = True
-                elif line:
-                    errors[error_level].append(line)
-                    section_errors[error_level] = True
+    if not list_mqm_errors:
+        return mqm_score(x)[0]
 
+    errors, _ = mqm_errors(x)
     error_classes = defaultdict(list)
-    final_score = 0
-    error_counter = 0
-    
-    for error_level in ['critical', 'major', 'minor']:
-        if error_level not in errors:
-            continue
-            
+    for error_level in ERROR_LEVELS:
         for error in errors[error_level]:
-            if error_counter < 5 and not list_mqm_errors and section_errors[error_level]:
-                if error_level == 'critical':
-                    final_score += 25
-                elif error_level == 'major':
-                    final_score += 5
-                else:
-                    final_score += 1
-                error_counter += 1
-
-            if full_desc:
-                error_classes[error_level].append(error)
-            else:
-                class_name = parse_error_class(error)
-                error_classes[error_level].append(class_name)
-                    
-    if final_score > 25:
-        final_score = 25
-
-    if list_mqm_errors:
-        return error_classes
-    else:
-        return -final_score
+            error_classes[error_level].append(error if full_desc else parse_error_class(error))
+    return error_classes
+
+
+def parse_mqm_answers(answers):
+    """
+    Score many MQM answers at once, e.g. to re-score the answers of a response store.
+
+    Repeated answers are parsed once (see `mqm_score`). Returns numpy arrays: "score" (as `parse_mqm_answer`,
+    NaN where the answer is None) and "critical", "major", "minor" with the number of errors
+    of every answer on each level.
+    """
+    count = len(answers)
+    scores = np.full(count, np.nan)
+    counts = {error_level: np.zeros(count, dtype=np.int32) for error_level in ERROR_LEVELS}
+    for i, x in enumerate(answers):
+        if x is None:
+            continue
+        scores[i], *levels = mqm_score(str(x))
+        for error_level, errors_on_level in zip(ERROR_LEVELS, levels):
+            counts[error_level][i] = errors_on_level
+    return {"score": scores, **counts}
 
 def mqm_fewshot(few_shots):
     prompts = [
@@ -1,51 +1,203 @@
 import sys
 import time
+import asyncio
 import threading
 import queue
+import warnings
+from contextlib import contextmanager, nullcontext
 from concurrent.futures import ThreadPoolExecutor
 from termcolor import colored
 from tqdm import tqdm
-from anthropic import Anthropic
+from anthropic import Anthropic, AsyncAnthropic, APIConnectionError, APIStatusError, RateLimitError
+from gemba.rate_limiter import RateLimiter
+from gemba.retry_scheduler import RetrySchedule
+from gemba.cache import request_digest
+from gemba.tokens import estimate_input_tokens
+from gemba.telemetry import Telemetry
+from gemba.dedup import prompt_key, dedup_prompts, fan_out, SingleFlight, AsyncSingleFlight
+
+# statuses worth retrying besides 5xx: timeout, rate limited, overloaded
+TRANSIENT_STATUS_CODES = (408, 429, 529)
+
+SYSTEM_PROMPT = "You are an expert buddhist annotator for the quality of machine translation. Your task is to identify errors and assess the quality of the translation."
+
+
+def build_parameters(prompt, model, temperature, max_tokens):
+    # single-string templates (GEMBA-DA, GEMBA-SQM, ...) are sent as one user turn
+    if isinstance(prompt, str):
+        prompt = [{"role": "user", "content": prompt}]
+
+    # the system prompt is identical for every request, mark it as a cacheable prefix;
+    # system turns of a template (GEMBA-ESA) are not allowed in messages and join it
+    system = [{"type": "text", "text": SYSTEM_PROMPT}]
+    messages = []
+    for turn in prompt:
+        if turn["role"] == "system":
+            system.append({"type": "text", "text": turn["content"]})
+        elif "cache_control" in turn:
+            # the API expects cache_control on a content block, not on the turn
+            messages.append({"role": turn["role"], "content": [{"type": "text", "text": turn["content"], "cache_control": turn["cache_control"]}]})
+        else:
+            messages.append(turn)
+    system[-1]["cache_control"] = {"type": "ephemeral"}
+
+    return {
+        "model": model,
+        "temperature": temperature,
+        "max_tokens": max_tokens if max_tokens else 1024,  # Default to 1024 tokens
+        "system": system,
+        "messages": messages,
+    }
+
+
+def is_transient(e):
+    """Whether a failed call may succeed when repeated; anything else (bad requests, bugs) is raised right away"""
+    # APITimeoutError is an APIConnectionError
+    if isinstance(e, (APIConnectionError, RateLimitError, TimeoutError)):
+        return True
+    if isinstance(e, APIStatusError):
+        return e.status_code in TRANSIENT_STATUS_CODES or e.status_code >= 500
+    return False
+
 
 class GptApi:
-    def __init__(self, verbose=False, num_workers=4):
+    def __init__(self, verbose=False, num_workers=4, api_key=None, base_url=None, rate_limiter=None, retry_schedule=None, telemetry=None):
         self.verbose = verbose
         self.num_workers = num_workers
-        self.client = Anthropic(
-            api_key=""
-        )
+        # temperatures used for prompts whose answer does not parse
+        self.retry_schedule = retry_schedule if retry_schedule is not None else RetrySchedule()
+        # api_key=None falls back to the ANTHROPIC_API_KEY environment variable
+        self.api_key = api_key
+        self.base_url = base_url
+        # the limiter can be shared between several GptApi instances to share one quota
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter(max_concurrent=num_workers)
+        # counters and latencies by model and method, can be shared like the rate limiter
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        self.client = self.create_client()
         # Thread-local storage to create separate clients per thread
         self.thread_local = threading.local()
+        # token usage of this run, including prompt-cache reads and writes
+        self.usage_lock = threading.Lock()
+        self.usage = {"requests": 0, "input_tokens": 0, "output_tokens": 0, "cache_read_input_tokens": 0, "cache_creation_input_tokens": 0}
+        # pre-flight estimates reserved with the rate limiter against the usage reported back
+        self.estimates = {"requests": 0, "estimated_input_tokens": 0, "input_tokens": 0, "reserved_output_tokens": 0, "output_tokens": 0}
+        # identical prompts are sent once per bulk request, concurrent identical requests once at all
+        self.dedup = {"prompts": 0, "unique": 0}
+        self.single_flight = SingleFlight()
+
+    def create_client(self):
+        # retries are handled by the rate limiter, which needs to see every 429/529
+        return Anthropic(api_key=self.api_key, base_url=self.base_url, max_retries=0)
 
     def get_client(self):
         """Get a thread-local client to ensure thread safety"""
         if not hasattr(self.thread_local, "client"):
-            self.thread_local.client = Anthropic(
-                api_key=""
-            )
+            self.thread_local.client = self.create_client()
         return self.thread_local.client
 
     # Single request method (existing functionality)
-    def request(self, prompt, model, parse_response, temperature=0, answer_id=-1, cache=None, max_tokens=None):
-        request = {"model": model, "temperature": temperature, "prompt": prompt}
+    def request(self, prompt, model, parse_response, attempt=0, answer_id=-1, cache=None, max_tokens=None, temperature=None):
+        if temperature is not None:
+            warnings.warn("GptApi.request(temperature=...) is deprecated, pass the attempt of the retry schedule instead",
+                          DeprecationWarning, stacklevel=2)
+            attempt = self.retry_schedule.attempt_for(temperature)
 
-        if cache and request in cache and cache[request] is not None and len(cache[request]) > 0:
-            answers = cache[request]
-        else:
+        # attempts follow the retry schedule, each one at a higher temperature
+        while True:
+            parsed_answers, answer_id = self.request_attempt(prompt, model, parse_response, attempt, answer_id, cache, max_tokens)
+            if parsed_answers is not None:
+                return parsed_answers
+            attempt += 1
+            if not self.retry_schedule.has_attempt(attempt):
+                return self.no_answer(prompt, model, self.retry_schedule.temperature(attempt - 1), answer_id)
+
+    def request_attempt(self, prompt, model, parse_response, attempt, answer_id, cache, max_tokens):
+        """
+        Run one attempt of the retry schedule for a prompt.
+
+        Returns (parsed_answers, answer_id); parsed_answers is None when the answer did not parse
+        and the prompt should be scheduled for its next attempt.
+        """
+        with self.telemetry.scope(parse_response):
+            temperature = self.retry_schedule.temperature(attempt)
+            key = self.cache_key(prompt, model, temperature, max_tokens)
+            answers = self.lookup_answers(key, model, attempt, cache)
+            if answers is None:
+                answers = self.single_flight.do(key, lambda: self.fetch_answers(key, prompt, model, temperature, max_tokens, cache))
+
+            return self.parse_attempt(answers, prompt, model, parse_response, attempt, answer_id)
+
+    def fetch_answers(self, key, prompt, model, temperature, max_tokens, cache):
+        # a duplicate in flight may have stored the answer since our lookup
+        answers = self.cached_answers(key, cache)
+        if answers is None:
             answers = self.request_api(prompt, model, temperature, max_tokens)
-            if cache:
-                cache[request] = answers
+            self.store_answers(key, cache, answers)
+        return answers
 
+    def cache_key(self, prompt, model, temperature, max_tokens):
+        """Digest of everything that is sent to the API, prompt-caching marks excluded"""
+        return request_digest(self.build_parameters(prompt, model, temperature, max_tokens))
+
+    def lookup_answers(self, key, model, attempt, cache):
+        """`cached_answers` of an attempt, counted in the telemetry"""
+        self.telemetry.count(model, "attempts")
+        if attempt > 0:
+            self.telemetry.count(model, "escalations")
+        answers = self.cached_answers(key, cache)
+        self.telemetry.count(model, "cache_misses" if answers is None else "cache_hits")
+        return answers
+
+    def cached_answers(self, key, cache):
+        # a single lookup, empty answers are not served from the cache
+        if cache is None:
+            return None
+        answers = cache.get(key)
+        if not answers:
+            return None
+        return answers
+
+    def store_answers(self, key, cache, answers):
+        if cache is not None:
+            cache.set(key, answers)
+
+    def parse_attempt(self, answers, prompt, model, parse_response, attempt, answer_id):
+        temperature = self.retry_schedule.temperature(attempt)
+        parsed_answers, answer_id = self.parse_answers(answers, prompt, model, parse_response, temperature, answer_id)
+        if parsed_answers is None:
+            outcome = "unparsed"
+        elif len(answers) == 0:
+            outcome = "no_answer"
+        else:
+            outcome = "parsed"
+        self.retry_schedule.record(attempt, outcome)
+        self.telemetry.count(model, outcome)
+        # answers cut off by max_tokens, a budget too small for the method shows up here
+        truncated = sum(1 for answer in answers if answer["finish_reason"] == "max_tokens")
+        if truncated:
+            self.telemetry.count(model, "truncated", truncated)
+        return parsed_answers, answer_id
+
+    def no_answer(self, prompt, model, temperature, answer_id, finish_reason=None):
+        return [{
+            "temperature": temperature,
+            "answer_id": answer_id,
+            "answer": None,
+            "prompt": prompt,
+            "finish_reason": finish_reason,
+            "model": model,
+        }]
+
+    def parse_answers(self, answers, prompt, model, parse_response, temperature, answer_id):
+        """
+        Parse raw API answers, shared by the threaded and the asyncio engines.
+
+        Returns (parsed_answers, answer_id); parsed_answers is None when the answers
+        exist but none of them parsed, which means the caller should retry at a higher temperature.
+        """
         # there is no valid answer
         if len(answers) == 0:
-            return [{
-                "temperature": temperature,
-                "answer_id": answer_id,
-                "answer": None,
-                "prompt": prompt,
-                "finish_reason": None,
-                "model": model,
-            }]
+            return self.no_answer(prompt, model, temperature, answer_id), answer_id
 
         parsed_answers = []
         for full_answer in answers:
@@ -68,52 +220,82 @@ class GptApi:
                 }
             )
 
-        # there was no valid answer, increase temperature and try again
         if len(parsed_answers) == 0:
-            return self.request(prompt, model, parse_response, temperature=temperature + 1, answer_id=answer_id, cache=cache)
+            return None, answer_id
 
-        return parsed_answers
+        return parsed_answers, answer_id
 
-    # Process a single prompt in a worker thread
-    def process_single_prompt(self, prompt, model, parse_response, temperature, max_tokens, cache):
+    # Process one attempt of a prompt in a worker thread
+    def process_single_prompt(self, prompt, model, parse_response, attempt, answer_id, max_tokens, cache):
         try:
-            results = self.request(prompt, model, parse_response, temperature, cache=cache, max_tokens=max_tokens)
-            return results
+            return self.request_attempt(prompt, model, parse_response, attempt, answer_id, cache, max_tokens)
         except Exception as e:
-            print(colored(f"Error processing prompt: {e}", "red"), file=sys.stderr)
-            return [{
-                "temperature": temperature,
-                "answer_id": -1,
-                "answer": None,
-                "prompt": prompt,
-                "finish_reason": "error",
-                "model": model,
-                "error": str(e)
-            }]
+            return self.error_answer(prompt, model, attempt, e), answer_id
 
-    def request_api(self, prompt, model, temperature=0, max_tokens=None):
-        if temperature > 10:
-            return []
+    def error_answer(self, prompt, model, attempt, e):
+        print(colored(f"Error processing prompt: {e}", "red"), file=sys.stderr)
+        answer = self.no_answer(prompt, model, self.retry_schedule.temperature(attempt), -1, finish_reason="error")
+        answer[0]["error"] = str(e)
+        return answer
 
+    def request_api(self, prompt, model, temperature=0, max_tokens=None):
         client = self.get_client()
-        
+        estimated_tokens = self.estimate_tokens(prompt, model, max_tokens)
+
+        attempt = 0
         while True:
+            queued = time.monotonic()
+            self.rate_limiter.acquire(*estimated_tokens)
+            self.telemetry.observe(model, "queue_wait", time.monotonic() - queued)
             try:
-                response = self.call_api(prompt, model, temperature, max_tokens, client)
+                response = self.call_api(prompt, model, temperature, max_tokens, client, estimated_tokens)
                 break
             except Exception as e:
-                # response was filtered
-                if hasattr(e, 'code'):
-                    if e.code == 'content_filter':
-                        return []
-                    print(e.code, file=sys.stderr)
-                if hasattr(e, 'error') and e.error['code'] == 'invalid_model_output':
+                self.telemetry.count(model, "errors")
+                if self.is_filtered(e):
                     return []
+                if not is_transient(e):
+                    raise
 
                 # frequent error is reaching the API limit
-                print(colored(f"Error, retrying in 1s: {str(e)}", "red"), file=sys.stderr)
-                time.sleep(1)
+                delay = self.retry_delay(e, attempt)
+                if delay is None:
+                    return []
+            finally:
+                self.rate_limiter.release()
+
+            # the slot is free during the backoff, as in the asyncio engine
+            self.telemetry.count(model, "retries")
+            time.sleep(delay)
+            attempt += 1
+
+        return self.collect_answers(response)
+
+    def retry_delay(self, e, attempt):
+        """Backoff before the next attempt of a transient error, or None once the retry budget is exhausted"""
+        delay = self.rate_limiter.on_error(e, attempt)
+        if delay is None:
+            print(colored(f"Error, giving up after {attempt + 1} attempts: {str(e)}", "red"), file=sys.stderr)
+        else:
+            print(colored(f"Error, retrying in {delay:.1f}s: {str(e)}", "red"), file=sys.stderr)
+        return delay
+
+    def estimate_tokens(self, prompt, model, max_tokens):
+        """(input, output) tokens reserved against the tokens-per-minute budgets, corrected once usage is known"""
+        parameters = self.build_parameters(prompt, model, 0, max_tokens)
+        return estimate_input_tokens(parameters), parameters["max_tokens"]
 
+    def is_filtered(self, e):
+        # response was filtered
+        if hasattr(e, 'code'):
+            if e.code == 'content_filter':
+                return True
+            print(e.code, file=sys.stderr)
+        if hasattr(e, 'error') and e.error['code'] == 'invalid_model_output':
+            return True
+        return False
+
+    def collect_answers(self, response):
         answers = []
 
         answers.append({
@@ -127,20 +309,88 @@ class GptApi:
 
         return answers
 
-    def call_api(self, prompt, model, temperature, max_tokens, client=None):
+    def build_parameters(self, prompt, model, temperature, max_tokens):
+        return build_parameters(prompt, model, temperature, max_tokens)
+
+    def call_api(self, prompt, model, temperature, max_tokens, client=None, estimated_tokens=(0, 0)):
         if client is None:
             client = self.get_client()
             
-        parameters = {
-            "model": model,
-            "temperature": temperature,
-            "max_tokens": max_tokens if max_tokens else 1024,  # Default to 1024 tokens
-            "system": "You are an expert buddhist annotator for the quality of machine translation. Your task is to identify errors and assess the quality of the translation.",
-            "messages": prompt,
-        }
+        parameters = self.build_parameters(prompt, model, temperature, max_tokens)
 
-        response = client.messages.create(**parameters)
+        # the raw response exposes the rate-limit headers
+        started = time.monotonic()
+        self.telemetry.count(model, "api_calls")
+        raw_response = client.messages.with_raw_response.create(**parameters)
+        response = raw_response.parse()
+        self.telemetry.observe(model, "latency", time.monotonic() - started)
+        self.report_success(raw_response.headers, response, estimated_tokens, model)
         
+        return self.extract_answer(response)
+
+    def report_success(self, headers, response, estimated_tokens, model):
+        usage = getattr(response, "usage", None)
+        tokens_used = None
+        if usage is not None:
+            self.record_usage(usage)
+            self.telemetry.record_usage(model, usage)
+            self.record_estimate(usage, estimated_tokens)
+            # cache reads do not count against the input tokens budget, cache writes do
+            tokens_used = (usage.input_tokens + (getattr(usage, "cache_creation_input_tokens", None) or 0), usage.output_tokens)
+        self.rate_limiter.on_success(headers, tokens_used, estimated_tokens)
+
+    def record_usage(self, usage):
+        with self.usage_lock:
+            self.usage["requests"] += 1
+            for key in ["input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens"]:
+                # cache fields are missing or None when prompt caching was not involved
+                self.usage[key] += getattr(usage, key, None) or 0
+
+    def record_estimate(self, usage, estimated_tokens):
+        estimated_input, reserved_output = estimated_tokens
+        input_tokens = usage.input_tokens + (getattr(usage, "cache_read_input_tokens", None) or 0) + (getattr(usage, "cache_creation_input_tokens", None) or 0)
+        with self.usage_lock:
+            self.estimates["requests"] += 1
+            self.estimates["estimated_input_tokens"] += estimated_input
+            self.estimates["input_tokens"] += input_tokens
+            self.estimates["reserved_output_tokens"] += reserved_output
+            self.estimates["output_tokens"] += usage.output_tokens
+
+    def estimate_summary(self):
+        with self.usage_lock:
+            estimates = dict(self.estimates)
+        input_ratio = estimates["estimated_input_tokens"] / estimates["input_tokens"] if estimates["input_tokens"] else 0
+        output_used = estimates["output_tokens"] / estimates["reserved_output_tokens"] if estimates["reserved_output_tokens"] else 0
+        return (f"{estimates['requests']} requests, input tokens: {estimates['estimated_input_tokens']} estimated, "
+                f"{estimates['input_tokens']} actual ({input_ratio:.2f}x), output tokens: {estimates['reserved_output_tokens']} reserved, "
+                f"{estimates['output_tokens']} used ({output_used:.1%} of the reservation)")
+
+    def usage_summary(self):
+        with self.usage_lock:
+            usage = dict(self.usage)
+        total_input = usage["input_tokens"] + usage["cache_read_input_tokens"] + usage["cache_creation_input_tokens"]
+        cached = usage["cache_read_input_tokens"] / total_input if total_input else 0
+        return (f"{usage['requests']} requests, input tokens: {usage['input_tokens']} uncached, "
+                f"{usage['cache_read_input_tokens']} cache reads, {usage['cache_creation_input_tokens']} cache writes "
+                f"({cached:.1%} read from cache), output tokens: {usage['output_tokens']}")
+
+    def record_dedup(self, prompts, unique):
+        with self.usage_lock:
+            self.dedup["prompts"] += prompts
+            self.dedup["unique"] += unique
+
+    def shared_in_flight(self):
+        return self.single_flight.shared
+
+    def dedup_summary(self):
+        with self.usage_lock:
+            dedup = dict(self.dedup)
+        duplicates = dedup["prompts"] - dedup["unique"]
+        ratio = duplicates / dedup["prompts"] if dedup["prompts"] else 0
+        return (f"{dedup['prompts']} prompts, {dedup['unique']} unique, {duplicates} duplicates ({ratio:.1%} deduplicated), "
+                f"{self.shared_in_flight()} requests shared with an identical one in flight")
+
+    def extract_answer(self, response):
         answer = response.content[0].text.strip()  # Extract response correctly
 
         return [{
@@ -148,10 +398,14 @@ class GptApi:
             "finish_reason": response.stop_reason,  # Correct key for Claude's API
         }]
     
-    # Concurrent processing using ThreadPoolExecutor
     def bulk_request(self, df, model, parse_mqm_answer, cache, max_tokens=None, max_concurrent=None):
         """
         Process a dataframe of prompts using concurrent threading
+
+        Identical prompts (e.g. systems producing the same translation) are requested once
+        and their answers are copied to every row. Prompts whose answer does not parse are put
+        back into the work queue for their next attempt of the retry schedule, so they do not
+        block a worker meanwhile.
         
         Args:
             df: Dataframe containing prompts
@@ -164,8 +418,17 @@ class GptApi:
         Returns:
             List of parsed answers
         """
-        all_answers = []
-        prompts = df["prompt"].tolist()
+        prompts = df["prompt"].tolist() if hasattr(df, "prompt") else list(df)
+        unique_prompts, inverse = dedup_prompts(prompts)
+        self.record_dedup(len(prompts), len(unique_prompts))
+
+        results = self.bulk_request_unique(unique_prompts, model, parse_mqm_answer, cache, max_tokens=max_tokens, max_concurrent=max_concurrent)
+        return fan_out(results, inverse)
+
+    # Concurrent processing using ThreadPoolExecutor
+    def bulk_request_unique(self, prompts, model, parse_mqm_answer, cache, max_tokens=None, max_concurrent=None):
+        """Process distinct prompts, returns the list of parsed answers of every prompt"""
+        results = [None] * len(prompts)
         
         if not max_concurrent:
             max_concurrent = self.num_workers
@@ -175,28 +438,148 @@ class GptApi:
         
         # Create a shared progress bar
         pbar = tqdm(total=len(prompts), desc="Processing prompts", file=sys.stderr)
-        
-        # Use ThreadPoolExecutor for concurrent processing
-        with ThreadPoolExecutor(max_workers=max_concurrent) as executor:
-            # Create a list to store all the futures
-            futures = []
-            
-            # Submit all tasks to the executor
-            for i, prompt in enumerate(prompts):
-                future = executor.submit(
-                    self.process_single_prompt,
-                    prompt, model, parse_mqm_answer, 0, max_tokens, cache
-                )
-                futures.append(future)
-            
-            # Process results as they complete
-            for future in futures:
-                result = future.result()
-                all_answers.extend(result)
-                pbar.update(1)
+
+        # everything is in memory already, so the window spans all prompts
+        answers = self.iter_request(prompts, model, parse_mqm_answer, cache, max_tokens=max_tokens, window=max(len(prompts), 1), ordered=False, max_concurrent=max_concurrent, dedup=False)
+        for i, parsed_answers in answers:
+            results[i] = parsed_answers
+            pbar.update(1)
         
         pbar.close()
-        return all_answers
+        return results
+
+    @contextmanager
+    def attempt_runner(self, max_concurrent):
+        """Provide a function running one attempt of a prompt in the background, it returns a concurrent.futures.Future"""
+        executor = ThreadPoolExecutor(max_workers=max_concurrent)
+        try:
+            yield lambda *args: executor.submit(self.process_single_prompt, *args)
+        finally:
+            # attempts not started yet are dropped when the consumer stops early
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def iter_request(self, prompts, model, parse_response, cache, max_tokens=None, window=None, ordered=True, max_concurrent=None, dedup=True):
+        """
+        Stream prompts from an iterable and yield (index, parsed_answers) as they complete
+
+        At most `window` prompts are read ahead of the consumer: in flight, waiting for their
+        next attempt, or (in ordered mode) done but waiting for an earlier prompt. Memory stays
+        constant however long the input is. A prompt identical to one in flight takes no worker
+        and gets a copy of its answers. Prompts whose answer does not parse go back into
+        the work queue for their next attempt of the retry schedule.
+
+        Args:
+            prompts: Iterable of prompts, read lazily
+            model: Model to use for generation
+            parse_response: Function to parse the responses
+            cache: Cache to use for storing responses
+            max_tokens: Maximum tokens for generation
+            window: Maximum number of prompts read but not yielded yet (default: 4x max_concurrent)
+            ordered: Yield in input order, otherwise as soon as a prompt is done
+            max_concurrent: Maximum number of concurrent requests (default: self.num_workers)
+            dedup: Share answers between identical prompts in the window
+
+        Yields:
+            (index of the prompt, list of parsed answers)
+        """
+        tasks = ((prompt, model, parse_response, cache, max_tokens) for prompt in prompts)
+        return self.iter_tasks(tasks, window=window, ordered=ordered, max_concurrent=max_concurrent, dedup=dedup)
+
+    def iter_tasks(self, tasks, window=None, ordered=True, max_concurrent=None, dedup=True, runner=None):
+        """
+        `iter_request` for prompts that do not share a model or parser, e.g. a work queue spanning several scenarios
+
+        Args:
+            tasks: Iterable of (prompt, model, parse_response, cache, max_tokens) tuples, read lazily
+            window, ordered, max_concurrent, dedup: as in `iter_request`
+            runner: Attempt runner from `attempt_runner`, pipeline stages passing the same runner
+                share its concurrency budget (default: a new runner of max_concurrent)
+
+        Yields:
+            (index of the task, list of parsed answers)
+        """
+        if not max_concurrent:
+            max_concurrent = self.num_workers
+        if not window:
+            window = 4 * max_concurrent
+        tasks = iter(tasks)
+
+        # completed attempts are reported through this queue as (index, attempt, future)
+        completed = queue.Queue()
+        # tasks read but not yielded yet, and answers waiting for earlier tasks in ordered mode
+        in_window = {}
+        finished = {}
+        next_read = 0
+        next_yield = 0
+        exhausted = False
+        # requested prompts by key, and the duplicates waiting for each of them
+        leaders = {}
+        keys = {}
+        followers = {}
+        unique = 0
+
+        with self.attempt_runner(max_concurrent) if runner is None else nullcontext(runner) as run_attempt:
+            def submit(i, attempt, answer_id):
+                prompt, model, parse_response, cache, max_tokens = in_window[i]
+                future = run_attempt(prompt, model, parse_response, attempt, answer_id, max_tokens, cache)
+                future.add_done_callback(lambda f: completed.put((i, attempt, f)))
+
+            try:
+                while True:
+                    while not exhausted and len(in_window) < window:
+                        try:
+                            task = next(tasks)
+                        except StopIteration:
+                            exhausted = True
+                            break
+                        i = next_read
+                        next_read += 1
+                        in_window[i] = task
+                        if dedup:
+                            prompt, model, parse_response, cache, max_tokens = task
+                            # the same prompt parsed differently or sent to another model is a different task
+                            key = (model, max_tokens, id(parse_response), prompt_key(prompt))
+                            if key in leaders:
+                                followers[leaders[key]].append(i)
+                                continue
+                            leaders[key] = i
+                            keys[i] = key
+                            followers[i] = []
+                        unique += 1
+                        submit(i, 0, -1)
+
+                    if not in_window:
+                        return
+
+                    # retries go to the back of the queue
+                    i, attempt, future = completed.get()
+                    parsed_answers, answer_id = future.result()
+                    if parsed_answers is None:
+                        if self.retry_schedule.has_attempt(attempt + 1):
+                            submit(i, attempt + 1, answer_id)
+                            continue
+                        prompt, model = in_window[i][:2]
+                        parsed_answers = self.no_answer(prompt, model, self.retry_schedule.temperature(attempt), answer_id)
+
+                    done = [(i, parsed_answers)]
+                    if dedup:
+                        del leaders[keys.pop(i)]
+                        done += [(j, [dict(answer) for answer in parsed_answers]) for j in followers.pop(i)]
+
+                    if not ordered:
+                        for j, answers in done:
+                            del in_window[j]
+                            yield j, answers
+                        continue
+
+                    finished.update(done)
+                    while next_yield in finished:
+                        del in_window[next_yield]
+                        yield next_yield, finished.pop(next_yield)
+                        next_yield += 1
+            finally:
+                if dedup:
+                    self.record_dedup(next_read, unique)
     
     # Original sequential processing method for comparison
     def bulk_request_sequential(self, df, model, parse_mqm_answer, cache, max_tokens=None):
@@ -208,4 +591,216 @@ class GptApi:
             parsed_answers = self.request(prompt, model, parse_mqm_answer, cache=cache, max_tokens=max_tokens)
             answers.extend(parsed_answers)
                 
-        return answers
\ No newline at end of file
+        return answers
+
+class AsyncGptApi(GptApi):
+    """
+    Asyncio engine built on the async Anthropic client.
+
+    Scoring is almost entirely network wait, so instead of a small thread pool
+    a single event loop keeps up to `max_concurrent` requests in flight, bounded
+    by a semaphore. Parsing, caching and the retry schedule follow `GptApi.request`;
+    a prompt releases its slot between attempts and queues up behind the waiting prompts.
+    """
+
+    def __init__(self, verbose=False, max_concurrent=64, api_key=None, base_url=None, rate_limiter=None, retry_schedule=None, telemetry=None):
+        super().__init__(verbose=verbose, num_workers=max_concurrent, api_key=api_key, base_url=base_url, rate_limiter=rate_limiter, retry_schedule=retry_schedule, telemetry=telemetry)
+        self.async_client = None
+        self.async_client_loop = None
+        self.single_flight_async = AsyncSingleFlight()
+
+    def get_async_client(self):
+        # the underlying http connection pool is bound to an event loop, create one per loop
+        loop = asyncio.get_running_loop()
+        if self.async_client is None or self.async_client_loop is not loop:
+            self.async_client = AsyncAnthropic(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+            self.async_client_loop = loop
+        return self.async_client
+
+    async def close_async_client(self):
+        # close the connections while their loop still runs, otherwise they are closed on a dead loop
+        if self.async_client is not None and self.async_client_loop is asyncio.get_running_loop():
+            await self.async_client.close()
+            self.async_client = None
+            self.async_client_loop = None
+
+    async def request_async(self, prompt, model, parse_response, attempt=0, answer_id=-1, cache=None, max_tokens=None, semaphore=None):
+        while True:
+            parsed_answers, answer_id = await self.request_attempt_async(prompt, model, parse_response, attempt, answer_id, cache, max_tokens, semaphore)
+            if parsed_answers is not None:
+                return parsed_answers
+            attempt += 1
+            if not self.retry_schedule.has_attempt(attempt):
+                return self.no_answer(prompt, model, self.retry_schedule.temperature(attempt - 1), answer_id)
+
+    async def request_attempt_async(self, prompt, model, parse_response, attempt, answer_id, cache, max_tokens, semaphore=None):
+        # the method label lives in the context of this task, concurrent attempts keep their own
+        with self.telemetry.scope(parse_response):
+            temperature = self.retry_schedule.temperature(attempt)
+            key = self.cache_key(prompt, model, temperature, max_tokens)
+            answers = self.lookup_answers(key, model, attempt, cache)
+            if answers is None:
+                answers = await self.single_flight_async.do(key, lambda: self.fetch_answers_async(key, prompt, model, temperature, max_tokens, cache, semaphore))
+
+            return self.parse_attempt(answers, prompt, model, parse_response, attempt, answer_id)
+
+    async def fetch_answers_async(self, key, prompt, model, temperature, max_tokens, cache, semaphore):
+        answers = self.cached_answers(key, cache)
+        if answers is None:
+            answers = await self.request_api_async(prompt, model, temperature, max_tokens, semaphore)
+            self.store_answers(key, cache, answers)
+        return answers
+
+    def shared_in_flight(self):
+        return self.single_flight.shared + self.single_flight_async.shared
+
+    async def request_api_async(self, prompt, model, temperature=0, max_tokens=None, semaphore=None):
+        estimated_tokens = self.estimate_tokens(prompt, model, max_tokens)
+
+        attempt = 0
+        while True:
+            queued = time.monotonic()
+            try:
+                if semaphore is None:
+                    response = await self.call_api_limited(prompt, model, temperature, max_tokens, estimated_tokens, queued)
+                else:
+                    # hold the slot only for the network call, not for the backoff sleep
+                    async with semaphore:
+                        response = await self.call_api_limited(prompt, model, temperature, max_tokens, estimated_tokens, queued)
+                break
+            except Exception as e:
+                self.telemetry.count(model, "errors")
+                if self.is_filtered(e):
+                    return []
+                if not is_transient(e):
+                    raise
+
+                # frequent error is reaching the API limit
+                delay = self.retry_delay(e, attempt)
+                if delay is None:
+                    return []
+                self.telemetry.count(model, "retries")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+        return self.collect_answers(response)
+
+    async def call_api_limited(self, prompt, model, temperature, max_tokens, estimated_tokens, queued):
+        await self.rate_limiter.acquire_async(*estimated_tokens)
+        # waited for a concurrency slot and the rate limiter
+        self.telemetry.observe(model, "queue_wait", time.monotonic() - queued)
+        try:
+            return await self.call_api_async(prompt, model, temperature, max_tokens, estimated_tokens)
+        finally:
+            self.rate_limiter.release()
+
+    async def call_api_async(self, prompt, model, temperature, max_tokens, estimated_tokens=(0, 0)):
+        parameters = self.build_parameters(prompt, model, temperature, max_tokens)
+
+        started = time.monotonic()
+        self.telemetry.count(model, "api_calls")
+        raw_response = await self.get_async_client().messages.with_raw_response.create(**parameters)
+        response = raw_response.parse()
+        self.telemetry.observe(model, "latency", time.monotonic() - started)
+        self.report_success(raw_response.headers, response, estimated_tokens, model)
+
+        return self.extract_answer(response)
+
+    async def process_attempt_async(self, prompt, model, parse_response, attempt, answer_id, max_tokens, cache, semaphore):
+        try:
+            return await self.request_attempt_async(prompt, model, parse_response, attempt, answer_id, cache, max_tokens, semaphore)
+        except Exception as e:
+            return self.error_answer(prompt, model, attempt, e), answer_id
+
+    @contextmanager
+    def attempt_runner(self, max_concurrent):
+        # attempts run on an event loop in a background thread, so `GptApi.iter_request` drives them unchanged
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        semaphore = asyncio.Semaphore(max_concurrent)
+
+        def run_attempt(prompt, model, parse_response, attempt, answer_id, max_tokens, cache):
+            coroutine = self.process_attempt_async(prompt, model, parse_response, attempt, answer_id, max_tokens, cache, semaphore)
+            return asyncio.run_coroutine_threadsafe(coroutine, loop)
+
+        async def cancel_pending():
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.close_async_client()
+
+        try:
+            yield run_attempt
+        finally:
+            asyncio.run_coroutine_threadsafe(cancel_pending(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+    async def process_single_prompt_async(self, prompt, model, parse_response, max_tokens, cache, semaphore):
+        try:
+            return await self.request_async(prompt, model, parse_response, cache=cache, max_tokens=max_tokens, semaphore=semaphore)
+        except Exception as e:
+            return self.error_answer(prompt, model, 0, e)
+
+    async def bulk_request_async(self, df, model, parse_mqm_answer, cache, max_tokens=None, max_concurrent=None):
+        """
+        Process a dataframe of prompts concurrently on the running event loop,
+        identical prompts are requested once
+
+        Args:
+            df: Dataframe containing prompts (or a plain list of prompts)
+            model: Model to use for generation
+            parse_mqm_answer: Function to parse the responses
+            cache: Cache to use for storing responses
+            max_tokens: Maximum tokens for generation
+            max_concurrent: Maximum number of requests in flight (default: self.num_workers),
+                the rate limiter may lower it further while the API is throttling
+
+        Returns:
+            List of parsed answers, in the order of the prompts
+        """
+        prompts = df["prompt"].tolist() if hasattr(df, "prompt") else list(df)
+        unique_prompts, inverse = dedup_prompts(prompts)
+        self.record_dedup(len(prompts), len(unique_prompts))
+
+        results = await self.bulk_request_unique_async(unique_prompts, model, parse_mqm_answer, cache, max_tokens=max_tokens, max_concurrent=max_concurrent)
+        return fan_out(results, inverse)
+
+    async def bulk_request_unique_async(self, prompts, model, parse_mqm_answer, cache, max_tokens=None, max_concurrent=None):
+        if not max_concurrent:
+            max_concurrent = self.num_workers
+        semaphore = asyncio.Semaphore(max_concurrent)
+
+        if self.verbose:
+            print(f"Processing {len(prompts)} prompts with {max_concurrent} concurrent requests", file=sys.stderr)
+
+        pbar = tqdm(total=len(prompts), desc="Processing prompts", file=sys.stderr)
+
+        async def run(prompt):
+            result = await self.process_single_prompt_async(prompt, model, parse_mqm_answer, max_tokens, cache, semaphore)
+            pbar.update(1)
+            return result
+
+        results = await asyncio.gather(*[run(prompt) for prompt in prompts])
+        pbar.close()
+        return results
+
+    def bulk_request_unique(self, prompts, model, parse_mqm_answer, cache, max_tokens=None, max_concurrent=None):
+        # synchronous entry point, `GptApi.bulk_request` deduplicates and calls it
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            # asyncio.run fails inside a running event loop (a notebook, an async caller), the attempts run on the background loop of `attempt_runner`
+            return super().bulk_request_unique(prompts, model, parse_mqm_answer, cache, max_tokens=max_tokens, max_concurrent=max_concurrent)
+
+        async def run():
+            try:
+                return await self.bulk_request_unique_async(prompts, model, parse_mqm_answer, cache, max_tokens=max_tokens, max_concurrent=max_concurrent)
+            finally:
+                await self.close_async_client()
+        return asyncio.run(run())
@@ -0,0 +1,106 @@
+import os
+import json
+import time
+from array import array
+
+
+class Journal:
+    """
+    Append-only write-ahead journal of scored segments.
+
+    The first line is a JSON header describing the run, every further line is
+    "<segment index>\\t<answer as JSON>". Lines are flushed and fsynced in batches
+    of `sync_every` records or every `sync_interval` seconds, so a crash loses at
+    most one batch. Reopening with resume=True indexes the finished segments by
+    their byte offset without decoding the answers, and a torn last line is cut off.
+    A segment whose last record is a None answer (a request error, or nothing parsed
+    after all retries) is not finished, a resumed run requests it again. With
+    read_only=True the journal is indexed the same way but never written or truncated,
+    e.g. to read the journal of a shard that may still be running.
+    """
+
+    def __init__(self, path, header, resume=False, sync_every=1000, sync_interval=1.0, read_only=False):
+        self.path = path
+        self.header = header
+        self.lines = header["lines"]
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+
+        # finished flag and record offset of every segment
+        self.done = bytearray(self.lines)
+        self.offsets = array("q", [-1]) * self.lines
+        self.count = 0
+
+        if read_only:
+            self.read()
+            self.file = None
+        elif resume and os.path.isfile(path):
+            end = self.read()
+            self.file = open(path, "r+b")
+            # drop a record torn by the crash, appends continue after the last complete one
+            self.file.truncate(end)
+            self.file.seek(end)
+        else:
+            self.file = open(path, "wb")
+            self.file.write((json.dumps(header, ensure_ascii=False) + "\n").encode("utf-8"))
+            self.sync()
+
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def read(self):
+        """Index the records of an existing journal, returns the offset after the last complete line"""
+        with open(self.path, "rb") as f:
+            header = f.readline()
+            if not header.endswith(b"\n") or json.loads(header) != self.header:
+                raise Exception(f"Journal {self.path} belongs to a different run, remove it or run without --resume.")
+            offset = len(header)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                tab = line.index(b"\t")
+                index = int(line[:tab])
+                self.mark(index, line[tab + 1:] != b"null\n")
+                self.offsets[index] = offset
+                offset += len(line)
+        return offset
+
+    def mark(self, index, finished):
+        # the last record of a segment decides whether it is finished
+        if finished != bool(self.done[index]):
+            self.done[index] = int(finished)
+            self.count += 1 if finished else -1
+
+    def __contains__(self, index):
+        return self.done[index] == 1
+
+    def append(self, index, answer):
+        self.offsets[index] = self.file.tell()
+        self.file.write(f"{index}\t{json.dumps(answer, ensure_ascii=False)}\n".encode("utf-8"))
+        self.mark(index, answer is not None)
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        if self.file is not None and not self.file.closed:
+            self.sync()
+            self.file.close()
+
+    def answers(self):
+        """Yield the answer of every segment in input order, None for segments not in the journal"""
+        self.close()
+        with open(self.path, "rb") as f:
+            for offset in self.offsets:
+                if offset < 0:
+                    yield None
+                    continue
+                f.seek(offset)
+                line = f.readline()
+                yield json.loads(line[line.index(b"\t") + 1:])
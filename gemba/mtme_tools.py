@@ -1,5 +1,9 @@
+from concurrent.futures import ProcessPoolExecutor
 from mt_metrics_eval import data
+import numpy as np
 import scipy
+from gemba.columnar import ColumnStore
+from gemba.significance import as_matrix, compare_accuracy, compare_metrics
 
 ######
 # Functions in this script are copied from mt-metrics-eval/wmt22_metrics.ipynb
@@ -8,7 +12,7 @@ import scipy
 
 def eval_metrics(eval_sets, langs, levels, primary_only, k, gold_name='std',
                  include_domains=True, seg_level_no_avg=False,
-                 include_human_with_acc=False):
+                 include_human_with_acc=False, processes=None, seed=0):
     """Evaluate all metrics for eval sets, across multiple task settings.
 
     Args:
@@ -25,11 +29,20 @@ def eval_metrics(eval_sets, langs, levels, primary_only, k, gold_name='std',
       seg_level_no_avg: If True, use only the average_by=None setting for segment-
         level correlations
       include_human_with_acc: If True, include human outputs in accuracy tasks.
+      processes: Worker processes for the significance tests when k > 0, all
+        CPUs if None.
+      seed: Seed of the bootstrap resampling, every task draws its own stream.
+
+    With k > 0 the scores of every task are read once into matrices and its
+    bootstrap runs vectorized in gemba.significance, the tasks are spread over
+    a process pool. With k == 0 mt-metrics-eval computes the correlations.
 
     Returns:
       Map from task names to metric -> (rank, corr, sig_string) stats.
     """
     results = {}
+    # significance tests, run in the pool once all tasks are collected
+    pending = {}
 
     # First task is global accuracy, iff more than one language is given.
     if len(langs) > 0:
@@ -46,6 +59,10 @@ def eval_metrics(eval_sets, langs, levels, primary_only, k, gold_name='std',
                 'wmt22', langs, None, 'sys', human, 'none', 'accuracy', k, gold,
                 main_refs, close_refs, False, primary_only)
             print(taskname)
+            if k > 0:
+                pending[taskname] = (compare_accuracy, accuracy_matrices(
+                    evs_list, main_refs, close_refs, human, gold, primary_only))
+                continue
             res = data.CompareMetricsWithGlobalAccuracy(
                 evs_list, main_refs, close_refs, include_human=human,
                 include_outliers=False, gold_name=gold,
@@ -79,15 +96,73 @@ def eval_metrics(eval_sets, langs, levels, primary_only, k, gold_name='std',
                                 close_refs=close_refs, include_human=human,
                                 include_outliers=False, gold_name=gold_name,
                                 primary_metrics=primary_only, domain=domain)
+                            if k > 0:
+                                names = [evs.DisplayName(m) for m in corrs]
+                                pending[taskname] = (compare_metrics, (names, *correlation_matrices(corrs), corr, avg))
+                                continue
                             metrics, sig_matrix = data.CompareMetrics(
                                 corrs, corr_fcn, average_by=avg, k=k, pval=0.05)
                             # Make compatible with accuracy results.
                             metrics = {evs.DisplayName(m): v for m, v in metrics.items()}
                             results[taskname] = reformat((metrics, sig_matrix))
 
+    if pending:
+        with ProcessPoolExecutor(processes) as pool:
+            futures = {taskname: pool.submit(compare, *args, k=k, pval=0.05, seed=[seed, i])
+                       for i, (taskname, (compare, args)) in enumerate(pending.items())}
+            for taskname, future in futures.items():
+                results[taskname] = reformat(future.result())
+
     return results
 
 
+def correlation_matrices(corrs):
+    """Gold (num_sys, num_items) and metric (num_metrics, num_sys, num_items) scores of data.GetCorrelations results"""
+    corrs = list(corrs.values())
+    gold = as_matrix(corrs[0].gold_scores, corrs[0].num_sys)
+    metrics = np.stack([as_matrix(c.metric_scores, c.num_sys) for c in corrs])
+    return gold, metrics
+
+
+def accuracy_matrices(evs_list, main_refs, close_refs, include_human, gold_name, primary_only):
+    """Metric names and system scores per language pair, for compare_accuracy"""
+    per_lp = []
+    for evs, main, close in zip(evs_list, main_refs, close_refs):
+        corrs = data.GetCorrelations(
+            evs=evs, level='sys', main_refs=main, close_refs=close,
+            include_human=include_human, include_outliers=False,
+            gold_name=gold_name, primary_metrics=primary_only, domain=None)
+        per_lp.append({evs.DisplayName(m): c for m, c in corrs.items()})
+    # metrics are compared across language pairs by display name, only those scoring all of them
+    names = [m for m in per_lp[0] if all(m in corrs for corrs in per_lp)]
+    golds = [as_matrix(corrs[names[0]].gold_scores, corrs[names[0]].num_sys)[:, 0] for corrs in per_lp] if names else []
+    metrics = [np.stack([as_matrix(corrs[m].metric_scores, corrs[m].num_sys)[:, 0] for m in names]) for corrs in per_lp] if names else []
+    return names, golds, metrics
+
+
+def load_eval_set(dataset, lp, path):
+    """data.EvalSet with the segment and system metric scores read from the compiled sidecars.
+
+    mt-metrics-eval parses every metric-scores TSV of the language pair on each run;
+    here only TSVs that changed since the last run are parsed (see
+    gemba.columnar.ColumnStore), the others are read from their sidecars. The scores
+    are still copied into the lists EvalSet works on, with None for missing scores,
+    which is what mt-metrics-eval filters on. Domain-level metric scores are not loaded.
+    """
+    evs = data.EvalSet(dataset, lp, False, path=path)
+    store = ColumnStore(f"{path}/{dataset}/metric-scores/{lp}")
+    for level in 'seg', 'sys':
+        for name, column in store.load_all(f".{level}.score").items():
+            # files are named <metric>-<reference>, "src" for metrics without a reference
+            metric, ref = name.rsplit('-', 1)
+            # NaN marks a missing score in the sidecar
+            scores = {system: [None if x != x else x for x in values.tolist()]
+                      for system, values in column.by_system().items()}
+            evs.AddMetric(metric, set() if ref == 'src' else {ref}, level, scores,
+                          replace=True)
+    return evs
+
+
 def reformat(results):
     """Reformat CompareMetrics() results to match mtme's format."""
     metrics, sig_matrix = results
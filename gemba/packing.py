@@ -0,0 +1,119 @@
+import re
+import sys
+from gemba.prompt import prompts
+from gemba.dedup import dedup_prompts
+from gemba.gemba_mqm_utils import compile_template
+
+# "Item 3: 85", "3. 85", "item 3 - five stars", ...
+ITEM_LINE = re.compile(r"^\s*(?:\**item\s*)?(\d+)\s*\**\s*[:.)\-]\s*\**\s*(.*)$", re.IGNORECASE)
+
+# output tokens reserved per packed item
+TOKENS_PER_ITEM = 25
+
+
+def split_template(template):
+    """
+    Split a single-segment prompt into its instruction, the per-segment body and the answer label.
+
+    All single-string prompts in gemba.prompt share the layout
+    "<instruction>\\n\\n<segment lines>\\n<Label>: ".
+    """
+    instruction, item = template.split("\n\n", 1)
+    body, label = item.rstrip().rsplit("\n", 1)
+    return instruction, body, label.rstrip(": ")
+
+
+def build_packed_prompt(template, rows):
+    """Render one prompt scoring all rows as numbered items"""
+    instruction, body, label = split_template(template)
+
+    # languages are the same for every row of a run
+    parts = [instruction.format(**rows[0]), f"There are {len(rows)} numbered items below, evaluate each of them independently."]
+    for number, row in enumerate(rows, start=1):
+        parts.append(f"Item {number}:\n" + body.format(**row))
+    parts.append(f'Answer with exactly one line per item in the form "Item <number>: <{label}>", for items 1 to {len(rows)}.')
+    return "\n\n".join(parts)
+
+
+def split_packed_answer(answer):
+    """Split a packed answer into {item number: answer text}, items answered twice are dropped"""
+    items = {}
+    duplicates = set()
+    current = None
+    for line in answer.split("\n"):
+        match = ITEM_LINE.match(line)
+        if match is not None:
+            current = int(match.group(1))
+            if current in items:
+                duplicates.add(current)
+            items[current] = match.group(2).strip()
+        elif current is not None and line.strip():
+            # answer continued on the next line
+            items[current] = f"{items[current]} {line.strip()}".strip()
+
+    for number in duplicates:
+        del items[number]
+    return items
+
+
+def parse_packed_answer(answer, validate_answer):
+    """
+    Parse a packed answer with the single-segment validator (validate_number, validate_stars, parse_classes)
+    applied to every item. Returns {item number: parsed answer} with unparsable items left out.
+    """
+    if answer is None:
+        return {}
+    parsed = {}
+    for number, text in split_packed_answer(str(answer)).items():
+        value = validate_answer(text)
+        if value is not None:
+            parsed[number] = value
+    return parsed
+
+
+def packed_bulk_request(gptapi, df, method, model, cache, pack_size, max_tokens=None):
+    """
+    Score the rows of df in groups of `pack_size` segments per request.
+
+    Identical rows are packed once. Items missing from a malformed or truncated packed
+    answer fall back to regular single-segment requests. Returns one answer per row, like `bulk_request`.
+    """
+    if method not in prompts:
+        raise Exception(f"Method {method} does not support packing.")
+    template = prompts[method]["prompt"]
+    validate_answer = prompts[method]["validate_answer"]
+
+    all_rows = df.to_dict("records")
+    # a row is identified by its single-segment prompt
+    single_prompts, inverse = dedup_prompts(compile_template(template).render_columns(df))
+    gptapi.record_dedup(len(all_rows), len(single_prompts))
+    rows = [None] * len(single_prompts)
+    for row, position in zip(all_rows, inverse):
+        rows[position] = row
+
+    groups = [list(range(start, min(start + pack_size, len(rows)))) for start in range(0, len(rows), pack_size)]
+    packed_prompts = [build_packed_prompt(template, [rows[i] for i in group]) for group in groups]
+
+    packed_max_tokens = max(max_tokens or 0, TOKENS_PER_ITEM * pack_size)
+    # never None, so a partially parsed answer is kept instead of escalating the temperature
+    parse_answer = lambda x: parse_packed_answer(x, validate_answer)
+    packed_answers = gptapi.bulk_request(packed_prompts, model, parse_answer, cache=cache, max_tokens=packed_max_tokens)
+
+    answers = [None] * len(rows)
+    missing = []
+    for group, packed_answer in zip(groups, packed_answers):
+        parsed = packed_answer["answer"] or {}
+        for number, i in enumerate(group, start=1):
+            if number in parsed:
+                answers[i] = {**packed_answer, "answer": parsed[number], "packed": len(group)}
+            else:
+                missing.append(i)
+
+    if missing:
+        print(f"Packed answers missed {len(missing)}/{len(rows)} items, falling back to single-segment requests", file=sys.stderr)
+        # already distinct, skip the deduplication of bulk_request
+        fallback = gptapi.bulk_request_unique([single_prompts[i] for i in missing], model, validate_answer, cache=cache, max_tokens=max_tokens)
+        for i, result in zip(missing, fallback):
+            answers[i] = result[0]
+
+    return [dict(answers[position]) for position in inverse]
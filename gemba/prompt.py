@@ -1,6 +1,27 @@
 import re
+import numpy as np
+from functools import lru_cache
 from termcolor import colored
 
+NUMBERS = re.compile(r'\d+')
+# ['100']
+QUOTED_NUMBER = re.compile(r"^\[['\"][0-9]*['\"]\]$")
+
+# phrases of a stars answer and the number of stars they stand for, matched on " {answer} "
+STAR_PHRASES = {
+    " one ": 1, "1 star": 1,
+    " two ": 2, "2 star": 2,
+    " three ": 3, "3 star": 3,
+    " four ": 4, "4 star": 4,
+    " five ": 5, "5 star": 5,
+}
+
+
+@lru_cache(maxsize=None)
+def fraction_pattern(max):
+    # 0/100
+    return re.compile(rf"^[0-9]*/{max}$")
+
 
 def parse_and_check_numerical_answer(answer, min=None, max=None):
     attempt = parse_numerical_answer(answer, min, max)
@@ -12,20 +33,21 @@ def parse_and_check_numerical_answer(answer, min=None, max=None):
     return None
 
 
+@lru_cache(maxsize=65536)
 def parse_numerical_answer(answer, min=None, max=None):
     # get all numbers in a string
-    numbers = re.findall(r'\d+', answer)
+    numbers = NUMBERS.findall(answer)
     if len(numbers) == 1:
         return int(numbers[0])
 
     # check if the answer is in form ['100'] and extract the number
-    r1 = re.match(r"^\[['\"][0-9]*['\"]\]$", answer)
+    r1 = QUOTED_NUMBER.match(answer)
     if r1 is not None:
         return int(answer[2:-2])
 
     if max is not None:
         # check if the answer is in a form of 0/100
-        r2 = re.match(rf"^[0-9]*/{max}$", answer)
+        r2 = fraction_pattern(max).match(answer)
         if r2 is not None:
             return int(answer.split("/")[0])
 
@@ -40,9 +62,10 @@ def validate_number(x, min=0, max=100):
 
 
 def parse_classes(answer, classes):
+    answer_lower = answer.lower()
     final_class = None
     for i in range(len(classes)):
-        if classes[i].lower() in answer.lower():
+        if classes[i].lower() in answer_lower:
             if final_class is None:
                 final_class = i
             else:
@@ -52,6 +75,7 @@ def parse_classes(answer, classes):
     return final_class
 
 
+@lru_cache(maxsize=65536)
 def validate_stars(x):
     x = x.lower()
     # try to find all possible answers as sometimes it seems to be explaining itself
@@ -65,16 +89,9 @@ def validate_stars(x):
 
     x = f" {x} ".replace("\n", " ")
     # possible answers: "five stars", "5 stars", "five", "five starts: perfect translation", ...
-    if " one " in x or "1 star" in x:
-        possible_answers.add(1)
-    if " two " in x or "2 star" in x:
-        possible_answers.add(2)
-    if " three " in x or "3 star" in x:
-        possible_answers.add(3)
-    if " four " in x or "4 star" in x:
-        possible_answers.add(4)
-    if " five " in x or "5 star" in x:
-        possible_answers.add(5)
+    for phrase, stars in STAR_PHRASES.items():
+        if phrase in x:
+            possible_answers.add(stars)
 
     numerical = parse_numerical_answer(x)
     if numerical is not None:
@@ -87,6 +104,25 @@ def validate_stars(x):
     return None
 
 
+def validate_answers(answers, validate_answer):
+    """
+    Validate many answers with one of the validators below, e.g. to re-parse cached answers.
+
+    Every distinct answer is validated once. Returns a float numpy array, NaN where the
+    answer is None or does not validate.
+    """
+    scores = np.full(len(answers), np.nan)
+    validated = {}
+    for i, answer in enumerate(answers):
+        if answer is None:
+            continue
+        if answer not in validated:
+            validated[answer] = validate_answer(answer)
+        if validated[answer] is not None:
+            scores[i] = validated[answer]
+    return scores
+
+
 language_codes = {
     "en": "English",
     "de": "German",
@@ -98,32 +134,38 @@ prompts = {
     "GEMBA-DA": {
         "prompt": 'Score the following translation from {source_lang} to {target_lang} on a continuous scale from 0 to 100, where a score of zero means "no meaning preserved" and score of one hundred means "perfect meaning and grammar".\n\n{source_lang} source: "{source_seg}"\n{target_lang} translation: "{target_seg}"\nScore: ',
         "validate_answer": lambda x: validate_number(x),
-        "use_ref": False},
+        "use_ref": False,
+        "max_tokens": 64},
 
     "GEMBA-DA_ref": {
         "prompt": 'Score the following translation from {source_lang} to {target_lang} with respect to human reference on a continuous scale 0 to 100 where score of zero means "no meaning preserved" and score of one hundred means "perfect meaning and grammar".\n\n{source_lang} source: "{source_seg}"\n{target_lang} human reference: {reference_seg}\n{target_lang} machine translation: "{target_seg}"\nScore: ',
         "validate_answer": lambda x: validate_number(x),
-        "use_ref": True},
+        "use_ref": True,
+        "max_tokens": 64},
 
     "GEMBA-SQM": {
         "prompt": 'Score the following translation from {source_lang} to {target_lang} on a continuous scale from 0 to 100 that starts on "No meaning preserved", goes through "Some meaning preserved", then "Most meaning preserved and few grammar mistakes", up to "Perfect meaning and grammar".\n\n{source_lang} source: "{source_seg}"\n{target_lang} translation: "{target_seg}"\nScore (0-100): ',
         "validate_answer": lambda x: validate_number(x),
-        "use_ref": False},
+        "use_ref": False,
+        "max_tokens": 64},
 
     "GEMBA-SQM_ref": {
         "prompt": 'Score the following machine translation from {source_lang} to {target_lang} with respect to the human reference on a continuous scale from 0 to 100 that starts with "No meaning preserved", goes through "Some meaning preserved", then "Most meaning preserved and few grammar mistakes", up to "Perfect meaning and grammar".\n\n{source_lang} source: "{source_seg}"\n{target_lang} human reference: "{reference_seg}"\n{target_lang} machine translation: "{target_seg}"\nScore (0-100): ',
         "validate_answer": lambda x: validate_number(x),
-        "use_ref": True},
+        "use_ref": True,
+        "max_tokens": 64},
 
     "GEMBA-stars": {
         "prompt": 'Score the following translation from {source_lang} to {target_lang} with one to five stars. Where one star means "Nonsense/No meaning preserved", two stars mean "Some meaning preserved, but not understandable", three stars mean "Some meaning preserved and understandable", four stars mean "Most meaning preserved with possibly few grammar mistakes", and five stars mean "Perfect meaning and grammar".\n\n{source_lang} source: "{source_seg}"\n{target_lang} translation: "{target_seg}"\nStars: ',
         "validate_answer": lambda x: validate_stars(x),
-        "use_ref": False},
+        "use_ref": False,
+        "max_tokens": 64},
 
     "GEMBA-stars_ref": {
         "prompt": 'Score the following translation from {source_lang} to {target_lang} with respect to the human reference with one to five stars. Where one star means "Nonsense/No meaning preserved", two stars mean "Some meaning preserved, but not understandable", three stars mean "Some meaning preserved and understandable", four stars mean "Most meaning preserved with possibly few grammar mistakes", and five stars mean "Perfect meaning and grammar".\n\n{source_lang} source: "{source_seg}"\n{target_lang} human reference: "{reference_seg}"\n{target_lang} translation: "{target_seg}"\nStars: ',
         "validate_answer": lambda x: validate_stars(x),
-        "use_ref": True},
+        "use_ref": True,
+        "max_tokens": 64},
 
     "GEMBA-classes": {
         "prompt": 'Classify the quality of machine translation from {source_lang} to {target_lang} into one of following classes: "No meaning preserved", "Some meaning preserved, but not understandable", "Some meaning preserved and understandable", "Most meaning preserved, minor issues", "Perfect translation".\n\n{source_lang} source: "{source_seg}"\n{target_lang} machine translation: "{target_seg}"\nClass: ',
@@ -0,0 +1,350 @@
+import os
+import time
+import random
+import socket
+import sqlite3
+import asyncio
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+
+# status codes that mean "slow down": rate limited and overloaded
+THROTTLE_STATUS_CODES = (429, 529)
+
+# budgets of the anthropic-ratelimit-* headers and the RateLimiter bucket of each
+BUDGETS = {"requests": "requests", "tokens": "tokens", "input-tokens": "input_tokens", "output-tokens": "output_tokens"}
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `per_minute` units per minute.
+
+    Reservations are allowed to drive the bucket into debt, the returned delay is
+    the time the caller has to wait until its reservation is covered. Concurrent
+    callers therefore queue up behind each other instead of all retrying at once.
+    """
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.per_minute, self.level + (now - self.updated) * self.per_minute / 60.0)
+        self.updated = now
+
+    def reserve(self, amount, now):
+        self.refill(now)
+        self.level -= amount
+        if self.level >= 0:
+            return 0.0
+        return -self.level * 60.0 / self.per_minute
+
+    def adjust(self, amount):
+        # correct an earlier reservation once the real usage is known
+        self.level = min(self.per_minute, self.level - amount)
+
+
+def parse_reset(value, now):
+    """Parse a rate-limit reset header (RFC 3339 timestamp) into seconds from now"""
+    try:
+        reset = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+    return max(0.0, reset.timestamp() - now)
+
+
+def parse_retry_after(value, now):
+    """Parse a retry-after header, given either in seconds or as an HTTP date"""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - now)
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """
+    Rate limiter shared by all workers of a GptApi.
+
+    - requests-per-minute and (input/output) tokens-per-minute budgets are token buckets,
+      if not configured they are adopted from the API's rate-limit headers; requests reserve
+      their estimated input and output tokens, corrected once the real usage is known
+    - retry-after and exhausted "remaining" headers pause every worker until the reset
+    - concurrency follows AIMD: halved on 429/529, grown by one slot per window of successes
+    - failed calls are retried with jittered exponential backoff, at most `max_retries` times per prompt
+    - with a `RateCoordinator`, the budgets are those of the whole API key and this limiter
+      only uses its share of them, pauses are passed on to the other processes
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, input_tokens_per_minute=None, output_tokens_per_minute=None,
+                 max_concurrent=64, min_concurrent=1, backoff_base=1.0, backoff_max=60.0, max_retries=8, decrease_factor=0.5,
+                 decrease_cooldown=1.0, coordinator=None):
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.async_waiters = []
+
+        # budgets of the API key, the buckets hold `share` of them
+        self.limits = {"requests": requests_per_minute, "tokens": tokens_per_minute,
+                       "input-tokens": input_tokens_per_minute, "output-tokens": output_tokens_per_minute}
+        self.share = 1.0
+        for kind, attribute in BUDGETS.items():
+            setattr(self, attribute, TokenBucket(self.limits[kind]) if self.limits[kind] else None)
+        self.blocked_until = 0.0
+        self.coordinator = coordinator
+
+        self.max_concurrent = max_concurrent
+        self.min_concurrent = min_concurrent
+        self.concurrency = float(max_concurrent)
+        self.in_flight = 0
+        self.decrease_factor = decrease_factor
+        self.decrease_cooldown = decrease_cooldown
+        self.last_decrease = 0.0
+
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retries = max_retries
+
+        self.stats = {"requests": 0, "successes": 0, "throttled": 0, "errors": 0, "retries": 0, "gave_up": 0, "waited": 0.0}
+        if coordinator is not None:
+            # register right away, so processes starting together split the budget from their first request
+            coordinator.sync(self, force=True)
+
+    # admission
+
+    def reserve(self, input_tokens=0, output_tokens=0):
+        """Reserve budget for one request and return how long the caller has to wait"""
+        if self.coordinator is not None:
+            self.coordinator.sync(self)
+        with self.lock:
+            now = time.monotonic()
+            delay = max(0.0, self.blocked_until - now)
+            for bucket, amount in [(self.requests, 1), (self.tokens, input_tokens + output_tokens),
+                                   (self.input_tokens, input_tokens), (self.output_tokens, output_tokens)]:
+                if bucket is not None and amount:
+                    delay = max(delay, bucket.reserve(amount, now))
+            self.stats["requests"] += 1
+            self.stats["waited"] += delay
+            return delay
+
+    def slots(self):
+        return max(self.min_concurrent, int(self.concurrency))
+
+    def acquire(self, input_tokens=0, output_tokens=0):
+        delay = self.reserve(input_tokens, output_tokens)
+        if delay > 0:
+            time.sleep(delay)
+        with self.condition:
+            while self.in_flight >= self.slots() or time.monotonic() < self.blocked_until:
+                self.condition.wait(timeout=max(0.01, self.blocked_until - time.monotonic()))
+            self.in_flight += 1
+
+    async def acquire_async(self, input_tokens=0, output_tokens=0):
+        delay = self.reserve(input_tokens, output_tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.lock:
+                blocked = self.blocked_until - time.monotonic()
+                if self.in_flight < self.slots() and blocked <= 0:
+                    self.in_flight += 1
+                    return
+                if blocked <= 0:
+                    future = loop.create_future()
+                    self.async_waiters.append((loop, future))
+            if blocked > 0:
+                await asyncio.sleep(blocked)
+            else:
+                await future
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.wake()
+
+    def wake(self):
+        # must be called with the lock held, waiters re-check the limits themselves
+        self.condition.notify_all()
+        waiters, self.async_waiters = self.async_waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(lambda f=future: f.done() or f.set_result(None))
+
+    def set_share(self, share):
+        """Use `share` of the configured (or adopted) budgets, e.g. 1/N with N processes on one API key"""
+        with self.lock:
+            self.share = share
+            for kind, attribute in BUDGETS.items():
+                bucket = getattr(self, attribute)
+                if bucket is not None:
+                    bucket.per_minute = self.limits[kind] * share
+                    bucket.level = min(bucket.level, bucket.per_minute)
+
+    def block(self, seconds):
+        """Pause every worker for `seconds`, e.g. on a retry-after seen by another process"""
+        with self.condition:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.wake()
+
+    # feedback
+
+    def on_success(self, headers=None, tokens_used=None, tokens_reserved=(0, 0)):
+        """Register a successful call, `tokens_used` and `tokens_reserved` are (input, output) pairs"""
+        with self.lock:
+            self.stats["successes"] += 1
+            if self.concurrency < self.max_concurrent:
+                # additive increase: roughly one extra slot per window of successful requests
+                self.concurrency = min(self.max_concurrent, self.concurrency + 1.0 / self.concurrency)
+            if tokens_used is not None:
+                (input_used, output_used), (input_reserved, output_reserved) = tokens_used, tokens_reserved
+                for bucket, amount in [(self.tokens, input_used + output_used - input_reserved - output_reserved),
+                                       (self.input_tokens, input_used - input_reserved), (self.output_tokens, output_used - output_reserved)]:
+                    if bucket is not None:
+                        bucket.adjust(amount)
+            if headers is not None:
+                self.read_headers(headers)
+            self.wake()
+
+    def on_error(self, error, attempt):
+        """
+        Register a failed call and return the backoff before the next attempt,
+        or None when the retry budget of the prompt is exhausted.
+        """
+        status = getattr(error, "status_code", None)
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None)
+
+        with self.lock:
+            now = time.monotonic()
+            retry_after = None
+            if headers is not None:
+                self.read_headers(headers)
+                retry_after = parse_retry_after(headers.get("retry-after"), time.time())
+
+            if status in THROTTLE_STATUS_CODES:
+                self.stats["throttled"] += 1
+                # multiplicative decrease, once per cooldown so a burst of 429s counts as one signal
+                if now - self.last_decrease >= self.decrease_cooldown:
+                    self.concurrency = max(self.min_concurrent, self.concurrency * self.decrease_factor)
+                    self.last_decrease = now
+            else:
+                self.stats["errors"] += 1
+
+            if attempt >= self.max_retries:
+                self.stats["gave_up"] += 1
+                delay = None
+            else:
+                # full jitter keeps the workers from retrying in lockstep
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                if retry_after is not None:
+                    delay = retry_after + random.uniform(0, self.backoff_base)
+                    self.blocked_until = max(self.blocked_until, now + retry_after)
+                self.stats["retries"] += 1
+
+        # the API key is throttled for the other processes as well
+        if retry_after is not None and self.coordinator is not None:
+            self.coordinator.report_block(retry_after)
+        return delay
+
+    def read_headers(self, headers):
+        # must be called with the lock held
+        now = time.time()
+        for kind, attribute in BUDGETS.items():
+            limit = headers.get(f"anthropic-ratelimit-{kind}-limit")
+            remaining = headers.get(f"anthropic-ratelimit-{kind}-remaining")
+            reset = headers.get(f"anthropic-ratelimit-{kind}-reset")
+
+            # adopt the server's budget when none was configured
+            if limit is not None and getattr(self, attribute) is None:
+                self.limits[kind] = float(limit)
+                setattr(self, attribute, TokenBucket(float(limit) * self.share))
+
+            if remaining is not None and reset is not None and float(remaining) <= 0:
+                wait = parse_reset(reset, now)
+                if wait is not None:
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + wait)
+
+    def summary(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["concurrency"] = self.slots()
+            if self.coordinator is not None:
+                stats["share"] = self.share
+        return stats
+
+
+class RateCoordinator:
+    """
+    Splits the rate budget of one API key between processes, e.g. the shards of a job.
+
+    Every process registers in a SQLite database, on local disk for processes of one
+    machine or on a shared filesystem for several machines, and refreshes a heartbeat
+    every `interval` seconds. Each limiter uses 1/N of the budget with N processes
+    alive (heartbeat within `ttl`), and a retry-after seen by one process pauses all of
+    them. The database is only touched on these refreshes, not per request.
+    """
+
+    def __init__(self, path, name=None, interval=5.0, ttl=30.0):
+        self.path = path
+        # hostname and pid identify the process on shared filesystems
+        self.name = name if name is not None else f"{socket.gethostname()}:{os.getpid()}"
+        self.interval = interval
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.last_sync = None
+        self.processes = 1
+
+        with self.connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS processes (name TEXT PRIMARY KEY, heartbeat REAL)")
+            db.execute("CREATE TABLE IF NOT EXISTS pause (id INTEGER PRIMARY KEY CHECK (id = 0), until REAL)")
+            db.execute("INSERT OR IGNORE INTO pause VALUES (0, 0)")
+
+    @contextmanager
+    def connect(self):
+        # one transaction per call, connections cannot be shared between threads
+        db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+        finally:
+            db.close()
+
+    def sync(self, limiter, force=False):
+        """Refresh the heartbeat and apply the current share and pause to `limiter`, at most once per interval"""
+        with self.lock:
+            now = time.monotonic()
+            if not force and self.last_sync is not None and now - self.last_sync < self.interval:
+                return
+            self.last_sync = now
+
+            wall = time.time()
+            with self.connect() as db:
+                db.execute("INSERT OR REPLACE INTO processes VALUES (?, ?)", (self.name, wall))
+                db.execute("DELETE FROM processes WHERE heartbeat < ?", (wall - self.ttl,))
+                self.processes = db.execute("SELECT COUNT(*) FROM processes").fetchone()[0]
+                until = db.execute("SELECT until FROM pause").fetchone()[0]
+
+        limiter.set_share(1.0 / self.processes)
+        if until > wall:
+            limiter.block(until - wall)
+
+    def report_block(self, seconds):
+        with self.connect() as db:
+            db.execute("UPDATE pause SET until = MAX(until, ?)", (time.time() + seconds,))
+
+    def close(self):
+        """Leave the coordination, the remaining processes take over the budget on their next refresh"""
+        with self.connect() as db:
+            db.execute("DELETE FROM processes WHERE name = ?", (self.name,))
+
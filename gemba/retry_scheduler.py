@@ -0,0 +1,54 @@
+import threading
+
+# Anthropic accepts temperatures from 0 to 1, the old schedule of +1 per retry was out of range from its third attempt
+DEFAULT_TEMPERATURES = (0, 0.25, 0.5, 0.75, 1)
+
+
+class RetrySchedule:
+    """
+    Temperature schedule for prompts whose answer does not parse.
+
+    Attempt n of a prompt runs at `temperatures[n]`; after `max_attempts` attempts the
+    prompt is given up with an empty answer. The engines put failed items back into their
+    work queue instead of retrying in place, so other prompts keep flowing meanwhile.
+    Outcomes are counted per attempt.
+    """
+
+    def __init__(self, temperatures=DEFAULT_TEMPERATURES, max_attempts=None):
+        if len(temperatures) == 0:
+            raise ValueError("The temperature schedule must not be empty")
+        self.temperatures = list(temperatures)
+        # repeating the last temperature would only hit the same cache entry again
+        self.max_attempts = min(max_attempts or len(self.temperatures), len(self.temperatures))
+
+        self.lock = threading.Lock()
+        self.stats = [{"temperature": t, "requests": 0, "parsed": 0, "unparsed": 0, "no_answer": 0} for t in self.temperatures[:self.max_attempts]]
+
+    def temperature(self, attempt):
+        return self.temperatures[attempt]
+
+    def attempt_for(self, temperature):
+        """First attempt running at `temperature` or above, the last attempt for temperatures beyond the schedule"""
+        for attempt in range(self.max_attempts):
+            if self.temperatures[attempt] >= temperature:
+                return attempt
+        return self.max_attempts - 1
+
+    def has_attempt(self, attempt):
+        return attempt < self.max_attempts
+
+    def record(self, attempt, outcome):
+        """Count the outcome ("parsed", "unparsed" or "no_answer") of an attempt"""
+        with self.lock:
+            self.stats[attempt]["requests"] += 1
+            self.stats[attempt][outcome] += 1
+
+    def summary(self):
+        with self.lock:
+            lines = []
+            for attempt, stats in enumerate(self.stats):
+                if stats["requests"] == 0:
+                    continue
+                lines.append(f"attempt {attempt + 1} (t={stats['temperature']}): {stats['requests']} requests, "
+                             f"{stats['parsed']} parsed, {stats['unparsed']} unparsable, {stats['no_answer']} without answer")
+        return "\n".join(lines)
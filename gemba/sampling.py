@@ -0,0 +1,119 @@
+import os
+import json
+import math
+import itertools
+from statistics import NormalDist
+import numpy as np
+
+
+class SequentialSampler:
+    """
+    Scores the segments of a testset in randomized rounds until the order of every pair of systems is settled.
+
+    Segments are visited in one random order shared by all systems, `round_size` at a time, so
+    two systems are always compared on the same segments. After every round the mean paired
+    difference of every unsettled pair gets a confidence interval; once it excludes zero the
+    pair is settled, and a system whose pairs are all settled gets no further segments. The
+    intervals use the normal approximation with a finite population correction (a fully scored
+    pair has an exact difference) and a Bonferroni correction over all pairs and rounds, so
+    testing after every round keeps the `confidence` for the whole ranking. Pairs are tested
+    once both systems have `min_segments` common scores.
+
+    Scores that already exist (e.g. of an interrupted run with the same seed) are used and not requested again.
+    """
+
+    def __init__(self, systems, segment_count, round_size=100, confidence=0.95, min_segments=200, seed=0):
+        self.systems = list(systems)
+        self.segment_count = segment_count
+        self.round_size = round_size
+        self.confidence = confidence
+        self.min_segments = min_segments
+        self.seed = seed
+        self.order = np.random.default_rng(seed).permutation(segment_count)
+        # segments of the order handed out so far
+        self.position = 0
+        self.rounds = 0
+        self.unsettled = set(itertools.combinations(self.systems, 2))
+        # settled pair -> (mean difference, half width, common segments, round)
+        self.settled = {}
+
+        looks = max(1, math.ceil(segment_count / round_size))
+        alpha = (1 - confidence) / (max(1, len(self.unsettled)) * looks)
+        self.z = NormalDist().inv_cdf(1 - alpha / 2)
+
+    @property
+    def done(self):
+        return not self.unsettled or self.position >= self.segment_count
+
+    def active_systems(self):
+        return sorted({system for pair in self.unsettled for system in pair}, key=self.systems.index)
+
+    def next_round(self, scores):
+        """(system, segment) pairs to score in the next round, those with a score in `scores` are skipped"""
+        if self.done:
+            return []
+        segments = self.order[self.position:self.position + self.round_size]
+        self.position += len(segments)
+        self.rounds += 1
+        selection = []
+        for system in self.active_systems():
+            missing = np.isnan(scores.get_scores(system, segments))
+            selection += [(system, int(segment)) for segment in segments[missing]]
+        return selection
+
+    def interval(self, values):
+        """Mean and half width of the confidence interval of the mean of values sampled without replacement"""
+        n = len(values)
+        if n < 2:
+            return (float(values.mean()) if n else math.nan), math.inf
+        correction = math.sqrt((self.segment_count - n) / (self.segment_count - 1)) if self.segment_count > 1 else 0.0
+        return float(values.mean()), self.z * float(values.std(ddof=1)) / math.sqrt(n) * correction
+
+    def update(self, scores):
+        """Test the unsettled pairs on the segments scored so far"""
+        sampled = self.order[:self.position]
+        values = {system: scores.get_scores(system, sampled) for system in self.active_systems()}
+        for pair in sorted(self.unsettled, key=lambda pair: (self.systems.index(pair[0]), self.systems.index(pair[1]))):
+            differences = values[pair[0]] - values[pair[1]]
+            differences = differences[~np.isnan(differences)]
+            if len(differences) < min(self.min_segments, self.segment_count):
+                continue
+            mean, half_width = self.interval(differences)
+            if abs(mean) > half_width:
+                self.unsettled.discard(pair)
+                self.settled[pair] = (mean, half_width, len(differences), self.rounds)
+
+    def summary(self, scores):
+        """What was sampled and the running estimates, written next to the scores"""
+        sampled = self.order[:self.position]
+        systems = {}
+        for system in self.systems:
+            values = scores.get_scores(system, sampled)
+            values = values[~np.isnan(values)]
+            mean, half_width = self.interval(values)
+            systems[system] = {"segments": len(values), "mean": finite(mean), "half_width": finite(half_width)}
+        return {
+            "confidence": self.confidence, "round_size": self.round_size, "min_segments": self.min_segments, "seed": self.seed,
+            "segment_count": self.segment_count, "rounds": self.rounds, "sampled_segments": self.position,
+            "scored": sum(system["segments"] for system in systems.values()),
+            "systems": systems,
+            "settled": [{"systems": list(pair), "difference": mean, "half_width": half_width, "segments": n, "round": rounds}
+                        for pair, (mean, half_width, n, rounds) in self.settled.items()],
+            "unsettled": [list(pair) for pair in sorted(self.unsettled)],
+        }
+
+    def save(self, scores):
+        with open(f"{scores.get_sampling_path()}.tmp", "w") as f:
+            json.dump(self.summary(scores), f, indent=1)
+        os.replace(f"{scores.get_sampling_path()}.tmp", scores.get_sampling_path())
+
+    def summary_line(self, scores):
+        total = len(self.systems) * self.segment_count
+        pairs = len(self.settled) + len(self.unsettled)
+        scored = sum(int((~np.isnan(scores.get_scores(system, self.order[:self.position]))).sum()) for system in self.systems)
+        return f"{scored}/{total} segments scored ({scored / max(total, 1):.0%}), {len(self.settled)}/{pairs} system pairs settled after {self.rounds} rounds"
+
+
+def finite(value):
+    # JSON has no NaN or infinity, unknown estimates are written as null
+    return value if math.isfinite(value) else None
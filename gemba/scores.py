@@ -1,10 +1,37 @@
 from pathlib import Path
 import os
-import pandas as pd
+import numpy as np
+from gemba.columnar import ColumnStore
+
+
+def format_score(value):
+    # missing scores are written as None, integral answers without a decimal point as before
+    value = float(value)
+    if value != value:
+        return "None"
+    if value.is_integer():
+        return str(int(value))
+    return repr(value)
 
 
 class Scores:
-    def __init__(self, name, testset, refname, output_path=None):
+    """
+    Segment scores of one metric for all systems of a testset.
+
+    Scores and temperatures are contiguous float arrays with one block of
+    `segment_count` values per system and NaN marking missing values; the block
+    of a system is found through a precomputed system -> offset index, so reading
+    or assigning a score costs the same however large the testset is. The TSVs are
+    read through their compiled sidecars (see `gemba.columnar.ColumnStore`), parsed
+    only when they changed.
+
+    Assignments are appended to a sidecar delta log every `checkpoint_every` scores
+    and replayed on load, so a crash loses at most one checkpoint. `save` compacts
+    the log into the MTME files with atomic renames. System and domain means come
+    from running sums and counts updated on every assignment.
+    """
+
+    def __init__(self, name, testset, refname, output_path=None, checkpoint_every=1000, compact_every=None):
         self.name = name
         self.testset = testset
         self.refname = refname
@@ -13,13 +40,31 @@ class Scores:
 
         self.output_path = output_path
 
-        self.seg_scores = None
-        self.metadata = None
+        self.segment_count = len(testset.sources)
+        self.systems = []
+        self.offsets = {}
+        self.scores = None
+        self.temperatures = None
         self.prefix = None
+        self.columns = None
+
+        # domain of every segment, and running sums and counts per system (and domain)
+        self.domains, self.domain_ids = np.unique([x.split("\t")[0] for x in testset.documents], return_inverse=True)
+        self.sys_sums = None
+        self.sys_counts = None
+        self.domain_sums = None
+        self.domain_counts = None
+
+        # assignments not in the delta log yet, and entries of the log since the last compaction
+        self.checkpoint_every = checkpoint_every
+        self.compact_every = compact_every
+        self.pending = []
+        self.pending_count = 0
+        self.delta_entries = 0
         self.load()
 
     def load(self):
-        output_folder = f"{self.testset.basepath}/{self.testset.dataset}/metric-scores/{self.testset.lp}"
+        output_folder = f"{self.output_path}/{self.testset.dataset}/metric-scores/{self.testset.lp}"
         Path(output_folder).mkdir(parents=True, exist_ok=True)
 
         if self.refname is not None:
@@ -27,32 +72,75 @@ class Scores:
         else:
             self.prefix = f"{output_folder}/{self.name}-src"
 
-        seg_scores_file = self.get_seg_path()
-        if os.path.isfile(f"{seg_scores_file}"):
-            self.seg_scores = pd.read_csv(seg_scores_file, sep="\t", names=["system", "score"], index_col=False)
-        else:
-            self.seg_scores = pd.DataFrame(columns=["system", "score"])
-
-        if os.path.isfile(f"{self.get_meta_path()}"):
-            self.metadata = pd.read_csv(self.get_meta_path(), sep="\t", names=["system", "temperature"], index_col=False)
-        else:
-            self.metadata = pd.DataFrame(columns=["system", "temperature"])
+        self.columns = ColumnStore(output_folder)
+        seg_scores = self.columns.load(self.get_seg_path())
+        metadata = self.columns.load(self.get_meta_path())
 
-        # generate placeholders for scores
-        segment_count = len(self.testset.sources)
+        # systems keep the order of the existing file, new systems are appended
+        systems = list(dict.fromkeys(seg_scores.systems)) if seg_scores is not None else []
         for system in self.testset.systems.keys():
-            if system not in self.seg_scores["system"].values:
-                # generate placeholders for scores
-                placeholder = pd.DataFrame([{"system": system, 'score': 'None'}] * segment_count)
-                self.seg_scores = pd.concat([self.seg_scores, placeholder], ignore_index=True)
+            if system not in systems:
+                systems.append(system)
+        for system in systems:
+            self.offsets[system] = len(self.systems) * self.segment_count
+            self.systems.append(system)
 
-            if system not in self.metadata["system"].values:
-                placeholder = pd.DataFrame([{"system": system, 'temperature': 'None'}] * segment_count)
-                self.metadata = pd.concat([self.metadata, placeholder], ignore_index=True)
+        self.scores = self.to_array(seg_scores)
+        self.temperatures = self.to_array(metadata)
+        self.replay_delta()
+        self.build_aggregates()
 
-            # check that all systems are present and have correct number of scores
-            assert len(self.seg_scores[self.seg_scores.system == system]) == segment_count
-            assert len(self.metadata[self.metadata.system == system]) == segment_count
+        # compaction rewrites every score, by default once the log holds a quarter of them
+        if self.compact_every is None:
+            self.compact_every = max(len(self.scores) // 4, self.checkpoint_every)
+
+    def replay_delta(self):
+        if not os.path.isfile(self.get_delta_path()):
+            return
+        end = 0
+        with open(self.get_delta_path(), "rb") as f:
+            for line in f:
+                fields = line.decode("utf-8", errors="replace").rstrip("\n").split("\t")
+                # the last line may be torn by a crash
+                if not line.endswith(b"\n") or len(fields) != 4:
+                    break
+                end += len(line)
+                system, segment, score, temperature = fields
+                if system not in self.offsets:
+                    continue
+                index = self.offsets[system] + int(segment)
+                self.scores[index] = np.nan if score == "None" else float(score)
+                self.temperatures[index] = np.nan if temperature == "None" else float(temperature)
+                self.delta_entries += 1
+
+        # cut off a torn line, later checkpoints append after the last complete one
+        if end < os.path.getsize(self.get_delta_path()):
+            with open(self.get_delta_path(), "r+b") as f:
+                f.truncate(end)
+
+    def build_aggregates(self):
+        blocks = self.scores.reshape(len(self.systems), self.segment_count)
+        scored = ~np.isnan(blocks)
+        values = np.where(scored, blocks, 0.0)
+        self.sys_sums = values.sum(axis=1)
+        self.sys_counts = scored.sum(axis=1)
+        self.domain_sums = np.zeros((len(self.systems), len(self.domains)))
+        self.domain_counts = np.zeros((len(self.systems), len(self.domains)), dtype=np.int64)
+        for domain in range(len(self.domains)):
+            in_domain = self.domain_ids == domain
+            self.domain_sums[:, domain] = values[:, in_domain].sum(axis=1)
+            self.domain_counts[:, domain] = scored[:, in_domain].sum(axis=1)
+
+    def to_array(self, column):
+        values = np.full(len(self.systems) * self.segment_count, np.nan)
+        if column is None:
+            return values
+        for system, scores in column.by_system().items():
+            # check that all systems have correct number of scores
+            assert len(scores) == self.segment_count, f"System {system} has {len(scores)} scores, expected {self.segment_count}"
+            offset = self.offsets[system]
+            values[offset:offset + self.segment_count] = scores
+        return values
 
     def get_seg_path(self):
         return f"{self.prefix}.seg.score"
@@ -66,38 +154,164 @@ class Scores:
     def get_meta_path(self):
         return f"{self.prefix}.seg.meta"
 
+    def get_delta_path(self):
+        return f"{self.prefix}.seg.delta"
+
+    def get_sampling_path(self):
+        # what gemba.sampling scored, when not all segments were
+        return f"{self.prefix}.sampling.json"
+
     def _remap_index(self, system, hypothesis_index):
-        # the order of systems may be different
-        # get id of the first hypothesis of the system
-        index = (self.seg_scores["system"] == system).argmax()
-        h = hypothesis_index % len(self.testset.sources)
-        return index + h
+        # hypothesis indices of Testset.iterate_over_all run over all systems
+        return self.offsets[system] + hypothesis_index % self.segment_count
+
+    def _remap_indices(self, system, hypothesis_indices):
+        return self.offsets[system] + np.asarray(hypothesis_indices, dtype=np.int64) % self.segment_count
 
     def get_score(self, system, hypothesis_index):
-        index = self._remap_index(system, hypothesis_index)
-        return self.seg_scores.iloc[index]['score']
+        """Score of a segment, None when it has not been scored yet"""
+        score = self.scores[self._remap_index(system, hypothesis_index)]
+        return None if np.isnan(score) else float(score)
+
+    def has_score(self, system, hypothesis_index):
+        return not np.isnan(self.scores[self._remap_index(system, hypothesis_index)])
 
     def assign_score(self, system, hypothesis_index, answer, temperature=None):
         index = self._remap_index(system, hypothesis_index)
-        self.seg_scores.iloc[index]['score'] = answer
-        self.metadata.iloc[index]['temperature'] = temperature
+        row, segment = divmod(index, self.segment_count)
+        domain = self.domain_ids[segment]
+
+        old = self.scores[index]
+        if not np.isnan(old):
+            self.sys_sums[row] -= old
+            self.sys_counts[row] -= 1
+            self.domain_sums[row, domain] -= old
+            self.domain_counts[row, domain] -= 1
+        if answer is not None:
+            self.sys_sums[row] += answer
+            self.sys_counts[row] += 1
+            self.domain_sums[row, domain] += answer
+            self.domain_counts[row, domain] += 1
+
+        self.scores[index] = np.nan if answer is None else answer
+        self.temperatures[index] = np.nan if temperature is None else temperature
+        self.log_assignments(np.array([index]))
+
+    def get_scores(self, system, hypothesis_indices=None):
+        """Scores of a system as a float array with NaN for missing scores (all segments by default)"""
+        offset = self.offsets[system]
+        if hypothesis_indices is None:
+            return self.scores[offset:offset + self.segment_count].copy()
+        return self.scores[self._remap_indices(system, hypothesis_indices)]
+
+    def missing_mask(self, system):
+        offset = self.offsets[system]
+        return np.isnan(self.scores[offset:offset + self.segment_count])
+
+    def assign_scores(self, system, hypothesis_indices, answers, temperatures=None):
+        """Assign many scores of a system at once, None answers or temperatures are stored as missing"""
+        indices = self._remap_indices(system, hypothesis_indices)
+        answers = np.array([np.nan if answer is None else answer for answer in answers], dtype=float)
+        if temperatures is None:
+            temperatures = np.full(len(indices), np.nan)
+        else:
+            temperatures = np.array([np.nan if t is None else t for t in temperatures], dtype=float)
+
+        # a segment assigned twice keeps its last score
+        _, last = np.unique(indices[::-1], return_index=True)
+        keep = len(indices) - 1 - last
+        indices, answers, temperatures = indices[keep], answers[keep], temperatures[keep]
+
+        rows, segments = np.divmod(indices, self.segment_count)
+        domains = self.domain_ids[segments]
+        for values, sign in [(self.scores[indices], -1), (answers, 1)]:
+            scored = ~np.isnan(values)
+            np.add.at(self.sys_sums, rows[scored], sign * values[scored])
+            np.add.at(self.sys_counts, rows[scored], sign)
+            np.add.at(self.domain_sums, (rows[scored], domains[scored]), sign * values[scored])
+            np.add.at(self.domain_counts, (rows[scored], domains[scored]), sign)
+
+        self.scores[indices] = answers
+        self.temperatures[indices] = temperatures
+        self.log_assignments(indices)
+
+    def merge(self, other):
+        """Take over every score of `other`, e.g. the scores of one shard, missing scores are left alone"""
+        for system in other.systems:
+            if system not in self.offsets:
+                continue
+            offset = other.offsets[system]
+            scores = other.scores[offset:offset + other.segment_count]
+            present = np.flatnonzero(~np.isnan(scores))
+            temperatures = other.temperatures[offset + present]
+            self.assign_scores(system, present, scores[present].tolist(), temperatures.tolist())
+
+    def log_assignments(self, indices):
+        self.pending.append(indices)
+        self.pending_count += len(indices)
+        if self.pending_count >= self.checkpoint_every:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Append the assignments since the last checkpoint to the delta log"""
+        if not self.pending:
+            return
+        lines = []
+        for indices in self.pending:
+            for index in indices:
+                row, segment = divmod(int(index), self.segment_count)
+                lines.append(f"{self.systems[row]}\t{segment}\t{format_score(self.scores[index])}\t{format_score(self.temperatures[index])}\n")
+        with open(self.get_delta_path(), "a") as f:
+            f.write("".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+        self.pending = []
+        self.pending_count = 0
+        self.delta_entries += len(lines)
+
+        if self.delta_entries >= self.compact_every:
+            self.save()
+
+    def write_column(self, path, values):
+        with open(path, "w") as f:
+            for system in self.systems:
+                offset = self.offsets[system]
+                f.writelines(f"{system}\t{format_score(value)}\n" for value in values[offset:offset + self.segment_count].tolist())
+
+    def means(self, sums, counts):
+        # NaN for groups without any score
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
 
     def save(self):
+        """Compact the scores into the MTME files, each written to a temporary file and renamed over the old one"""
+        order = sorted(range(len(self.systems)), key=lambda i: self.systems[i])
+
         # segment level scores
-        self.seg_scores.to_csv(self.get_seg_path(), sep="\t", index=False, header=False, na_rep="None")
+        self.write_column(f"{self.get_seg_path()}.tmp", self.scores)
 
         # system scores
-        self.seg_scores.score = self.seg_scores.score.replace("None", None).astype(float)
-        sys_scores_df = self.seg_scores.groupby(['system'], as_index=False, dropna=True).mean()
-        sys_scores_df.to_csv(self.get_sys_path(), sep="\t", index=False, header=False, na_rep="None")
+        means = self.means(self.sys_sums, self.sys_counts)
+        with open(f"{self.get_sys_path()}.tmp", "w") as f:
+            for i in order:
+                f.write(f"{self.systems[i]}\t{format_score(means[i])}\n")
 
         # domain scores
-        df = self.seg_scores.copy()
-        documents = self.testset.documents
-        total_systems = len(self.testset.systems)
-        df["domains"] = pd.DataFrame([x.split("\t")[0] for x in documents] * total_systems)[0]
-        df = df.groupby(["domains", 'system'], as_index=False, dropna=True).mean()
-        df.to_csv(self.get_domain_path(), sep="\t", index=False, header=False, na_rep="None")
+        means = self.means(self.domain_sums, self.domain_counts)
+        with open(f"{self.get_domain_path()}.tmp", "w") as f:
+            for domain, name in enumerate(self.domains):
+                for i in order:
+                    f.write(f"{name}\t{self.systems[i]}\t{format_score(means[i, domain])}\n")
 
         # metadata
-        self.metadata.to_csv(self.get_meta_path(), sep="\t", index=False, header=False, na_rep="None")
+        self.write_column(f"{self.get_meta_path()}.tmp", self.temperatures)
+
+        for path in [self.get_seg_path(), self.get_sys_path(), self.get_domain_path(), self.get_meta_path()]:
+            os.replace(f"{path}.tmp", path)
+
+        # everything in the log is in the files now, replaying it again would be harmless
+        if os.path.isfile(self.get_delta_path()):
+            os.remove(self.get_delta_path())
+        self.pending = []
+        self.pending_count = 0
+        self.delta_entries = 0
@@ -0,0 +1,30 @@
+import hashlib
+
+
+def parse_shard(spec):
+    """Parse "i/N" (0 <= i < N) into (i, N), None stays None"""
+    if spec is None:
+        return None
+    try:
+        index, count = (int(x) for x in spec.split("/"))
+    except ValueError:
+        raise Exception(f"Shard must be given as i/N, got {spec}.")
+    if count < 1 or not 0 <= index < count:
+        raise Exception(f"Shard {spec} out of range, i must be between 0 and N-1.")
+    return index, count
+
+
+def shard_of(key, count):
+    """
+    Shard of a segment, a stable hash of the text it is scored on.
+
+    Unlike Python's hash() it is the same in every process and on every machine.
+    Identical segments land in the same shard, so they are still requested once.
+    """
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+
+def shard_name(shard):
+    index, count = shard
+    return f"shard-{index}-of-{count}"
@@ -0,0 +1,218 @@
+import numpy as np
+from scipy import stats
+
+# Kendall correlations over at most this many pairs of points are computed from pairwise
+# sign matrices, vectorized over metrics and resamples; larger inputs (segment-level
+# correlations without averaging) go through scipy one resample at a time
+PAIRWISE_LIMIT = 5000
+
+
+def as_matrix(scores, num_sys):
+    """Scores grouped by system (as in mt_metrics_eval.stats.Correlation) as a (num_sys, num_items) array, NaN for None"""
+    return np.array([np.nan if x is None else x for x in scores], dtype=float).reshape(num_sys, -1)
+
+
+def bootstrap_indices(rng, n, k):
+    """k resamples of n units drawn with replacement, one row of unit indices per resample"""
+    return rng.integers(0, n, size=(k, n))
+
+
+def bootstrap_counts(indices, n):
+    """How often each unit is drawn in each resample, (k, n); statistics are weighted by these counts"""
+    k = len(indices)
+    return np.bincount((indices + n * np.arange(k)[:, None]).ravel(), minlength=k * n).reshape(k, n).astype(float)
+
+
+def weighted_pearson(gold, metrics, weights):
+    """
+    Pearson correlation of every metric with gold, for every row of unit weights.
+
+    gold is (blocks, units) and metrics (num_metrics, blocks, units); a unit is resampled
+    with all its blocks (e.g. a segment with the scores of all systems). Returns (k, num_metrics).
+    """
+    valid = ~np.isnan(metrics) & ~np.isnan(gold)
+    count = valid.sum(axis=(1, 2))
+    # centered, so the sums of squares do not cancel out
+    x = np.where(valid, metrics, 0.0)
+    x = np.where(valid, x - (x.sum(axis=(1, 2)) / np.maximum(count, 1))[:, None, None], 0.0)
+    y = np.where(valid, gold, 0.0)
+    y = np.where(valid, y - (y.sum(axis=(1, 2)) / np.maximum(count, 1))[:, None, None], 0.0)
+
+    # sums over the blocks of a unit first, then over the weighted units of every resample
+    n = weights @ valid.sum(axis=1).T
+    sx = weights @ x.sum(axis=1).T
+    sy = weights @ y.sum(axis=1).T
+    sxx = weights @ (x * x).sum(axis=1).T
+    syy = weights @ (y * y).sum(axis=1).T
+    sxy = weights @ (x * y).sum(axis=1).T
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (n * sxy - sx * sy) / np.sqrt((n * sxx - sx * sx) * (n * syy - sy * sy))
+
+
+def weighted_kendall(gold, metrics, weights):
+    """
+    Kendall tau-b of every metric with gold, for every row of unit weights, same arguments as `weighted_pearson`.
+
+    A pair of points counts with the product of the weights of their units. Copies of the same
+    point are tied in both scores and drop out of tau-b, as they do for scipy on resampled data.
+    """
+    blocks, units = gold.shape
+    point_units = np.tile(np.arange(units), blocks)
+    gold = gold.ravel()
+    metrics = metrics.reshape(len(metrics), -1)
+    a, b = np.triu_indices(len(gold), 1)
+    if len(a) > PAIRWISE_LIMIT:
+        return looped_kendall(gold, metrics, weights, point_units)
+
+    sy = np.sign(gold[a] - gold[b])
+    sx = np.sign(metrics[:, a] - metrics[:, b])
+    valid = ~np.isnan(sx) & ~np.isnan(sy)
+    pair_weights = weights[:, point_units[a]] * weights[:, point_units[b]]
+    concordance = pair_weights @ np.where(valid, sx * sy, 0.0).T
+    untied_x = pair_weights @ (valid & (sx != 0)).T
+    untied_y = pair_weights @ (valid & (sy != 0)).T
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return concordance / np.sqrt(untied_x * untied_y)
+
+
+def looped_kendall(gold, metrics, weights, point_units):
+    result = np.full((len(weights), len(metrics)), np.nan)
+    for i, row in enumerate(weights):
+        selected = np.repeat(np.arange(len(gold)), row[point_units].astype(int))
+        for j, metric in enumerate(metrics):
+            result[i, j] = kendall(gold[selected], metric[selected])
+    return result
+
+
+def kendall(gold, metric):
+    valid = ~np.isnan(gold) & ~np.isnan(metric)
+    if valid.sum() < 2:
+        return np.nan
+    return stats.kendalltau(gold[valid], metric[valid])[0]
+
+
+def group_correlations(gold, metrics, corr):
+    """Correlation of every metric within every group (row) of gold (groups, members), (num_metrics, groups)"""
+    if corr == "pearson":
+        return pearson_by_group(gold, metrics)
+    members = gold.shape[1]
+    if members * (members - 1) // 2 <= PAIRWISE_LIMIT:
+        return np.stack([weighted_kendall(gold[g][None], metrics[:, g][:, None], np.ones((1, members)))[0] for g in range(len(gold))], axis=1)
+    return np.array([[kendall(gold[g], metric[g]) for g in range(len(gold))] for metric in metrics])
+
+
+def pearson_by_group(gold, metrics):
+    # vectorized over the groups, e.g. the systems of every segment
+    valid = ~np.isnan(metrics) & ~np.isnan(gold)
+    n = valid.sum(axis=2)
+    x = np.where(valid, metrics, 0.0)
+    x = np.where(valid, x - x.sum(axis=2, keepdims=True) / np.maximum(n, 1)[..., None], 0.0)
+    y = np.where(valid, gold, 0.0)
+    y = np.where(valid, y - y.sum(axis=2, keepdims=True) / np.maximum(n, 1)[..., None], 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        corr = (x * y).sum(axis=2) / np.sqrt((x * x).sum(axis=2) * (y * y).sum(axis=2))
+    return np.where(n >= 2, corr, np.nan)
+
+
+def weighted_average(corrs, weights):
+    """Mean of the group correlations (num_metrics, groups) for every row of group weights, NaN correlations are left out"""
+    valid = ~np.isnan(corrs)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (weights @ np.where(valid, corrs, 0.0).T) / (weights @ valid.T)
+
+
+def assign_ranks(sig_matrix, pval):
+    """
+    Rank of the significance cluster of every metric, metrics sorted by decreasing score.
+
+    A metric starts a new cluster when it is significantly worse than any metric of the current one.
+    """
+    ranks = []
+    rank = 1
+    start = 0
+    for i in range(len(sig_matrix)):
+        if any(sig_matrix[j, i] < pval for j in range(start, i)):
+            rank += 1
+            start = i
+        ranks.append(rank)
+    return ranks
+
+
+def rank_metrics(names, scores, samples, pval):
+    """
+    Sort metrics by score and test every pair with a paired bootstrap.
+
+    sig_matrix[i, j] is the p-value of metric i (the better one, i < j) not being better than metric j:
+    the share of resamples whose difference, shifted to mean zero, is at least the observed one.
+    Returns the same as mt_metrics_eval.data.CompareMetrics: name -> (score, rank) and sig_matrix.
+    """
+    order = np.argsort(-np.nan_to_num(scores, nan=-np.inf), kind="stable")
+    scores = scores[order]
+    samples = samples[:, order]
+    deltas = scores[:, None] - scores[None, :]
+    sig_matrix = np.zeros((len(scores), len(scores)))
+    for i in range(len(scores)):
+        sample_deltas = samples[:, i:i + 1] - samples
+        sig_matrix[i] = (sample_deltas - deltas[i] >= deltas[i]).mean(axis=0)
+    ranks = assign_ranks(sig_matrix, pval)
+    return {names[m]: (float(scores[i]), ranks[i]) for i, m in enumerate(order)}, sig_matrix
+
+
+def compare_metrics(names, gold, metrics, corr, average_by="none", k=1000, pval=0.05, seed=0):
+    """
+    Vectorized counterpart of mt_metrics_eval.data.CompareMetrics with bootstrap significance.
+
+    gold is (num_sys, num_items), metrics (num_metrics, num_sys, num_items), NaN marks missing scores.
+    average_by "sys" or "item" averages the correlations within every system or item and resamples
+    those; without averaging segments are resampled with the scores of all systems, at system level
+    (one item per system) the systems. All k resamples are drawn at once as index arrays.
+    """
+    rng = np.random.default_rng(seed)
+    if average_by in ("sys", "item"):
+        if average_by == "item":
+            gold, metrics = gold.T, metrics.transpose(0, 2, 1)
+        corrs = group_correlations(gold, metrics, corr)
+        weights = bootstrap_counts(bootstrap_indices(rng, len(gold), k), len(gold))
+        scores = weighted_average(corrs, np.ones((1, len(gold))))[0]
+        samples = weighted_average(corrs, weights)
+    else:
+        if gold.shape[1] == 1:
+            gold, metrics = gold.T, metrics.transpose(0, 2, 1)
+        correlation = weighted_pearson if corr == "pearson" else weighted_kendall
+        units = gold.shape[1]
+        scores = correlation(gold, metrics, np.ones((1, units)))[0]
+        samples = correlation(gold, metrics, bootstrap_counts(bootstrap_indices(rng, units, k), units))
+    return rank_metrics(names, scores, samples, pval)
+
+
+def pair_agreements(gold, metrics, weights):
+    """Weighted number of system pairs ordered like gold, and of comparable pairs, (k, num_metrics) each"""
+    a, b = np.triu_indices(len(gold), 1)
+    gold_sign = np.sign(gold[a] - gold[b])
+    metric_sign = np.sign(metrics[:, a] - metrics[:, b])
+    valid = ~np.isnan(gold_sign) & ~np.isnan(metric_sign)
+    pair_weights = weights[:, a] * weights[:, b]
+    # two copies of a resampled system are a pair as well, tied in both scores
+    copies = weights * (weights - 1) / 2
+    present = ~np.isnan(gold) & ~np.isnan(metrics)
+    return pair_weights @ (valid & (metric_sign == gold_sign)).T + copies @ present.T, pair_weights @ valid.T + copies @ present.T
+
+
+def compare_accuracy(names, golds, metrics, k=1000, pval=0.05, seed=0):
+    """
+    Vectorized counterpart of mt_metrics_eval.data.CompareMetricsWithGlobalAccuracy with bootstrap significance.
+
+    golds holds the system scores (num_sys,) of every language pair, metrics the (num_metrics, num_sys)
+    scores of the same metrics. Pairwise accuracy counts the system pairs of all language pairs
+    that a metric orders like gold; the systems of every language pair are resampled.
+    """
+    rng = np.random.default_rng(seed)
+    agreed, compared = 0.0, 0.0
+    sample_agreed, sample_compared = 0.0, 0.0
+    for gold, scores in zip(golds, metrics):
+        point = pair_agreements(gold, scores, np.ones((1, len(gold))))
+        samples = pair_agreements(gold, scores, bootstrap_counts(bootstrap_indices(rng, len(gold), k), len(gold)))
+        agreed, compared = agreed + point[0], compared + point[1]
+        sample_agreed, sample_compared = sample_agreed + samples[0], sample_compared + samples[1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return rank_metrics(names, (agreed / compared)[0], sample_agreed / sample_compared, pval)
@@ -0,0 +1,188 @@
+import json
+import time
+import random
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# method of the prompt being processed, set by `Telemetry.scope` for the calls made on its behalf
+CURRENT_METHOD = contextvars.ContextVar("gemba_method", default=None)
+
+# latency quantiles reported in the summary and on the metrics endpoint
+QUANTILES = (0.5, 0.95, 0.99)
+
+# counters shown in the summary, in this order
+SUMMARY_COUNTERS = ["attempts", "cache_hits", "cache_misses", "escalations", "parsed", "unparsed", "no_answer", "truncated", "api_calls", "retries", "errors"]
+TOKEN_COUNTERS = ["input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens"]
+
+
+class Samples:
+    """
+    Count, sum and a uniform reservoir of observed values, for quantiles in bounded memory.
+    """
+
+    def __init__(self, size=10000):
+        self.size = size
+        self.count = 0
+        self.sum = 0.0
+        self.reservoir = []
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        if len(self.reservoir) < self.size:
+            self.reservoir.append(value)
+        else:
+            slot = random.randrange(self.count)
+            if slot < self.size:
+                self.reservoir[slot] = value
+
+    def quantile(self, q):
+        if not self.reservoir:
+            return 0.0
+        values = sorted(self.reservoir)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Telemetry:
+    """
+    Counters and latency samples of a GptApi, labelled by model and method.
+
+    The engines report attempts, cache hits and misses, parse outcomes, temperature
+    escalations, API calls, retries, errors and token usage as counters, and the
+    queue wait (rate limiter and concurrency slot) and network latency of every call
+    as samples. Every event is also appended to the JSON-lines file at `path`, if given.
+
+    Methods are told apart by the parse function of their prompts, name them with
+    `name_method`; calls of unnamed parsers are labelled `method` (default: "unknown").
+    """
+
+    def __init__(self, path=None, method=None):
+        self.lock = threading.Lock()
+        self.method = method or "unknown"
+        self.methods = {}
+        self.counters = {}
+        self.samples = {}
+        self.file = open(path, "a", encoding="utf-8") if path else None
+
+    def name_method(self, parse_response, method):
+        self.methods[parse_response] = method
+
+    @contextmanager
+    def scope(self, parse_response):
+        """Label the events of the enclosed calls (in this thread or task) with the method of `parse_response`"""
+        token = CURRENT_METHOD.set(self.methods.get(parse_response, self.method))
+        try:
+            yield
+        finally:
+            CURRENT_METHOD.reset(token)
+
+    def labels(self, model):
+        return model, CURRENT_METHOD.get() or self.method
+
+    def count(self, model, name, amount=1):
+        labels = self.labels(model)
+        with self.lock:
+            series = self.counters.setdefault(labels, {})
+            series[name] = series.get(name, 0) + amount
+            self.write(labels, name, amount)
+
+    def observe(self, model, name, seconds):
+        labels = self.labels(model)
+        with self.lock:
+            self.samples.setdefault(labels, {}).setdefault(name, Samples()).add(seconds)
+            self.write(labels, name, seconds)
+
+    def record_usage(self, model, usage):
+        for name in TOKEN_COUNTERS:
+            # cache fields are missing or None when prompt caching was not involved
+            tokens = getattr(usage, name, None) or 0
+            if tokens:
+                self.count(model, name, tokens)
+
+    def write(self, labels, name, value):
+        # must be called with the lock held
+        if self.file is not None:
+            model, method = labels
+            self.file.write(json.dumps({"time": time.time(), "model": model, "method": method, "event": name, "value": value}) + "\n")
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    # reporting
+
+    def summary(self):
+        with self.lock:
+            labels = sorted(set(self.counters) | set(self.samples))
+            lines = []
+            for model, method in labels:
+                counters = self.counters.get((model, method), {})
+                samples = self.samples.get((model, method), {})
+                parts = [f"{counters.get(name, 0)} {name.replace('_', ' ')}" for name in SUMMARY_COUNTERS]
+                latency = samples.get("latency")
+                if latency is not None:
+                    parts.append("latency " + " ".join(f"p{int(q * 100)} {latency.quantile(q):.2f}s" for q in QUANTILES))
+                wait = samples.get("queue_wait")
+                if wait is not None:
+                    parts.append(f"queue wait mean {wait.sum / wait.count:.2f}s p95 {wait.quantile(0.95):.2f}s")
+                parts.append("tokens " + ", ".join(f"{counters.get(name, 0)} {name.replace('_input_tokens', '').replace('_tokens', '').replace('_', ' ')}" for name in TOKEN_COUNTERS))
+                lines.append(f"{model} {method}: " + ", ".join(parts))
+        return "\n".join(lines)
+
+    def prometheus_text(self):
+        """Counters and samples in the Prometheus text exposition format"""
+        def labels_text(model, method, **extra):
+            pairs = {"model": model, "method": method, **extra}
+            return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in pairs.items()) + "}"
+
+        with self.lock:
+            lines = ["# TYPE gemba_events_total counter"]
+            for (model, method), counters in sorted(self.counters.items()):
+                for name, value in sorted(counters.items()):
+                    lines.append(f"gemba_events_total{labels_text(model, method, event=name)} {value}")
+
+            names = sorted({name for series in self.samples.values() for name in series})
+            for name in names:
+                metric = f"gemba_{name}_seconds"
+                lines.append(f"# TYPE {metric} summary")
+                for (model, method), series in sorted(self.samples.items()):
+                    samples = series.get(name)
+                    if samples is None:
+                        continue
+                    for q in QUANTILES:
+                        lines.append(f"{metric}{labels_text(model, method, quantile=str(q))} {samples.quantile(q)}")
+                    lines.append(f"{metric}_sum{labels_text(model, method)} {samples.sum}")
+                    lines.append(f"{metric}_count{labels_text(model, method)} {samples.count}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="127.0.0.1"):
+        """Serve `prometheus_text` on http://host:port/metrics from a daemon thread, returns the server"""
+        telemetry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = telemetry.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # scrapes would otherwise be logged to stderr next to the progress bars
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
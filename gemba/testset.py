@@ -1,12 +1,135 @@
 import glob
+import hashlib
+import mmap
 import os
+import numpy as np
+
+# line offsets of the segment files, kept apart from the (possibly read-only) data
+DEFAULT_INDEX_DIR = "cache/offsets"
+
+
+class SegmentFile:
+    """
+    Read-only, memory-mapped list of the lines of a segment file.
+
+    The file is mapped on first access and segments are decoded on demand, with
+    trailing whitespace stripped as before. The byte offset of every line is found
+    once and cached in `index_dir`, under a digest of the absolute path, size and
+    modification time of the file, so a changed file gets a new index; without a
+    writable `index_dir` the offsets are kept in memory only.
+    """
+
+    # lines decoded at once while iterating
+    chunk_lines = 4096
+
+    def __init__(self, path, index_dir=DEFAULT_INDEX_DIR):
+        self.path = path
+        self.index_dir = index_dir
+        self.data = None
+        self.offsets = None
+
+    def index_path(self, stat):
+        key = f"{os.path.abspath(self.path)}\0{stat.st_size}\0{stat.st_mtime_ns}"
+        return os.path.join(self.index_dir, f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.npy")
+
+    def open(self):
+        if self.offsets is not None:
+            return
+        stat = os.stat(self.path)
+        with open(self.path, "rb") as f:
+            # empty files cannot be mapped
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else b""
+
+        self.offsets = self.load_index(stat)
+        if self.offsets is None:
+            self.offsets = self.build_index()
+            self.save_index(stat)
+
+    def load_index(self, stat):
+        try:
+            index = np.load(self.index_path(stat), mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        # the offsets end at the end of the file
+        if len(index) < 1 or index[-1] != stat.st_size:
+            return None
+        return index
+
+    def save_index(self, stat):
+        path = self.index_path(stat)
+        try:
+            os.makedirs(self.index_dir, exist_ok=True)
+            with open(f"{path}.{os.getpid()}.tmp", "wb") as f:
+                np.save(f, self.offsets.astype(np.int64))
+            os.replace(f"{path}.{os.getpid()}.tmp", path)
+        except OSError:
+            # no writable cache, the index is kept in memory only
+            pass
+
+    def build_index(self):
+        # start of every line plus the end of the file, newlines are searched in blocks to bound memory
+        size = len(self.data)
+        block = 64 * 1024 * 1024
+        starts = [np.zeros(1, dtype=np.int64)]
+        for begin in range(0, size, block):
+            view = np.frombuffer(self.data, dtype=np.uint8, count=min(block, size - begin), offset=begin)
+            starts.append(np.flatnonzero(view == ord("\n")).astype(np.int64) + begin + 1)
+        offsets = np.concatenate(starts)
+        # a last line without newline is a segment as well
+        if size and self.data[size - 1:size] != b"\n":
+            offsets = np.append(offsets, size)
+        return offsets
+
+    def __len__(self):
+        self.open()
+        return len(self.offsets) - 1
+
+    def decode(self, start, end):
+        return self.data[start:end].decode("utf-8").rstrip()
+
+    def __getitem__(self, index):
+        self.open()
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Segment {index} out of range for {self.path}")
+        return self.decode(int(self.offsets[index]), int(self.offsets[index + 1]))
+
+    def __iter__(self):
+        self.open()
+        for begin in range(0, len(self), self.chunk_lines):
+            end = min(begin + self.chunk_lines, len(self))
+            start = int(self.offsets[begin])
+            chunk = self.data[start:int(self.offsets[end])].decode("utf-8")
+            lines = chunk.split("\n")
+            # the chunk ends with a newline unless it holds the unterminated last line
+            for line in lines[:end - begin]:
+                yield line.rstrip()
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.data = None
+        self.offsets = None
 
 
 class Testset:
-    def __init__(self, basepath, dataset, lp):
+    """
+    Sources, references, system outputs and documents of one language pair in the
+    mt-metrics-eval layout.
+
+    Files are memory-mapped lazily (see `SegmentFile`), so only the segments that
+    are used get read. `systems` and `references` restrict the testset to a subset
+    of the system outputs and references, by default all of them are listed.
+    """
+
+    def __init__(self, basepath, dataset, lp, systems=None, references=None, index_dir=DEFAULT_INDEX_DIR):
         self.basepath = basepath
         self.dataset = dataset
         self.lp = lp
+        self.index_dir = index_dir
 
         self.sources = []
         self.references = {}
@@ -14,45 +137,54 @@ class Testset:
         self.documents = []
         self.main_ref = None
 
-        self.load()
+        self.load(systems, references)
 
-    def load(self):
+    def load(self, systems=None, references=None):
         dataset = f"{self.basepath}/{self.dataset}"
 
-        self.sources = self.load_segment_files(f"{dataset}/sources/{self.lp}.txt")
+        self.sources = SegmentFile(f"{dataset}/sources/{self.lp}.txt", self.index_dir)
 
         # list all files in references folder
         refs = glob.glob(f"{dataset}/references/{self.lp}.*.txt")
         for reffile in refs:
             refname = reffile.split('.')[-2]
+            if references is not None and refname not in references:
+                continue
             if self.main_ref is None:
                 self.main_ref = refname
-            self.references[refname] = self.load_segment_files(reffile)
+            self.references[refname] = SegmentFile(reffile, self.index_dir)
 
-        systems = f"{dataset}/system-outputs/{self.lp}"
+        system_folder = f"{dataset}/system-outputs/{self.lp}"
         # keep systems in order
-        all_systems = sorted(os.listdir(systems))
+        all_systems = sorted(os.listdir(system_folder))
         for system in all_systems:
             systemname = system.replace(".txt", "")
-            self.systems[systemname] = self.load_segment_files(f"{systems}/{system}")
+            if systems is not None and systemname not in systems:
+                continue
+            self.systems[systemname] = SegmentFile(f"{system_folder}/{system}", self.index_dir)
+
+        for kind, requested, found in [("System", systems, self.systems), ("Reference", references, self.references)]:
+            missing = [name for name in requested or [] if name not in found]
+            if missing:
+                raise Exception(f"{kind} {', '.join(missing)} not found in {dataset} for {self.lp}.")
 
-        self.documents = self.load_segment_files(f"{dataset}/documents/{self.lp}.docs")
+        self.documents = SegmentFile(f"{dataset}/documents/{self.lp}.docs", self.index_dir)
 
     def iterate_over_all(self, reference=None):
+        # sources and the reference are shared by all systems, decode them once
+        sources = list(self.sources)
+        if reference is not None:
+            references = list(self.references[reference])
         for system in self.systems.keys():
             if reference is None:
-                for src, hyp in zip(self.sources, self.systems[system]):
+                for src, hyp in zip(sources, self.systems[system]):
                     yield src, hyp, None, system
             else:
-                for src, hyp, ref in zip(self.sources, self.systems[system], self.references[reference]):
+                for src, hyp, ref in zip(sources, self.systems[system], references):
                     yield src, hyp, ref, system
 
     def load_segment_files(self, path):
-        segments = []
-        with open(path, "r") as fh:
-            for line in fh:
-                segments.append(line.rstrip())
-        return segments
+        return list(SegmentFile(path, self.index_dir))
 
     def segments_count(self):
         return len(self.sources)*len(self.systems)
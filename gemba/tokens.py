@@ -0,0 +1,71 @@
+import re
+from functools import lru_cache
+from gemba.prompt import prompts
+
+# runs of ASCII letters, groups of up to three digits, runs of other letters, any other single character
+PIECES = re.compile(r"[A-Za-z]+|[0-9]{1,3}|[^\W\dA-Za-z_]+|\S")
+
+# tokens added by the API per message and per request
+MESSAGE_OVERHEAD = 4
+REQUEST_OVERHEAD = 8
+
+# output tokens requested per method: scores and classes are answered in a few tokens
+# ("max_tokens" of the gemba.prompt entries), MQM and ESA list the errors they find
+OUTPUT_BUDGETS = {method: entry["max_tokens"] for method, entry in prompts.items()}
+OUTPUT_BUDGETS.update({
+    "GEMBA-MQM": 500,
+    "GEMBA-ESA": 1024,
+    "GEMBA-ESA_ranking": 64,
+})
+
+
+def output_budget(method):
+    """max_tokens of the requests of a scoring method"""
+    if method not in OUTPUT_BUDGETS:
+        raise Exception(f"Method {method} not supported.")
+    return OUTPUT_BUDGETS[method]
+
+
+def prompt_budget(method, prompt):
+    """`output_budget` of one prompt of a method, the two stages of GEMBA-ESA are told apart by their prompts"""
+    if method == "GEMBA-ESA" and isinstance(prompt, str):
+        # error spans are requested with a list of turns, the ranking with a single string
+        return output_budget("GEMBA-ESA_ranking")
+    return output_budget(method)
+
+
+@lru_cache(maxsize=1024)
+def estimate_text_tokens(text):
+    """
+    Rough local token count of a text, without a tokenizer.
+
+    ASCII words take a token per six letters, digits a token per three, other scripts
+    a token per three UTF-8 bytes and every other symbol a token of its own. Cached,
+    as few-shot examples and system prompts repeat in every request.
+    """
+    tokens = 0
+    for piece in PIECES.findall(text):
+        first = piece[0]
+        if not first.isascii():
+            tokens += (len(piece.encode("utf-8")) + 2) // 3
+        elif first.isalpha():
+            tokens += 1 + (len(piece) - 1) // 6
+        else:
+            tokens += 1
+    return tokens
+
+
+def estimate_input_tokens(parameters):
+    """Estimated input tokens of a request built by `build_parameters`, cached prefixes included"""
+    system = parameters.get("system") or []
+    if isinstance(system, str):
+        system = [{"text": system}]
+    tokens = REQUEST_OVERHEAD + sum(estimate_text_tokens(block["text"]) for block in system)
+    for message in parameters["messages"]:
+        content = message["content"]
+        if isinstance(content, str):
+            tokens += estimate_text_tokens(content)
+        else:
+            tokens += sum(estimate_text_tokens(block.get("text", "")) for block in content)
+        tokens += MESSAGE_OVERHEAD
+    return tokens
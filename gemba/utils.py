@@ -1,38 +1,196 @@
+import sys
 import ipdb
+import itertools
 import pandas as pd
-import diskcache as dc
-from gemba.gpt_api import GptApi
-from gemba.gemba_mqm_utils import TEMPLATE_GEMBA_MQM, apply_template, parse_mqm_answer
+from gemba.cache import ResponseStore
+from gemba.gpt_api import GptApi, AsyncGptApi
+from gemba.batch_api import BatchGptApi
+from gemba.gemba_mqm_utils import TEMPLATE_GEMBA_MQM, compile_template, parse_mqm_answer
 from gemba.gemba_esa import TEMPLATE_GEMBA_ESA_ERROR_SPANS, TEMPLATE_GEMBA_ESA_RANKING
 from gemba.prompt import prompts, validate_number
+from gemba.packing import packed_bulk_request
+from gemba.shards import shard_of
+from gemba.tokens import output_budget
+from gemba.telemetry import Telemetry
 
+# execution engines selectable with --backend, all expose the same bulk_request
+BACKENDS = {
+    "threads": GptApi,
+    "async": AsyncGptApi,
+    "batch": BatchGptApi,
+}
 
-def get_gemba_scores(source, hypothesis, source_lang, target_lang, method, model):
+# single-string prompts from gemba.prompt, the ones that support packing
+SCORE_METHODS = ["GEMBA-DA", "GEMBA-DA_ref", "GEMBA-SQM", "GEMBA-SQM_ref", "GEMBA-stars", "GEMBA-stars_ref", "GEMBA-classes", "GEMBA-classes_ref"]
+
+
+def get_gemba_scores(source, hypothesis, source_lang, target_lang, method, model, backend="threads", pack_size=1, retry_schedule=None, store=None, telemetry=None):
     df = pd.DataFrame({'source_seg': source, 'target_seg': hypothesis})
     df['source_lang'] = source_lang
     df['target_lang'] = target_lang
 
-    cache = dc.Cache(f'cache/{model}_{method}', expire=None, size_limit=int(10e10), cull_limit=0, eviction_policy='none')
-    gptapi = GptApi()
+    # responses are shared between methods, the digest keys contain the full request
+    if store is None:
+        store = ResponseStore()
+    cache = store.for_model(model)
+    if backend not in BACKENDS:
+        raise Exception(f"Backend {backend} not supported.")
+    gptapi = BACKENDS[backend](retry_schedule=retry_schedule, telemetry=telemetry if telemetry is not None else Telemetry(method=method))
+    gptapi.telemetry.name_method(validate_number, "GEMBA-ESA_ranking")
 
     if method == "GEMBA-MQM":
-        df["prompt"] = df.apply(lambda x: apply_template(TEMPLATE_GEMBA_MQM, x), axis=1)
+        prompts_list = compile_template(TEMPLATE_GEMBA_MQM).render_columns(df)
         parse_answer = lambda x: parse_mqm_answer(x, list_mqm_errors=False, full_desc=True)
-        answers = gptapi.bulk_request(df, model, parse_answer, cache=cache, max_tokens=500)
-    elif method in ["GEMBA-DA", "GEMBA-DA_ref", "GEMBA-SQM", "GEMBA-SQM_ref", "GEMBA-stars", "GEMBA-stars_ref", "GEMBA-classes", "GEMBA-classes_ref"]:
-        df["prompt"] = df.apply(lambda x: apply_template(prompts[method]['prompt'], x), axis=1)
+        answers = gptapi.bulk_request(prompts_list, model, parse_answer, cache=cache, max_tokens=output_budget(method))
+    elif method in SCORE_METHODS and pack_size > 1:
+        answers = packed_bulk_request(gptapi, df, method, model, cache, pack_size, max_tokens=output_budget(method))
+    elif method in SCORE_METHODS:
+        prompts_list = compile_template(prompts[method]['prompt']).render_columns(df)
         parse_answer = prompts[method]["validate_answer"]
-        answers = gptapi.bulk_request(df, model, parse_answer, cache=cache, max_tokens=500)
+        answers = gptapi.bulk_request(prompts_list, model, parse_answer, cache=cache, max_tokens=output_budget(method))
     elif method == "GEMBA-ESA":
-        df["prompt"] = df.apply(lambda x: apply_template(TEMPLATE_GEMBA_ESA_ERROR_SPANS, x), axis=1)
-        parse_answer = lambda x: x
-        error_spans = gptapi.bulk_request(df, model, parse_answer, cache=cache)
-        df['error_spans'] = pd.DataFrame(error_spans)['answer']
-
-        df["prompt"] = df.apply(lambda x: apply_template(TEMPLATE_GEMBA_ESA_RANKING, x), axis=1)
-        parse_answer = validate_number
-        answers = gptapi.bulk_request(df, model, parse_answer, cache=cache)
+        answers = [answers[0] for row, answers in pipelined_esa(gptapi, df.to_dict("records"), model, cache)]
     else:
         raise Exception(f"Method {method} not supported.")
 
+    print_summary(gptapi)
+
     return list(pd.DataFrame(answers)['answer'])
+
+
+def error_spans_answer(x):
+    return x
+
+
+def pipelined_esa(gptapi, rows, model, cache, window=None, ordered=True, max_concurrent=None):
+    """
+    Two-stage GEMBA-ESA without a barrier between the stages.
+
+    The ranking prompt of a segment is sent as soon as its error spans return, while other
+    segments are still being annotated. Both stages run on one attempt runner, so together
+    they keep at most `max_concurrent` requests in flight. Yields (row, parsed ranking answers),
+    in input order unless `ordered` is False.
+
+    The stages themselves run unordered, a slow span annotation must not hold back the ranking
+    of later segments. In ordered mode the finished segments wait for earlier ones here instead.
+    """
+    if not max_concurrent:
+        max_concurrent = gptapi.num_workers
+    segments = {}
+    error_spans_template = compile_template(TEMPLATE_GEMBA_ESA_ERROR_SPANS)
+    ranking_template = compile_template(TEMPLATE_GEMBA_ESA_RANKING)
+
+    def span_tasks():
+        for i, row in enumerate(rows):
+            segments[i] = row
+            yield error_spans_template.render(row), model, error_spans_answer, cache, output_budget("GEMBA-ESA")
+
+    with gptapi.attempt_runner(max_concurrent) as runner:
+        error_spans = gptapi.iter_tasks(span_tasks(), window=window, ordered=False, max_concurrent=max_concurrent, runner=runner)
+        # ranking prompts are read in the order error spans complete, map them back to their segment
+        ranked = {}
+
+        def ranking_tasks():
+            for position, (i, answers) in enumerate(error_spans):
+                segments[i]['error_spans'] = answers[0]['answer']
+                ranked[position] = i
+                yield ranking_template.render(segments[i]), model, validate_number, cache, output_budget("GEMBA-ESA_ranking")
+
+        finished = {}
+        next_yield = 0
+        for position, answers in gptapi.iter_tasks(ranking_tasks(), window=window, ordered=False, max_concurrent=max_concurrent, runner=runner):
+            i = ranked.pop(position)
+            if not ordered:
+                yield segments.pop(i), answers
+                continue
+            finished[i] = answers
+            while next_yield in finished:
+                yield segments.pop(next_yield), finished.pop(next_yield)
+                next_yield += 1
+
+
+def print_summary(gptapi):
+    print(f"Token usage: {gptapi.usage_summary()}", file=sys.stderr)
+    print(f"Token estimates: {gptapi.estimate_summary()}", file=sys.stderr)
+    print(f"Deduplication: {gptapi.dedup_summary()}", file=sys.stderr)
+    print(f"Attempts:\n{gptapi.retry_schedule.summary()}", file=sys.stderr)
+    print(f"Telemetry:\n{gptapi.telemetry.summary()}", file=sys.stderr)
+
+
+def iter_rows(source_iter, hyp_iter, source_lang, target_lang, skip=None, shard=None):
+    missing = object()
+    for index, (source, hypothesis) in enumerate(itertools.zip_longest(source_iter, hyp_iter, fillvalue=missing)):
+        if source is missing or hypothesis is missing:
+            raise Exception("Source and hypothesis must have the same number of segments.")
+        if skip is not None and index in skip:
+            continue
+        if shard is not None and shard_of(f"{source}\t{hypothesis}", shard[1]) != shard[0]:
+            continue
+        yield {'index': index, 'source_seg': source, 'target_seg': hypothesis, 'source_lang': source_lang, 'target_lang': target_lang}
+
+
+def iter_scores(source_iter, hyp_iter, source_lang, target_lang, method, model, backend="threads", pack_size=1, retry_schedule=None, store=None, window=None, ordered=True, skip=None,
+                shard=None, rate_limiter=None, telemetry=None):
+    """
+    Streaming version of `get_gemba_scores`.
+
+    Segments are read lazily from the two iterables and (index, source, hypothesis, answer)
+    is yielded as soon as a segment is scored, in input order unless `ordered` is False.
+    Only a window of segments is kept in memory, see `GptApi.iter_request`. Segments whose
+    index is in `skip` (e.g. a `Journal` of a resumed run) are neither rendered nor looked up.
+    With `shard` (i, N) only the segments of shard i are scored, see `gemba.shards.shard_of`,
+    and a `rate_limiter` (e.g. one with a `RateCoordinator`) replaces the engine's own,
+    as does `telemetry` (e.g. one exporting to a file or a metrics endpoint).
+    """
+    if store is None:
+        store = ResponseStore()
+    cache = store.for_model(model)
+    if backend not in BACKENDS:
+        raise Exception(f"Backend {backend} not supported.")
+    gptapi = BACKENDS[backend](retry_schedule=retry_schedule, rate_limiter=rate_limiter, telemetry=telemetry if telemetry is not None else Telemetry(method=method))
+    # the ranking stage of GEMBA-ESA is reported on its own
+    gptapi.telemetry.name_method(validate_number, "GEMBA-ESA_ranking")
+
+    rows = iter_rows(source_iter, hyp_iter, source_lang, target_lang, skip, shard)
+
+    if method in SCORE_METHODS and pack_size > 1:
+        # packing needs whole groups, score the input one window at a time
+        window = window or 4 * pack_size * gptapi.num_workers
+        while True:
+            chunk = list(itertools.islice(rows, window))
+            if not chunk:
+                break
+            answers = packed_bulk_request(gptapi, pd.DataFrame(chunk), method, model, cache, pack_size, max_tokens=output_budget(method))
+            for row, answer in zip(chunk, answers):
+                yield row['index'], row['source_seg'], row['target_seg'], answer['answer']
+        print_summary(gptapi)
+        return
+
+    # rows read by the engine but not yielded yet
+    segments = {}
+
+    def prompt_rows(template):
+        template = compile_template(template)
+        for i, row in enumerate(rows):
+            segments[i] = row
+            yield template.render(row)
+
+    def read(results):
+        for i, answers in results:
+            yield segments.pop(i), answers
+
+    if method == "GEMBA-MQM":
+        parse_answer = lambda x: parse_mqm_answer(x, list_mqm_errors=False, full_desc=True)
+        results = read(gptapi.iter_request(prompt_rows(TEMPLATE_GEMBA_MQM), model, parse_answer, cache, max_tokens=output_budget(method), window=window, ordered=ordered))
+    elif method in SCORE_METHODS:
+        parse_answer = prompts[method]["validate_answer"]
+        results = read(gptapi.iter_request(prompt_rows(prompts[method]['prompt']), model, parse_answer, cache, max_tokens=output_budget(method), window=window, ordered=ordered))
+    elif method == "GEMBA-ESA":
+        results = pipelined_esa(gptapi, rows, model, cache, window=window, ordered=ordered)
+    else:
+        raise Exception(f"Method {method} not supported.")
+
+    for row, answers in results:
+        yield row['index'], row['source_seg'], row['target_seg'], answers[0]['answer']
+
+    print_summary(gptapi)
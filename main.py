@@ -2,9 +2,15 @@ import os
 import sys
 import ipdb
 import pandas as pd
-import diskcache as dc
 from absl import app, flags
-from gemba.utils import get_gemba_scores
+from tqdm import tqdm
+from gemba.utils import iter_scores
+from gemba.journal import Journal
+from gemba.retry_scheduler import RetrySchedule, DEFAULT_TEMPERATURES
+from gemba.cache import ResponseStore, DEFAULT_STORE, EVICTION_POLICIES
+from gemba.rate_limiter import RateLimiter, RateCoordinator
+from gemba.shards import parse_shard, shard_name
+from gemba.telemetry import Telemetry
 
 
 flags.DEFINE_string('method', "GEMBA-MQM", 'Which method to use?')
@@ -13,6 +19,26 @@ flags.DEFINE_string('source', None, 'Filepath to the source file.')
 flags.DEFINE_string('hypothesis', None, 'Filepath to the translation file.')
 flags.DEFINE_string('source_lang', None, 'Source language name.')
 flags.DEFINE_string('target_lang', None, 'Target language name.')
+flags.DEFINE_integer('pack_size', 1, 'Number of segments scored per request (GEMBA-DA/SQM/stars/classes only).')
+flags.DEFINE_list('temperatures', [str(t) for t in DEFAULT_TEMPERATURES], 'Temperatures of the attempts for prompts whose answer does not parse.')
+flags.DEFINE_integer('max_attempts', None, 'Maximum attempts per prompt (default: length of --temperatures).')
+flags.DEFINE_string('cache_dir', DEFAULT_STORE, 'Response store shared by all methods and runs.')
+flags.DEFINE_enum('cache_eviction', "none", list(EVICTION_POLICIES), 'Eviction policy once the model quota is exceeded.')
+flags.DEFINE_float('cache_quota_gb', 100, 'Disk quota of the model in the response store, in GB.')
+flags.DEFINE_enum('backend', "threads", ["threads", "async", "batch"], 'Execution backend: thread pool, asyncio or Message Batches (offline).')
+flags.DEFINE_integer('window', None, 'Segments read ahead of the journal (default: 4x the concurrency, one full batch for --backend=batch).')
+flags.DEFINE_bool('ordered', True, 'Journal segments in input order; with --noordered as soon as they complete.')
+flags.DEFINE_string('journal', "results.journal", 'Write-ahead journal of scored segments, results.txt is assembled from it.')
+flags.DEFINE_bool('resume', False, 'Continue the run recorded in --journal, finished segments are skipped.')
+flags.DEFINE_string('shard', None, 'Score only shard i/N of the segments (e.g. 0/4), journaled to --journal.shard-i-of-N.')
+flags.DEFINE_integer('merge_shards', None, 'Assemble results.txt from the journals of N finished shards instead of scoring.')
+flags.DEFINE_string('coordinator', None, 'SQLite database through which all shards of the API key split its rate budget.')
+flags.DEFINE_integer('requests_per_minute', None, 'Requests-per-minute budget of the API key (default: adopted from the rate-limit headers).')
+flags.DEFINE_integer('tokens_per_minute', None, 'Tokens-per-minute budget of the API key (default: adopted from the rate-limit headers).')
+flags.DEFINE_integer('input_tokens_per_minute', None, 'Input-tokens-per-minute budget of the API key (default: adopted from the rate-limit headers).')
+flags.DEFINE_integer('output_tokens_per_minute', None, 'Output-tokens-per-minute budget of the API key (default: adopted from the rate-limit headers).')
+flags.DEFINE_string('telemetry', None, 'JSON-lines file receiving every telemetry event (cache hits, latencies, tokens, ...).')
+flags.DEFINE_integer('metrics_port', None, 'Serve the telemetry in the Prometheus text format on http://127.0.0.1:<port>/metrics.')
 
 
 def main(argv):
@@ -31,26 +57,105 @@ def main(argv):
     assert FLAGS.source_lang is not None, "Source language name must be provided."
     assert FLAGS.target_lang is not None, "Target language name must be provided."
 
-    # load both files and strip them
+    # count the lines without loading the files, they are streamed below
     with open(FLAGS.source, 'r') as f:
-        source = f.readlines()
-    source = [x.strip() for x in source]
+        source_count = sum(1 for _ in f)
     with open(FLAGS.hypothesis, 'r') as f:
-        hypothesis = f.readlines()
-    hypothesis = [x.strip() for x in hypothesis]
-
-    assert len(source) == len(hypothesis), "Source and hypothesis files must have the same number of lines."
-
-    answers = get_gemba_scores(source, hypothesis, FLAGS.source_lang, FLAGS.target_lang, FLAGS.method, FLAGS.model)
-
-    # save the results to a text file
-    with open(f"results.txt", 'w') as f:
-        for answer,source,hypothesis in zip(answers,source,hypothesis):
-            f.write(f"{source}\t{hypothesis}\t{answer}\n")
-
-    
-
-    
+        hypothesis_count = sum(1 for _ in f)
+
+    assert source_count == hypothesis_count, "Source and hypothesis files must have the same number of lines."
+
+    # integer temperatures keep the cache keys of earlier runs
+    temperatures = [float(t) if "." in t else int(t) for t in FLAGS.temperatures]
+    retry_schedule = RetrySchedule(temperatures, FLAGS.max_attempts)
+
+    store = ResponseStore(FLAGS.cache_dir, eviction=FLAGS.cache_eviction, model_quotas={FLAGS.model: int(FLAGS.cache_quota_gb * 1e9)})
+
+    # a resumed run must score the same segments the same way
+    header = {
+        "source": os.path.abspath(FLAGS.source), "hypothesis": os.path.abspath(FLAGS.hypothesis),
+        "source_lang": FLAGS.source_lang, "target_lang": FLAGS.target_lang,
+        "method": FLAGS.method, "model": FLAGS.model, "lines": source_count,
+    }
+
+    if FLAGS.merge_shards:
+        write_results(merged_answers(header, FLAGS.merge_shards))
+        return
+
+    shard = parse_shard(FLAGS.shard)
+    journal_path = FLAGS.journal
+    if shard is not None:
+        # every shard journals its own segments, the index space stays the one of the whole input
+        header["shard"] = FLAGS.shard
+        journal_path = f"{FLAGS.journal}.{shard_name(shard)}"
+
+    coordinator = RateCoordinator(FLAGS.coordinator) if FLAGS.coordinator else None
+    rate_limiter = None
+    budgets = [FLAGS.requests_per_minute, FLAGS.tokens_per_minute, FLAGS.input_tokens_per_minute, FLAGS.output_tokens_per_minute]
+    if coordinator is not None or any(budgets):
+        rate_limiter = RateLimiter(requests_per_minute=FLAGS.requests_per_minute, tokens_per_minute=FLAGS.tokens_per_minute,
+                                   input_tokens_per_minute=FLAGS.input_tokens_per_minute, output_tokens_per_minute=FLAGS.output_tokens_per_minute,
+                                   coordinator=coordinator)
+
+    telemetry = Telemetry(FLAGS.telemetry, method=FLAGS.method)
+    if FLAGS.metrics_port:
+        telemetry.serve(FLAGS.metrics_port)
+
+    journal = Journal(journal_path, header, resume=FLAGS.resume)
+    if FLAGS.resume:
+        print(f"Resuming, {journal.count}/{source_count} segments already scored", file=sys.stderr)
+
+    # scored segments are journaled as they complete, so memory does not grow with the input and a crash loses at most one sync batch
+    try:
+        with open(FLAGS.source, 'r') as source_file, open(FLAGS.hypothesis, 'r') as hypothesis_file:
+            source = (x.strip() for x in source_file)
+            hypothesis = (x.strip() for x in hypothesis_file)
+            scores = iter_scores(source, hypothesis, FLAGS.source_lang, FLAGS.target_lang, FLAGS.method, FLAGS.model, backend=FLAGS.backend, pack_size=FLAGS.pack_size,
+                                 retry_schedule=retry_schedule, store=store, window=FLAGS.window, ordered=FLAGS.ordered, skip=journal,
+                                 shard=shard, rate_limiter=rate_limiter, telemetry=telemetry)
+            # the size of a shard is only known once the input has been hashed
+            total = source_count if shard is None else None
+            for index, source_seg, hypothesis_seg, answer in tqdm(scores, initial=journal.count, total=total, desc="Scoring", file=sys.stderr):
+                journal.append(index, answer)
+    finally:
+        journal.close()
+        telemetry.close()
+        if coordinator is not None:
+            coordinator.close()
+
+    if shard is not None:
+        print(f"Shard {FLAGS.shard} done, {journal.count} segments in {journal_path}. Once all shards are done, assemble results.txt with --merge_shards={shard[1]}.", file=sys.stderr)
+        return
+
+    write_results(journal.answers())
+
+
+def merged_answers(header, count):
+    """Answers of every segment in input order, each taken from the journal of the shard that scored it"""
+    journals = []
+    for index in range(count):
+        path = f"{flags.FLAGS.journal}.{shard_name((index, count))}"
+        if not os.path.isfile(path):
+            raise Exception(f"Journal {path} of shard {index}/{count} not found.")
+        # the shard may still be writing its journal, read it as it is
+        journals.append(Journal(path, dict(header, shard=f"{index}/{count}"), read_only=True))
+
+    # a segment left without an answer (None) by its shard is merged as such
+    missing = sum(1 for i in range(header["lines"]) if not any(journal.offsets[i] >= 0 for journal in journals))
+    if missing:
+        raise Exception(f"{missing} segments were not scored by any shard, finish the shards with --resume first.")
+
+    for i, answers in enumerate(zip(*(journal.answers() for journal in journals))):
+        yield next((answers[k] for k, journal in enumerate(journals) if i in journal), None)
+
+
+def write_results(answers):
+    # save the results to a text file, assembled from the journal(s) in input order
+    FLAGS = flags.FLAGS
+    with open(FLAGS.source, 'r') as source_file, open(FLAGS.hypothesis, 'r') as hypothesis_file, open("results.txt.tmp", 'w') as f:
+        for source_seg, hypothesis_seg, answer in zip(source_file, hypothesis_file, answers):
+            f.write(f"{source_seg.strip()}\t{hypothesis_seg.strip()}\t{answer}\n")
+    os.replace("results.txt.tmp", "results.txt")
 
 
 
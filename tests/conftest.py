@@ -0,0 +1,24 @@
+import os
+import pytest
+from gemba.testset import Testset
+
+
+def write_testset(basepath, systems, segments, domains=("news", "social"), dataset="test", lp="en-de"):
+    """Minimal mt-metrics-eval layout of one language pair, en-de of dataset "test" by default"""
+    dataset = f"{basepath}/{dataset}"
+    for folder in ["sources", "references", "documents", f"system-outputs/{lp}"]:
+        os.makedirs(f"{dataset}/{folder}", exist_ok=True)
+    paths = [f"sources/{lp}.txt", f"references/{lp}.refA.txt"] + [f"system-outputs/{lp}/{system}.txt" for system in systems]
+    for path in paths:
+        with open(f"{dataset}/{path}", "w") as f:
+            f.writelines(f"{path} segment {i}\n" for i in range(segments))
+    with open(f"{dataset}/documents/{lp}.docs", "w") as f:
+        f.writelines(f"{domains[i % len(domains)]}\tdoc{i // 10}\n" for i in range(segments))
+
+
+@pytest.fixture
+def make_testset(tmp_path):
+    def make(systems, segments):
+        write_testset(tmp_path / "data", systems, segments)
+        return Testset(str(tmp_path / "data"), "test", "en-de", index_dir=str(tmp_path / "offsets"))
+    return make
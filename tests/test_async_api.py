@@ -0,0 +1,81 @@
+import re
+import time
+import random
+import asyncio
+import threading
+from gemba.gpt_api import GptApi, AsyncGptApi
+from gemba.prompt import validate_number
+
+
+PROMPTS = [f"Score segment {i % 40}: " for i in range(60)]
+
+
+def answer(prompt):
+    return [{"answer": re.search(r"\d+", prompt).group(), "finish_reason": "end_turn"}]
+
+
+def async_api(monkeypatch, max_concurrent=16):
+    """AsyncGptApi whose calls take a random few milliseconds, recording the calls in flight"""
+    api = AsyncGptApi(api_key="test", max_concurrent=max_concurrent)
+    lock = threading.Lock()
+    stats = {"in_flight": 0, "max_in_flight": 0, "calls": 0}
+
+    async def call_api_async(prompt, model, temperature, max_tokens, estimated_tokens=(0, 0)):
+        with lock:
+            stats["calls"] += 1
+            stats["in_flight"] += 1
+            stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            await asyncio.sleep(random.uniform(0.001, 0.02))
+            return answer(prompt)
+        finally:
+            with lock:
+                stats["in_flight"] -= 1
+
+    monkeypatch.setattr(api, "call_api_async", call_api_async)
+    return api, stats
+
+
+def threads_answers(monkeypatch):
+    api = GptApi(api_key="test")
+
+    def call_api(prompt, model, temperature, max_tokens, client=None, estimated_tokens=(0, 0)):
+        time.sleep(random.uniform(0.001, 0.005))
+        return answer(prompt)
+
+    monkeypatch.setattr(api, "call_api", call_api)
+    return api.bulk_request(PROMPTS, "model", validate_number, None)
+
+
+def strip(answers):
+    return [(answer["answer"], answer["prompt"], answer["temperature"]) for answer in answers]
+
+
+def test_semaphore_limit_and_order(monkeypatch):
+    api, stats = async_api(monkeypatch)
+    answers = api.bulk_request(PROMPTS, "model", validate_number, None, max_concurrent=3)
+
+    assert stats["max_in_flight"] == 3
+    # duplicates are requested once
+    assert stats["calls"] == 40
+    assert strip(answers) == strip(threads_answers(monkeypatch))
+    assert [answer["answer"] for answer in answers] == [i % 40 for i in range(60)]
+
+
+def test_bulk_request_in_a_running_event_loop(monkeypatch):
+    api, stats = async_api(monkeypatch)
+
+    async def caller():
+        return api.bulk_request(PROMPTS, "model", validate_number, None, max_concurrent=5)
+
+    answers = asyncio.run(caller())
+    assert 1 < stats["max_in_flight"] <= 5
+    assert strip(answers) == strip(threads_answers(monkeypatch))
+
+
+def test_iter_request_streams_on_the_background_loop(monkeypatch):
+    api, stats = async_api(monkeypatch)
+    results = list(api.iter_request(PROMPTS, "model", validate_number, None, max_concurrent=4))
+    assert [i for i, answers in results] == list(range(60))
+    assert [answers[0]["answer"] for i, answers in results] == [i % 40 for i in range(60)]
+    assert 1 < stats["max_in_flight"] <= 4
@@ -0,0 +1,97 @@
+from types import SimpleNamespace
+from gemba.batch_api import BatchGptApi
+from gemba.gpt_api import GptApi
+from gemba.prompt import validate_number
+from gemba.retry_scheduler import RetrySchedule
+
+
+class DictCache(dict):
+    def set(self, key, value):
+        self[key] = value
+
+
+def answer_of(prompt, temperature):
+    # "unsure" prompts only get a score from the second temperature on
+    content = prompt[0]["content"]
+    if content.startswith("unsure") and temperature == 0:
+        return "I cannot score this."
+    return content.split()[-1]
+
+
+class FakeTransport:
+    """Message Batches with canned answers, failing requests as listed in `errors`"""
+
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.batches = []
+
+    def submit(self, requests):
+        self.batches.append(requests)
+        return len(self.batches) - 1
+
+    def is_done(self, batch_id):
+        return True
+
+    def results(self, batch_id):
+        for request in self.batches[batch_id]:
+            params = request["params"]
+            content = params["messages"][0]["content"]
+            errors = self.errors.get(content, [])
+            if errors:
+                yield request["custom_id"], None, errors.pop(0)
+                continue
+            usage = SimpleNamespace(input_tokens=10, output_tokens=1)
+            yield request["custom_id"], {"answer": answer_of(params["messages"], params["temperature"]), "finish_reason": "end_turn", "usage": usage}, None
+
+
+def prompts(contents):
+    return [[{"role": "user", "content": content}] for content in contents]
+
+
+def batch_api(transport):
+    return BatchGptApi(api_key="test", transport=transport, poll_interval=0, retry_schedule=RetrySchedule((0, 0.5, 1)))
+
+
+def comparable(answers):
+    return [(answer["answer"], answer["temperature"], answer["finish_reason"]) for answer in answers]
+
+
+def test_matches_the_threaded_engine(monkeypatch):
+    batch = prompts(["score 87", "unsure 40", "score 12", "score 87"])
+    transport = FakeTransport()
+    results = batch_api(transport).bulk_request(batch, "model", validate_number, cache=None)
+
+    threaded = GptApi(api_key="test", retry_schedule=RetrySchedule((0, 0.5, 1)))
+    monkeypatch.setattr(threaded, "request_api", lambda prompt, model, temperature, max_tokens:
+                        [{"answer": answer_of(prompt, temperature), "finish_reason": "end_turn"}])
+    assert comparable(results) == comparable(threaded.bulk_request(batch, "model", validate_number, cache=None))
+    assert comparable(results)[1] == (40, 0.5, "end_turn")
+    # duplicates are submitted once, the unparsable prompt again at the next temperature
+    assert [len(requests) for requests in transport.batches] == [3, 1]
+
+
+def test_transient_errors_are_resubmitted_and_permanent_ones_given_up():
+    transport = FakeTransport({"score 50": ["overloaded_error"], "score 60": ["invalid_request_error"]})
+    results = batch_api(transport).bulk_request(prompts(["score 50", "score 60"]), "model", validate_number, cache=None)
+    assert comparable(results) == [(50, 0, "end_turn"), (None, 0, None)]
+    assert [len(requests) for requests in transport.batches] == [2, 1]
+
+
+def test_answers_are_cached():
+    cache = DictCache()
+    batch = prompts(["score 87", "unsure 40"])
+    first = batch_api(FakeTransport()).bulk_request(batch, "model", validate_number, cache=cache)
+    transport = FakeTransport()
+    assert comparable(batch_api(transport).bulk_request(batch, "model", validate_number, cache=cache)) == comparable(first)
+    assert transport.batches == []
+
+
+def test_token_estimates_are_recorded():
+    api = batch_api(FakeTransport())
+    api.bulk_request(prompts(["score 87", "unsure 40"]), "model", validate_number, cache=None, max_tokens=64)
+    # three results: both prompts, and the unsure one again at the next temperature
+    assert api.estimates["requests"] == 3
+    assert api.estimates["input_tokens"] == 30 and api.estimates["output_tokens"] == 3
+    assert api.estimates["reserved_output_tokens"] == 3 * 64
+    assert api.estimates["estimated_input_tokens"] > 0
+    assert api.estimate_summary().startswith("3 requests")
@@ -0,0 +1,78 @@
+import io
+import json
+import diskcache as dc
+from gemba.cache import ResponseStore, migrate, request_digest
+from gemba.gpt_api import GptApi, build_parameters
+from gemba.prompt import validate_number
+from gemba.tokens import output_budget, prompt_budget
+
+
+PROMPT = [{"role": "user", "content": "Example source"}, {"role": "assistant", "content": "Example answer"},
+          {"role": "user", "content": "Score: "}]
+
+
+def test_digest_ignores_prompt_caching_marks():
+    marked = [dict(PROMPT[0]), dict(PROMPT[1], cache_control={"type": "ephemeral"}), PROMPT[2]]
+    digest = request_digest(build_parameters(PROMPT, "model", 0, 32))
+    assert request_digest(build_parameters(marked, "model", 0, 32)) == digest
+    # everything that can change the answer is part of the key
+    assert request_digest(build_parameters(PROMPT, "model", 0.5, 32)) != digest
+    assert request_digest(build_parameters(PROMPT, "model", 0, 500)) != digest
+    assert request_digest(build_parameters(PROMPT, "other", 0, 32)) != digest
+
+
+def test_store_round_trip_and_export(tmp_path):
+    store = ResponseStore(str(tmp_path / "store"))
+    answers = [{"answer": "87", "finish_reason": "end_turn"}]
+    store.for_model("model-a").set("key", answers)
+    store.for_model("org/model-b").set("key", [])
+
+    assert store.for_model("model-a").get("key") == answers
+    # empty answers are not served
+    assert store.for_model("org/model-b").get("key") is None
+    assert store.for_model("model-a").get("missing") is None
+    assert store.models() == ["model-a", "org_model-b"]
+    assert store.stats()["model-a"]["entries"] == 1
+
+    output = io.StringIO()
+    assert store.export(output, "model-a") == 1
+    assert json.loads(output.getvalue()) == {"model": "model-a", "key": "key", "answers": [["87", "end_turn"]]}
+    store.close()
+
+
+def test_requests_are_served_from_the_store(tmp_path, monkeypatch):
+    api = GptApi(api_key="test")
+    calls = []
+    monkeypatch.setattr(api, "request_api", lambda *args, **kwargs: calls.append(1) or [{"answer": "87", "finish_reason": "end_turn"}])
+    cache = ResponseStore(str(tmp_path / "store")).for_model("model")
+    first = api.request(PROMPT, "model", validate_number, cache=cache, max_tokens=32)
+    second = api.request(PROMPT, "model", validate_number, cache=cache, max_tokens=32)
+    assert first == second and len(calls) == 1
+
+
+def test_migrate_rekeys_legacy_entries(tmp_path):
+    # per-method caches were keyed by request dicts, without max_tokens
+    legacy = dc.Cache(str(tmp_path / "model_GEMBA-DA"))
+    legacy.set({"model": "model", "temperature": 0, "prompt": PROMPT}, [{"answer": "87", "finish_reason": "end_turn"}])
+    legacy.set({"model": "model", "temperature": 1, "prompt": PROMPT}, [])
+    legacy.close()
+
+    store = ResponseStore(str(tmp_path / "store"))
+    assert migrate(str(tmp_path / "model_GEMBA-DA"), store, output_budget("GEMBA-DA")) == (1, 1)
+    digest = request_digest(build_parameters(PROMPT, "model", 0, output_budget("GEMBA-DA")))
+    assert store.for_model("model").get(digest) == [{"answer": "87", "finish_reason": "end_turn"}]
+
+
+def test_migrate_rekeys_each_esa_stage_with_its_budget(tmp_path):
+    # the GEMBA-ESA cache holds the error span prompts (turns) and the ranking prompts (strings)
+    ranking = "Score (0-100): "
+    legacy = dc.Cache(str(tmp_path / "model_GEMBA-ESA"))
+    legacy.set({"model": "model", "temperature": 0, "prompt": PROMPT}, [{"answer": "Minor: ...", "finish_reason": "end_turn"}])
+    legacy.set({"model": "model", "temperature": 0, "prompt": ranking}, [{"answer": "87", "finish_reason": "end_turn"}])
+    legacy.close()
+
+    store = ResponseStore(str(tmp_path / "store"))
+    assert migrate(str(tmp_path / "model_GEMBA-ESA"), store, lambda prompt: prompt_budget("GEMBA-ESA", prompt)) == (2, 0)
+    cache = store.for_model("model")
+    assert cache.get(request_digest(build_parameters(PROMPT, "model", 0, output_budget("GEMBA-ESA"))))[0]["answer"] == "Minor: ..."
+    assert cache.get(request_digest(build_parameters(ranking, "model", 0, output_budget("GEMBA-ESA_ranking"))))[0]["answer"] == "87"
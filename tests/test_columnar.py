@@ -0,0 +1,66 @@
+import os
+import numpy as np
+from gemba.columnar import COLUMNAR_FOLDER, ColumnStore
+
+
+def read_tsv(path):
+    # how the TSVs were read before the sidecars
+    result = {}
+    with open(path) as f:
+        for line in f:
+            system, value = line.rstrip("\n").split("\t")
+            result.setdefault(system, []).append(np.nan if value == "None" else float(value))
+    return result
+
+
+def write(path, lines):
+    with open(path, "w") as f:
+        f.writelines(f"{system}\t{value}\n" for system, value in lines)
+
+
+def test_column_matches_the_tsv_and_is_reused(tmp_path):
+    path = str(tmp_path / "metric-refA.seg.score")
+    write(path, [("sysA", 1), ("sysA", "None"), ("sysB", 0.5), ("sysB", 25), ("sysA", 3)])
+
+    column = ColumnStore(str(tmp_path)).load(path)
+    assert column.values.dtype == np.float32
+    expected = read_tsv(path)
+    assert list(column.by_system()) == list(expected)
+    for system, values in column.by_system().items():
+        np.testing.assert_array_equal(values, expected[system])
+
+    # a second store reads the sidecar, memory-mapped
+    column = ColumnStore(str(tmp_path)).load(path)
+    assert isinstance(column.values, np.memmap)
+    assert column.systems == ["sysA", "sysB", "sysA"]
+
+
+def test_values_lost_in_float32_are_kept_as_float64(tmp_path):
+    path = str(tmp_path / "metric-refA.seg.score")
+    write(path, [("sysA", 0.1), ("sysA", 1)])
+    column = ColumnStore(str(tmp_path)).load(path)
+    assert column.values.dtype == np.float64
+    assert column.values.tolist() == [0.1, 1.0]
+
+
+def test_changed_tsv_rebuilds_the_sidecar(tmp_path):
+    path = str(tmp_path / "metric-refA.seg.score")
+    write(path, [("sysA", 1), ("sysB", 2)])
+    ColumnStore(str(tmp_path)).load(path)
+    write(path, [("sysC", 5), ("sysA", 1), ("sysB", 2)])
+    os.utime(path, ns=(0, 0))
+
+    column = ColumnStore(str(tmp_path)).load(path)
+    assert {system: values.tolist() for system, values in column.by_system().items()} == {"sysC": [5], "sysA": [1], "sysB": [2]}
+    with open(tmp_path / COLUMNAR_FOLDER / "systems.txt") as f:
+        assert f.read() == "sysA\nsysB\nsysC\n"
+
+
+def test_unwritable_sidecar_is_kept_in_memory(tmp_path):
+    path = str(tmp_path / "metric-refA.seg.score")
+    write(path, [("sysA", 1), ("sysB", 2)])
+    # a file where the sidecar folder would be
+    (tmp_path / COLUMNAR_FOLDER).write_text("")
+    column = ColumnStore(str(tmp_path)).load(path)
+    assert {system: values.tolist() for system, values in column.by_system().items()} == {"sysA": [1], "sysB": [2]}
+    assert ColumnStore(str(tmp_path)).load(str(tmp_path / "missing.seg.score")) is None
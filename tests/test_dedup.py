@@ -0,0 +1,82 @@
+import asyncio
+import threading
+import time
+import pytest
+from gemba.dedup import AsyncSingleFlight, SingleFlight, dedup_prompts, fan_out
+
+
+def test_dedup_prompts_and_fan_out():
+    turns = [{"role": "user", "content": "b"}]
+    prompts = ["a", [dict(turns[0])], "a", "c", turns]
+    unique, inverse = dedup_prompts(prompts)
+    assert unique == ["a", turns, "c"]
+    assert [unique[i] for i in inverse] == prompts
+
+    answers = fan_out([[{"answer": i}] for i in range(len(unique))], inverse)
+    assert [answer["answer"] for answer in answers] == [0, 1, 0, 2, 1]
+    # duplicates get copies
+    answers[0]["answer"] = None
+    assert answers[2]["answer"] == 0
+
+
+def test_single_flight_shares_a_call_in_flight():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def call():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "answer"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("key", call)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do("key", call))) for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    deadline = time.monotonic() + 5
+    while flight.shared < 3 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join()
+
+    assert results == ["answer"] * 4 and len(calls) == 1
+    # once done, the next call runs again
+    assert flight.do("key", lambda: "again") == "again"
+
+
+def test_single_flight_passes_errors_on():
+    def failing():
+        raise ValueError()
+
+    flight = SingleFlight()
+    with pytest.raises(ValueError):
+        flight.do("key", failing)
+    assert flight.calls == {}
+
+
+def test_async_single_flight():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise ValueError()
+
+    async def run():
+        results = await asyncio.gather(*(flight.do("key", call) for _ in range(4)))
+        errors = await asyncio.gather(*(flight.do("error", failing) for _ in range(2)), return_exceptions=True)
+        return results, errors
+
+    results, errors = asyncio.run(run())
+    assert results == ["answer"] * 4 and len(calls) == 1 and flight.shared == 4
+    assert all(isinstance(error, ValueError) for error in errors)
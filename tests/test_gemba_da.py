@@ -0,0 +1,48 @@
+import os
+import sys
+import subprocess
+import textwrap
+from conftest import write_testset
+from gemba import testset as testset_module
+from gemba.scores import Scores
+
+
+# gemba_da defines flags that clash with main.py, so the run gets a process of its own
+INTERRUPTED_RUN = textwrap.dedent("""
+    import threading
+    from absl import app
+    from gemba import gemba_da
+    from gemba.gpt_api import GptApi
+
+    lock = threading.Lock()
+    calls = []
+
+    def request_api(self, prompt, model, temperature=0, max_tokens=None):
+        with lock:
+            calls.append(prompt)
+            if len(calls) > 30:
+                raise KeyboardInterrupt
+        return [{"answer": "80", "finish_reason": "end_turn"}]
+
+    GptApi.request_api = request_api
+    app.run(gemba_da.main)
+""")
+
+
+def test_interrupted_run_keeps_its_scores(tmp_path):
+    for lp in ["en-de", "zh-en", "en-ru"]:
+        write_testset(tmp_path / "mtme", ["sysA", "sysB"], 20, dataset="wmt22", lp=lp)
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    run = subprocess.run([sys.executable, "-c", INTERRUPTED_RUN, f"--mtme_path={tmp_path / 'mtme'}", "--backend=threads", "--max_concurrent=4"],
+                         cwd=tmp_path, env=env, capture_output=True, text=True)
+    assert run.returncode != 0 and "KeyboardInterrupt" in run.stderr
+
+    # far fewer than checkpoint_every scores were assigned, they are in the delta logs nevertheless
+    scored = 0
+    for annotation, refname in [("GEMBA-DA", None), ("GEMBA-DA_ref", "refA")]:
+        for lp in ["en-de", "zh-en", "en-ru"]:
+            testset = testset_module.Testset(str(tmp_path / "mtme"), "wmt22", lp, index_dir=str(tmp_path / "offsets"))
+            scores = Scores(f"{annotation}_text-davinci-003", testset, refname)
+            scored += sum(int((~scores.missing_mask(system)).sum()) for system in testset.systems)
+            assert all(scores.get_score(system, i) in (None, 80) for system in testset.systems for i in range(20))
+    assert 0 < scored <= 30
@@ -0,0 +1,66 @@
+import anthropic
+import pytest
+from gemba import gpt_api
+from gemba.gpt_api import GptApi, is_transient
+from gemba.rate_limiter import RateLimiter
+
+
+PROMPT = [{"role": "user", "content": "Score: "}]
+
+
+class FakeResponse:
+    request = None
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+
+
+def status_error(status_code):
+    return anthropic.APIStatusError("error", response=FakeResponse(status_code), body=None)
+
+
+@pytest.mark.parametrize("status_code, transient", [(400, False), (401, False), (404, False), (408, True), (429, True),
+                                                    (500, True), (503, True), (529, True)])
+def test_status_errors(status_code, transient):
+    assert is_transient(status_error(status_code)) == transient
+
+
+def test_connection_errors_and_bugs():
+    assert is_transient(anthropic.APIConnectionError(request=None))
+    assert is_transient(anthropic.APITimeoutError(request=None))
+    assert is_transient(TimeoutError())
+    assert not is_transient(TypeError("unexpected keyword"))
+
+
+def flaky_api(errors, monkeypatch):
+    """GptApi whose calls fail with `errors` first, recording the slots held during every backoff"""
+    api = GptApi(api_key="test", rate_limiter=RateLimiter(max_concurrent=1, backoff_base=0.01))
+    calls = []
+
+    def call_api(*args, **kwargs):
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return [{"answer": "87", "finish_reason": "end_turn"}]
+
+    sleeps = []
+    monkeypatch.setattr(api, "call_api", call_api)
+    monkeypatch.setattr(gpt_api.time, "sleep", lambda delay: sleeps.append(api.rate_limiter.in_flight))
+    return api, calls, sleeps
+
+
+def test_transient_errors_are_retried_without_holding_the_slot(monkeypatch):
+    api, calls, sleeps = flaky_api([status_error(529), anthropic.APIConnectionError(request=None)], monkeypatch)
+    assert api.request_api(PROMPT, "model") == [{"answer": "87", "finish_reason": "end_turn"}]
+    assert len(calls) == 3
+    assert sleeps == [0, 0]
+    assert api.rate_limiter.in_flight == 0
+
+
+def test_other_errors_are_raised_at_once(monkeypatch):
+    api, calls, sleeps = flaky_api([TypeError("unexpected keyword")], monkeypatch)
+    with pytest.raises(TypeError):
+        api.request_api(PROMPT, "model")
+    assert len(calls) == 1 and sleeps == []
+    assert api.rate_limiter.in_flight == 0
@@ -0,0 +1,105 @@
+import pytest
+from gemba.cache import ResponseStore
+from gemba.gpt_api import GptApi
+from gemba.journal import Journal
+from gemba.utils import iter_scores
+
+
+HEADER = {"lines": 5, "method": "GEMBA-DA", "model": "test"}
+
+
+def test_answers_in_input_order(tmp_path):
+    journal = Journal(tmp_path / "run.journal", HEADER)
+    for index, answer in [(3, 30.0), (0, {"critical": []}), (1, None), (3, 31.0)]:
+        journal.append(index, answer)
+
+    # segments answered with None are not finished
+    assert journal.count == 2
+    # the last record of a segment wins, segments without a record are None
+    assert list(journal.answers()) == [{"critical": []}, None, None, 31.0, None]
+
+
+def test_resume_skips_finished_segments(tmp_path):
+    path = tmp_path / "run.journal"
+    journal = Journal(path, HEADER)
+    journal.append(2, 20.0)
+    journal.append(4, 40.0)
+    journal.close()
+
+    resumed = Journal(path, HEADER, resume=True)
+    assert resumed.count == 2
+    assert [i in resumed for i in range(5)] == [False, False, True, False, True]
+    resumed.append(0, 0.0)
+    assert list(resumed.answers()) == [0.0, None, 20.0, None, 40.0]
+
+
+def test_resume_cuts_off_torn_record(tmp_path):
+    path = tmp_path / "run.journal"
+    journal = Journal(path, HEADER)
+    journal.append(1, 10.0)
+    journal.close()
+    # a crash in the middle of a write
+    with open(path, "ab") as f:
+        f.write(b"3\t{\"err")
+
+    resumed = Journal(path, HEADER, resume=True)
+    assert resumed.count == 1
+    assert 3 not in resumed
+    resumed.append(3, 30.0)
+    assert list(resumed.answers()) == [None, 10.0, None, 30.0, None]
+    assert open(path, "rb").read().count(b"\n") == 3
+
+
+def test_resume_rejects_other_run(tmp_path):
+    path = tmp_path / "run.journal"
+    Journal(path, HEADER).close()
+    with pytest.raises(Exception, match="different run"):
+        Journal(path, dict(HEADER, model="other"), resume=True)
+
+
+def test_resume_requests_segments_without_answer_again(tmp_path, monkeypatch):
+    sources = [f"Source {i}." for i in range(5)]
+    hypotheses = [f"Hypothesis {i}." for i in range(5)]
+    requested = []
+
+    def request_api(self, prompt, model, temperature=0, max_tokens=None):
+        requested.append(prompt)
+        if "Hypothesis 1." in prompt and len(requested) <= 5:
+            raise Exception("overloaded")
+        return [{"answer": "80", "finish_reason": "end_turn"}]
+
+    monkeypatch.setattr(GptApi, "request_api", request_api)
+    path = tmp_path / "run.journal"
+
+    def run(resume):
+        journal = Journal(path, HEADER, resume=resume)
+        store = ResponseStore(str(tmp_path / "cache"))
+        for index, source, hypothesis, answer in iter_scores(sources, hypotheses, "English", "German", "GEMBA-DA", "model", store=store, skip=journal):
+            journal.append(index, answer)
+        journal.close()
+        return journal
+
+    journal = run(False)
+    assert list(journal.answers()) == [80, None, 80, 80, 80]
+    assert journal.count == 4 and len(requested) == 5
+
+    journal = run(True)
+    assert list(journal.answers()) == [80] * 5
+    assert journal.count == 5
+    assert len(requested) == 6 and "Hypothesis 1." in requested[-1]
+
+
+def test_read_only_leaves_the_file_alone(tmp_path):
+    path = tmp_path / "run.journal"
+    journal = Journal(path, HEADER)
+    journal.append(1, 10.0)
+    journal.close()
+    # a record still being written by another process
+    with open(path, "ab") as f:
+        f.write(b"3\t{\"err")
+    before = open(path, "rb").read()
+
+    reader = Journal(path, HEADER, read_only=True)
+    assert reader.count == 1 and 3 not in reader
+    assert list(reader.answers()) == [None, 10.0, None, None, None]
+    assert open(path, "rb").read() == before
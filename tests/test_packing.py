@@ -0,0 +1,63 @@
+import re
+import pandas as pd
+import pytest
+from gemba.gpt_api import GptApi
+from gemba.packing import build_packed_prompt, packed_bulk_request, parse_packed_answer, split_packed_answer, split_template
+from gemba.prompt import prompts, validate_number
+
+
+ROWS = [{"source_lang": "English", "target_lang": "German", "source_seg": f"Sentence {i % 9}.", "target_seg": f"Satz {i % 9}."} for i in range(20)]
+
+
+@pytest.mark.parametrize("method", [method for method, entry in prompts.items() if isinstance(entry["prompt"], str)])
+def test_split_template_reassembles(method):
+    template = prompts[method]["prompt"]
+    instruction, body, label = split_template(template)
+    assert f"{instruction}\n\n{body}\n{label}: " == template
+    assert "{target_seg}" in body and "{" not in label
+
+
+def test_split_packed_answer():
+    answer = "Item 1: 85\n2. 70\n**Item 3**: four\nstars\nItem 4: 10\nItem 4: 20\nsome closing remark"
+    # item 4 is answered twice and dropped, the remark continues its answer
+    assert split_packed_answer(answer) == {1: "85", 2: "70", 3: "four stars"}
+    assert parse_packed_answer(answer, validate_number) == {1: 85, 2: 70}
+    assert parse_packed_answer(None, validate_number) == {}
+
+
+def test_packed_prompt_numbers_every_row():
+    packed = build_packed_prompt(prompts["GEMBA-DA"]["prompt"], ROWS[:3])
+    # three items and the answer format
+    assert packed.count("Item ") == 4
+    assert 'German translation: "Satz 2."' in packed
+    assert packed.endswith('"Item <number>: <Score>", for items 1 to 3.')
+
+
+def fake_answer(prompt):
+    """Scores as a model would give them: 10 times the sentence number, packed items with number 4 left out"""
+    if "numbered items" not in prompt:
+        return str(10 * int(re.search(r'translation: "Satz (\d)', prompt).group(1)))
+    items = re.findall(r'Item (\d+):\n.*?translation: "Satz (\d)', prompt, re.DOTALL)
+    return "\n".join(f"Item {number}: {10 * int(sentence)}" for number, sentence in items if sentence != "4")
+
+
+def test_packing_matches_single_requests(monkeypatch):
+    api = GptApi(api_key="test")
+    requested = []
+
+    def request_api(prompt, model, temperature=0, max_tokens=None):
+        requested.append(prompt)
+        return [{"answer": fake_answer(prompt), "finish_reason": "end_turn"}]
+
+    monkeypatch.setattr(api, "request_api", request_api)
+    df = pd.DataFrame(ROWS)
+    df["prompt"] = [prompts["GEMBA-DA"]["prompt"].format(**row) for row in ROWS]
+
+    single = api.bulk_request(df, "model", validate_number, cache=None)
+    requested.clear()
+    packed = packed_bulk_request(api, df, "GEMBA-DA", "model", None, pack_size=4)
+
+    assert [answer["answer"] for answer in packed] == [answer["answer"] for answer in single] == [10 * (i % 9) for i in range(20)]
+    # 9 distinct rows in 3 packs, the item left out of its pack is requested on its own
+    assert len(requested) == 3 + 1
+    assert [answer.get("packed") for answer in packed[:5]] == [4, 4, 4, 4, None]
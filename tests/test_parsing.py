@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+from gemba.gemba_mqm_utils import ERROR_LEVELS, few_shots, parse_mqm_answer, parse_mqm_answers
+from gemba.prompt import prompts, validate_answers
+
+
+MQM_ANSWERS = [shot["answer"] for shot in few_shots.values()] + [
+    "Critical:\nno-error\nMajor:\naccuracy/mistranslation - \"Haus\"\nMinor:\nfluency/punctuation - \",\"\nfluency/spelling - \"Strase\"",
+    "Critical:\nnon-translation\nMajor:\nno-error\nMinor:\nno-error",
+    "Major:\n" + "\n".join(f"accuracy/omission - \"{i}\"" for i in range(30)),
+    '{"improved translation": "Ein Haus.", "errors": {"major": ["accuracy/mistranslation"], "minor": ["style/awkward", "fluency/grammar"]}}',
+    '{"improved translation": "Ein Haus.", "errors": {"critical": ["accuracy/omission"]',
+    "I cannot annotate this translation.",
+    "",
+    None,
+]
+
+SCORE_ANSWERS = ["87", "Score: 87", "['95']", "70/100", "100", "101", "-5", "between 60 and 70", "no score", "", None]
+STAR_ANSWERS = ["5 stars", "★★★", "three stars", "**", "four", "Five stars: perfect translation", "7 stars", "no stars", None]
+CLASS_ANSWERS = ["Perfect translation", "Most meaning preserved, minor issues", "No meaning preserved",
+                 "No meaning preserved, perfect translation", "other", None]
+
+
+def as_scores(values):
+    return np.array([np.nan if value is None else value for value in values], dtype=float)
+
+
+def test_parse_mqm_answers_matches_parse_mqm_answer():
+    # repeated answers take the cached path
+    answers = MQM_ANSWERS * 3
+    parsed = parse_mqm_answers(answers)
+
+    np.testing.assert_array_equal(parsed["score"], as_scores([parse_mqm_answer(answer) for answer in answers]))
+    for answer, *counts in zip(answers, *(parsed[error_level] for error_level in ERROR_LEVELS)):
+        errors = parse_mqm_answer(answer, list_mqm_errors=True) if answer is not None else {}
+        assert counts == [len(errors.get(error_level, [])) for error_level in ERROR_LEVELS]
+
+
+def test_parse_mqm_answer_scores():
+    assert parse_mqm_answer(MQM_ANSWERS[-6]) == -25
+    assert parse_mqm_answer(MQM_ANSWERS[-8]) == -7
+    assert parse_mqm_answer("Critical:\nno-error\nMajor:\nno-error\nMinor:\nno-error") == 0
+    assert parse_mqm_answer(None) is None
+
+
+@pytest.mark.parametrize("method, answers", [
+    ("GEMBA-DA", SCORE_ANSWERS), ("GEMBA-SQM_ref", SCORE_ANSWERS),
+    ("GEMBA-stars", STAR_ANSWERS), ("GEMBA-classes", CLASS_ANSWERS),
+])
+def test_validate_answers_matches_validate_answer(method, answers):
+    validate_answer = prompts[method]["validate_answer"]
+    answers = answers * 2
+    expected = [None if answer is None else validate_answer(answer) for answer in answers]
+    np.testing.assert_array_equal(validate_answers(answers, validate_answer), as_scores(expected))
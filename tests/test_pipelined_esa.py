@@ -0,0 +1,66 @@
+import re
+import time
+import threading
+import pytest
+from gemba.gpt_api import GptApi
+from gemba.utils import pipelined_esa
+
+
+SEGMENTS = 12
+
+
+def rows():
+    return [{"source_lang": "English", "target_lang": "German", "source_seg": f"Source {i}", "target_seg": f"Hypothesis {i}"} for i in range(SEGMENTS)]
+
+
+@pytest.fixture
+def esa_api(monkeypatch):
+    """GptApi whose span annotations of later segments return sooner, recording the requests in flight"""
+    api = GptApi(api_key="test")
+    lock = threading.Lock()
+    stats = {"in_flight": 0, "max_in_flight": 0, "spans_done": []}
+
+    def request_api(prompt, model, temperature=0, max_tokens=None):
+        with lock:
+            stats["in_flight"] += 1
+            stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            if isinstance(prompt, list):
+                # error spans, the segment is in the last user turn
+                segment = int(re.search(r"```Hypothesis (\d+)```", prompt[-1]["content"]).group(1))
+                time.sleep(0.01 * (SEGMENTS - segment))
+                with lock:
+                    stats["spans_done"].append(segment)
+                return [{"answer": f"spans of {segment}", "finish_reason": "end_turn"}]
+            # ranking, answered with the segment only when its own error spans are in the prompt
+            segment, = re.search(r"```Hypothesis (\d+)```", prompt).groups()
+            spans, = re.search(r"Annotated error spans:\n```spans of (\d+)```", prompt).groups()
+            time.sleep(0.005)
+            return [{"answer": segment if segment == spans else "mismatch", "finish_reason": "end_turn"}]
+        finally:
+            with lock:
+                stats["in_flight"] -= 1
+
+    monkeypatch.setattr(api, "request_api", request_api)
+    return api, stats
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_pipelined_esa(esa_api, ordered):
+    api, stats = esa_api
+    results = list(pipelined_esa(api, rows(), "model", None, ordered=ordered, max_concurrent=3))
+
+    # the span annotations finished out of order
+    assert stats["spans_done"] != sorted(stats["spans_done"])
+    # every ranking prompt carried the error spans of its own segment
+    for row, answers in results:
+        segment = int(row["target_seg"].split()[-1])
+        assert answers[0]["answer"] == segment
+        assert row["error_spans"] == f"spans of {segment}"
+    indices = [int(row["target_seg"].split()[-1]) for row, answers in results]
+    if ordered:
+        assert indices == list(range(SEGMENTS))
+    else:
+        assert sorted(indices) == list(range(SEGMENTS))
+    # both stages share one concurrency budget
+    assert 1 < stats["max_in_flight"] <= 3
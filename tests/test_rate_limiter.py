@@ -0,0 +1,98 @@
+import threading
+import time
+from email.utils import formatdate
+import pytest
+from gemba.rate_limiter import RateCoordinator, RateLimiter, TokenBucket, parse_retry_after
+
+
+class FakeResponse:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+class FakeError(Exception):
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.response = FakeResponse(headers or {})
+
+
+def test_token_bucket_queues_reservations():
+    bucket = TokenBucket(60)
+    now = bucket.updated
+    assert bucket.reserve(60, now) == 0.0
+    # the budget is spent, the next caller waits until its share is refilled
+    assert bucket.reserve(30, now) == pytest.approx(30.0)
+    assert bucket.reserve(30, now) == pytest.approx(60.0)
+    # an over-estimated reservation is given back once the usage is known
+    bucket.adjust(-60)
+    assert bucket.reserve(1, now) == pytest.approx(1.0)
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("2.5", 0) == 2.5
+    assert parse_retry_after(None, 0) is None
+    assert parse_retry_after("soon", 0) is None
+    now = time.time()
+    assert parse_retry_after(formatdate(now + 30, usegmt=True), now) == pytest.approx(30, abs=1)
+
+
+def test_throttling_halves_concurrency_once_per_cooldown():
+    limiter = RateLimiter(max_concurrent=16, decrease_cooldown=60)
+    assert limiter.on_error(FakeError(429), 0) is not None
+    assert limiter.on_error(FakeError(529), 0) is not None
+    assert limiter.slots() == 8
+    assert limiter.summary()["throttled"] == 2
+    # successes grow it back by about one slot per window
+    for _ in range(9):
+        limiter.on_success()
+    assert limiter.slots() == 9
+
+
+def test_backoff_respects_retry_after_and_max_retries():
+    limiter = RateLimiter(max_retries=2, backoff_base=0.5, backoff_max=1.0)
+    delay = limiter.on_error(FakeError(429, {"retry-after": "3"}), 0)
+    assert 3.0 <= delay <= 3.5
+    assert limiter.blocked_until > time.monotonic() + 2
+    assert 0.0 <= limiter.on_error(FakeError(500), 1) <= 1.0
+    assert limiter.on_error(FakeError(500), 2) is None
+    assert limiter.summary()["gave_up"] == 1
+
+
+def test_budgets_are_adopted_from_headers():
+    limiter = RateLimiter()
+    assert limiter.requests is None
+    limiter.on_success(headers={"anthropic-ratelimit-requests-limit": "50", "anthropic-ratelimit-output-tokens-limit": "8000"})
+    assert limiter.requests.per_minute == 50
+    assert limiter.output_tokens.per_minute == 8000
+    assert limiter.input_tokens is None
+
+
+def test_slots_bound_concurrent_calls():
+    limiter = RateLimiter(max_concurrent=1)
+    limiter.acquire()
+    acquired = threading.Event()
+    waiter = threading.Thread(target=lambda: (limiter.acquire(), acquired.set()))
+    waiter.start()
+    assert not acquired.wait(0.2)
+    limiter.release()
+    assert acquired.wait(5)
+    waiter.join()
+    assert limiter.in_flight == 1
+
+
+def test_coordinator_splits_the_budget_and_shares_pauses(tmp_path):
+    path = str(tmp_path / "rates.db")
+    first = RateLimiter(requests_per_minute=120, coordinator=RateCoordinator(path, name="first"))
+    second = RateLimiter(requests_per_minute=120, coordinator=RateCoordinator(path, name="second"))
+    first.coordinator.sync(first, force=True)
+    assert first.requests.per_minute == second.requests.per_minute == 60
+
+    # a retry-after seen by one process pauses the other one on its next refresh
+    second.on_error(FakeError(429, {"retry-after": "30"}), 0)
+    first.coordinator.sync(first, force=True)
+    assert first.blocked_until > time.monotonic() + 25
+
+    # the remaining process takes over the budget once the other one leaves
+    second.coordinator.close()
+    first.coordinator.sync(first, force=True)
+    assert first.requests.per_minute == 120
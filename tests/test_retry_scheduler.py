@@ -0,0 +1,61 @@
+import warnings
+import pytest
+from gemba.gpt_api import GptApi
+from gemba.prompt import validate_number
+from gemba.retry_scheduler import RetrySchedule
+
+
+def test_schedule():
+    schedule = RetrySchedule((0, 0.5, 1), max_attempts=2)
+    assert [schedule.temperature(attempt) for attempt in range(3)] == [0, 0.5, 1]
+    assert schedule.has_attempt(1) and not schedule.has_attempt(2)
+    # temperatures are mapped to the first attempt at or above them, within max_attempts
+    assert [schedule.attempt_for(t) for t in (0, 0.2, 0.5, 1, 2)] == [0, 1, 1, 1, 1]
+    with pytest.raises(ValueError):
+        RetrySchedule(())
+
+
+def test_summary_counts_outcomes():
+    schedule = RetrySchedule((0, 1))
+    for attempt, outcome in [(0, "parsed"), (0, "unparsed"), (1, "parsed")]:
+        schedule.record(attempt, outcome)
+    assert schedule.summary() == ("attempt 1 (t=0): 2 requests, 1 parsed, 1 unparsable, 0 without answer\n"
+                                  "attempt 2 (t=1): 1 requests, 1 parsed, 0 unparsable, 0 without answer")
+
+
+def escalating_api(monkeypatch, answers):
+    """GptApi answering with answers[temperature], recording the temperatures it was asked at"""
+    api = GptApi(api_key="test", retry_schedule=RetrySchedule((0, 0.5, 1)))
+    temperatures = []
+
+    def request_api(prompt, model, temperature=0, max_tokens=None):
+        temperatures.append(temperature)
+        return [{"answer": answers[temperature], "finish_reason": "end_turn"}]
+
+    monkeypatch.setattr(api, "request_api", request_api)
+    return api, temperatures
+
+
+def test_unparsable_answers_escalate_the_temperature(monkeypatch):
+    api, temperatures = escalating_api(monkeypatch, {0: "no idea", 0.5: "maybe", 1: "75"})
+    answer, = api.request("Score: ", "model", validate_number)
+    assert (answer["answer"], answer["temperature"]) == (75, 1)
+    assert temperatures == [0, 0.5, 1]
+
+
+def test_schedule_exhausted(monkeypatch):
+    api, temperatures = escalating_api(monkeypatch, {0: "no idea", 0.5: "maybe", 1: "still no idea"})
+    answer, = api.request("Score: ", "model", validate_number)
+    assert (answer["answer"], answer["temperature"]) == (None, 1)
+    assert len(temperatures) == 3
+
+
+def test_temperature_keyword_is_deprecated(monkeypatch):
+    api, temperatures = escalating_api(monkeypatch, {0: "no idea", 0.5: "60", 1: "75"})
+    with pytest.warns(DeprecationWarning):
+        answer, = api.request("Score: ", "model", validate_number, temperature=0.5)
+    assert answer["answer"] == 60 and temperatures == [0.5]
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        api.request("Score: ", "model", validate_number, 1)
+    assert temperatures == [0.5, 0.5]
@@ -0,0 +1,69 @@
+import numpy as np
+from gemba.sampling import SequentialSampler
+from gemba.scores import Scores
+
+
+SEGMENTS = 400
+
+
+def run(sampler, scores, quality, rng):
+    """Score the requested segments round by round, a system's scores are its quality plus noise"""
+    requested = 0
+    while not sampler.done:
+        selection = sampler.next_round(scores)
+        requested += len(selection)
+        for system, segment in selection:
+            scores.assign_score(system, segment, quality[system] + rng.normal(0, 10))
+        sampler.update(scores)
+    return requested
+
+
+def test_separated_systems_stop_early(make_testset, tmp_path):
+    quality = {"sysA": 80.0, "sysB": 50.0, "sysC": 20.0}
+    scores = Scores("GEMBA", make_testset(list(quality), SEGMENTS), None, output_path=str(tmp_path))
+    sampler = SequentialSampler(list(quality), SEGMENTS, round_size=20, min_segments=20, seed=0)
+
+    requested = run(sampler, scores, quality, np.random.default_rng(0))
+
+    assert not sampler.unsettled
+    assert requested < len(quality) * SEGMENTS / 4
+    for (better, worse), (difference, half_width, _, _) in sampler.settled.items():
+        assert quality[better] > quality[worse]
+        assert difference > half_width > 0
+
+
+def test_tied_systems_are_scored_completely(make_testset, tmp_path):
+    quality = {"sysA": 50.0, "sysB": 50.0, "sysC": 90.0}
+    scores = Scores("GEMBA", make_testset(list(quality), SEGMENTS), None, output_path=str(tmp_path))
+    sampler = SequentialSampler(list(quality), SEGMENTS, round_size=50, min_segments=20, seed=0)
+
+    run(sampler, scores, quality, np.random.default_rng(1))
+
+    # the tie is only settled once both systems have every segment and their difference is exact;
+    # sysC stops as soon as it beats both
+    assert sampler.position == SEGMENTS
+    difference, half_width, segments, settled_round = sampler.settled[("sysA", "sysB")]
+    assert (half_width, segments, settled_round) == (0.0, SEGMENTS, sampler.rounds)
+    assert sampler.settled[("sysA", "sysC")][3] < sampler.rounds
+    assert not scores.missing_mask("sysA").any() and not scores.missing_mask("sysB").any()
+    assert scores.missing_mask("sysC").any()
+
+
+def test_complete_scores_have_an_exact_difference():
+    # without sampling there is no uncertainty left, any difference settles the pair
+    sampler = SequentialSampler(["a", "b"], 10, round_size=10, min_segments=2)
+    mean, half_width = sampler.interval(np.array([0.1, -0.05] * 5))
+    assert half_width == 0.0 and mean > 0
+
+
+def test_existing_scores_are_not_requested_again(make_testset, tmp_path):
+    systems = ["sysA", "sysB"]
+    scores = Scores("GEMBA", make_testset(systems, SEGMENTS), None, output_path=str(tmp_path))
+    sampler = SequentialSampler(systems, SEGMENTS, round_size=30, seed=3)
+    first = sampler.order[:30]
+    scores.assign_scores("sysA", first[:10], [70.0] * 10)
+
+    selection = sampler.next_round(scores)
+    assert sorted(selection) == sorted([("sysA", int(s)) for s in first[10:]] + [("sysB", int(s)) for s in first])
+    # the order of a seed is fixed, a resumed run samples the same segments
+    np.testing.assert_array_equal(SequentialSampler(systems, SEGMENTS, round_size=30, seed=3).order, sampler.order)
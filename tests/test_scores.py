@@ -0,0 +1,99 @@
+import os
+import numpy as np
+import pandas as pd
+from gemba.scores import Scores
+
+
+SYSTEMS = ["sysA", "sysB", "sysC"]
+SEGMENTS = 20
+
+
+def random_assignments(rng, count):
+    systems = rng.choice(SYSTEMS, count)
+    segments = rng.integers(0, SEGMENTS, count)
+    answers = [None if x < 5 else float(x) for x in rng.integers(0, 101, count)]
+    return list(zip(systems.tolist(), segments.tolist(), answers))
+
+
+def assign_all(scores, assignments):
+    for system, segment, answer in assignments:
+        scores.assign_score(system, segment, answer, temperature=0.25)
+
+
+def expected_scores(assignments):
+    expected = {system: [None] * SEGMENTS for system in SYSTEMS}
+    for system, segment, answer in assignments:
+        expected[system][segment] = answer
+    return expected
+
+
+def test_delta_log_survives_a_crash(make_testset, tmp_path):
+    testset = make_testset(SYSTEMS, SEGMENTS)
+    assignments = random_assignments(np.random.default_rng(0), 50)
+    scores = Scores("GEMBA", testset, "refA", output_path=str(tmp_path), checkpoint_every=10, compact_every=10**6)
+    assign_all(scores, assignments)
+    # the last checkpoint was written after 50 assignments, nothing is pending and the files were never saved
+    assert not os.path.isfile(scores.get_seg_path())
+
+    reloaded = Scores("GEMBA", testset, "refA", output_path=str(tmp_path))
+    for system, values in expected_scores(assignments).items():
+        assert [reloaded.get_score(system, i) for i in range(SEGMENTS)] == values
+    np.testing.assert_array_equal(reloaded.sys_counts, scores.sys_counts)
+    np.testing.assert_allclose(reloaded.sys_sums, scores.sys_sums)
+
+
+def test_torn_delta_line_is_dropped(make_testset, tmp_path):
+    testset = make_testset(SYSTEMS, SEGMENTS)
+    scores = Scores("GEMBA", testset, "refA", output_path=str(tmp_path), checkpoint_every=1)
+    scores.assign_score("sysA", 3, 70.0)
+    with open(scores.get_delta_path(), "a") as f:
+        f.write("sysB\t4\t8")
+
+    reloaded = Scores("GEMBA", testset, "refA", output_path=str(tmp_path), checkpoint_every=1)
+    assert reloaded.get_score("sysA", 3) == 70.0
+    assert reloaded.get_score("sysB", 4) is None
+    reloaded.assign_score("sysC", 5, 10.0)
+    assert open(scores.get_delta_path()).read().splitlines()[-1] == "sysC\t5\t10\tNone"
+
+
+def test_save_matches_pandas_aggregates(make_testset, tmp_path):
+    # the system and domain means Scores used to compute with pandas groupby
+    testset = make_testset(SYSTEMS, SEGMENTS)
+    assignments = random_assignments(np.random.default_rng(1), 80)
+    scores = Scores("GEMBA", testset, "refA", output_path=str(tmp_path))
+    assign_all(scores, assignments)
+    scores.save()
+    assert not os.path.isfile(scores.get_delta_path())
+
+    seg = pd.read_csv(scores.get_seg_path(), sep="\t", names=["system", "score"], na_values="None", keep_default_na=False)
+    domains = [line.split("\t")[0] for line in testset.documents] * len(SYSTEMS)
+    expected_sys = seg.groupby("system")["score"].mean()
+    expected_domain = seg.assign(domain=domains).groupby(["domain", "system"])["score"].mean()
+
+    sys_scores = pd.read_csv(scores.get_sys_path(), sep="\t", names=["system", "score"], na_values="None", keep_default_na=False)
+    domain_scores = pd.read_csv(scores.get_domain_path(), sep="\t", names=["domain", "system", "score"], na_values="None", keep_default_na=False)
+    np.testing.assert_allclose(sys_scores.set_index("system")["score"], expected_sys.loc[sys_scores["system"]])
+    np.testing.assert_allclose(domain_scores.set_index(["domain", "system"])["score"], expected_domain.loc[list(zip(domain_scores["domain"], domain_scores["system"]))])
+
+    for system, values in expected_scores(assignments).items():
+        column = seg[seg.system == system]["score"].tolist()
+        assert [None if x != x else x for x in column] == values
+
+
+def test_merge_shards(make_testset, tmp_path):
+    testset = make_testset(SYSTEMS, SEGMENTS)
+    assignments = random_assignments(np.random.default_rng(2), 60)
+    shards = [Scores("GEMBA", testset, "refA", output_path=str(tmp_path / f"shard{i}")) for i in range(2)]
+    for i, assignment in enumerate(assignments):
+        assign_all(shards[i % 2], [assignment])
+    merged = Scores("GEMBA", testset, "refA", output_path=str(tmp_path / "merged"))
+    for shard in shards:
+        merged.merge(shard)
+
+    # a segment scored by both shards keeps the score of the shard merged last
+    expected = expected_scores(assignments[0::2])
+    for system, values in expected_scores(assignments[1::2]).items():
+        expected[system] = [b if b is not None else a for a, b in zip(expected[system], values)]
+    for system, values in expected.items():
+        assert [merged.get_score(system, i) for i in range(SEGMENTS)] == values
+    np.testing.assert_allclose(merged.sys_sums, np.nansum(merged.scores.reshape(len(SYSTEMS), SEGMENTS), axis=1))
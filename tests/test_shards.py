@@ -0,0 +1,84 @@
+import pytest
+from absl import flags
+from absl.testing import flagsaver
+from gemba.journal import Journal
+from gemba.shards import parse_shard, shard_name
+from gemba.utils import iter_rows
+from main import merged_answers
+
+
+SOURCES = [f"Source sentence {i % 7}." for i in range(50)]
+HYPOTHESES = [f"Hypothesis {i % 5}." for i in range(50)]
+HEADER = {"source": "src.txt", "hypothesis": "hyp.txt", "method": "GEMBA-DA", "model": "test", "lines": len(SOURCES)}
+
+
+@pytest.fixture
+def journal(tmp_path):
+    with flagsaver.flagsaver():
+        flags.FLAGS(["main", f"--journal={tmp_path / 'results.journal'}"])
+        yield flags.FLAGS.journal
+
+
+def shard_rows(shard, skip=None):
+    return list(iter_rows(SOURCES, HYPOTHESES, "en", "de", skip=skip, shard=shard))
+
+
+def score_shard(journal, shard, answer):
+    with_shard = dict(HEADER, shard=f"{shard[0]}/{shard[1]}")
+    shard_journal = Journal(f"{journal}.{shard_name(shard)}", with_shard)
+    for row in shard_rows(shard):
+        shard_journal.append(row["index"], answer(row))
+    shard_journal.close()
+
+
+def test_parse_shard():
+    assert parse_shard(None) is None
+    assert parse_shard("2/4") == (2, 4)
+    for spec in ["4/4", "-1/4", "1/0", "1-4"]:
+        with pytest.raises(Exception):
+            parse_shard(spec)
+
+
+def test_shards_partition_the_input():
+    shards = [shard_rows((i, 4)) for i in range(4)]
+    indices = sorted(row["index"] for rows in shards for row in rows)
+    assert indices == list(range(len(SOURCES)))
+    # identical segments (every 35th line repeats) stay in one shard
+    owners = {}
+    for i, rows in enumerate(shards):
+        for row in rows:
+            owners.setdefault((row["source_seg"], row["target_seg"]), set()).add(i)
+    assert len(owners) == 35
+    assert all(len(owner) == 1 for owner in owners.values())
+
+
+def test_merge_restores_input_order(journal):
+    for i in range(3):
+        score_shard(journal, (i, 3), lambda row: f"{row['index']}: {row['source_seg']}")
+    assert list(merged_answers(HEADER, 3)) == [f"{i}: {source}" for i, source in enumerate(SOURCES)]
+
+
+def test_merge_requires_every_segment(journal):
+    score_shard(journal, (0, 2), lambda row: 1.0)
+    Journal(f"{journal}.{shard_name((1, 2))}", dict(HEADER, shard="1/2")).close()
+    with pytest.raises(Exception, match="not scored by any shard"):
+        list(merged_answers(HEADER, 2))
+
+
+def test_merge_keeps_segments_without_answer(journal):
+    score_shard(journal, (0, 2), lambda row: None if row["index"] == 0 else 1.0)
+    score_shard(journal, (1, 2), lambda row: None if row["index"] == 0 else 2.0)
+    answers = list(merged_answers(HEADER, 2))
+    assert answers[0] is None and None not in answers[1:]
+
+
+def test_merge_does_not_modify_the_shard_journals(journal):
+    for i in range(2):
+        score_shard(journal, (i, 2), lambda row: 1.0)
+    paths = [f"{journal}.{shard_name((i, 2))}" for i in range(2)]
+    # a shard rescoring a segment, caught in the middle of a write
+    with open(paths[0], "ab") as f:
+        f.write(b"0\t2")
+    before = [open(path, "rb").read() for path in paths]
+    assert list(merged_answers(HEADER, 2)) == [1.0] * len(SOURCES)
+    assert [open(path, "rb").read() for path in paths] == before
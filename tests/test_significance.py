@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+from scipy import stats
+from gemba import significance
+from gemba.significance import bootstrap_counts, bootstrap_indices, compare_accuracy, compare_metrics
+
+
+def synthetic_scores(seed, systems=6, items=30, metrics=4, missing=0.0):
+    rng = np.random.default_rng(seed)
+    gold = rng.normal(size=(systems, 1)) + rng.normal(size=(systems, items))
+    metric_scores = gold[None] + np.linspace(0.3, 2.0, metrics)[:, None, None] * rng.normal(size=(metrics, systems, items))
+    # integer scores have ties, as GEMBA-DA scores do
+    gold, metric_scores = np.round(gold * 2), np.round(metric_scores * 2)
+    metric_scores[rng.random(metric_scores.shape) < missing] = np.nan
+    return gold, metric_scores
+
+
+def scipy_corr(corr, gold, metric):
+    valid = ~np.isnan(gold) & ~np.isnan(metric)
+    function = stats.pearsonr if corr == "pearson" else stats.kendalltau
+    return function(gold[valid], metric[valid])[0]
+
+
+def scalar_samples(gold, metrics, corr, average_by, indices):
+    """Correlations of every resample and metric, one scipy call per resample, metric and group"""
+    if average_by == "item":
+        gold, metrics = gold.T, metrics.transpose(0, 2, 1)
+    samples = np.zeros((len(indices), len(metrics)))
+    for i, draw in enumerate(indices):
+        for j, metric in enumerate(metrics):
+            if average_by == "none":
+                samples[i, j] = scipy_corr(corr, gold[:, draw].ravel(), metric[:, draw].ravel())
+            else:
+                samples[i, j] = np.nanmean([scipy_corr(corr, gold[g], metric[g]) for g in draw])
+    return samples
+
+
+def scalar_p_values(scores, samples):
+    """p-value of every better metric i not being better than metric j, as in mt-metrics-eval"""
+    order = sorted(range(len(scores)), key=lambda m: -scores[m])
+    p = np.zeros((len(scores), len(scores)))
+    for a, i in enumerate(order):
+        for b, j in enumerate(order):
+            delta = scores[i] - scores[j]
+            p[a, b] = np.mean([(sample[i] - sample[j]) - delta >= delta for sample in samples])
+    return p
+
+
+@pytest.mark.parametrize("corr", ["pearson", "kendall"])
+@pytest.mark.parametrize("average_by", ["none", "sys", "item"])
+def test_compare_metrics_matches_scipy(corr, average_by):
+    gold, metrics = synthetic_scores(0, missing=0.05)
+    names = [f"metric-{i}" for i in range(len(metrics))]
+    k = 30
+    results, sig_matrix = compare_metrics(names, gold, metrics, corr, average_by, k=k, seed=7)
+
+    units = {"none": gold.shape[1], "sys": gold.shape[0], "item": gold.shape[1]}[average_by]
+    indices = bootstrap_indices(np.random.default_rng(7), units, k)
+    scores = scalar_samples(gold, metrics, corr, average_by, [np.arange(units)])[0]
+    samples = scalar_samples(gold, metrics, corr, average_by, indices)
+
+    np.testing.assert_allclose([results[name][0] for name in names], scores, rtol=1e-10)
+    np.testing.assert_array_equal(sig_matrix, scalar_p_values(scores, samples))
+
+
+def test_system_level_resamples_systems():
+    gold, metrics = synthetic_scores(1, systems=12, metrics=3)
+    gold, metrics = gold.mean(axis=1, keepdims=True), metrics.mean(axis=2, keepdims=True)
+    names = ["a", "b", "c"]
+    results, sig_matrix = compare_metrics(names, gold, metrics, "pearson", k=40, seed=3)
+
+    indices = bootstrap_indices(np.random.default_rng(3), len(gold), 40)
+    samples = scalar_samples(gold.T, metrics.transpose(0, 2, 1), "pearson", "none", indices)
+    scores = np.array([scipy_corr("pearson", gold.ravel(), metric.ravel()) for metric in metrics])
+    np.testing.assert_allclose([results[name][0] for name in names], scores, rtol=1e-10)
+    np.testing.assert_array_equal(sig_matrix, scalar_p_values(scores, samples))
+
+
+def test_looped_kendall_matches_pairwise(monkeypatch):
+    gold, metrics = synthetic_scores(2, systems=4, items=10, metrics=3, missing=0.1)
+    weights = bootstrap_counts(bootstrap_indices(np.random.default_rng(0), gold.shape[1], 20), gold.shape[1])
+    pairwise = significance.weighted_kendall(gold, metrics, weights)
+    monkeypatch.setattr(significance, "PAIRWISE_LIMIT", 0)
+    np.testing.assert_allclose(significance.weighted_kendall(gold, metrics, weights), pairwise, rtol=1e-12)
+
+
+def test_compare_accuracy_matches_scalar_reference():
+    rng = np.random.default_rng(4)
+    golds = [rng.normal(size=n) for n in (8, 6)]
+    metrics = [gold[None] + rng.normal(0, [[0.2], [1.0], [3.0]], size=(3, len(gold))) for gold in golds]
+    names = ["close", "noisy", "noise"]
+    k = 25
+    results, sig_matrix = compare_accuracy(names, golds, metrics, k=k, seed=5)
+
+    def accuracy(draws):
+        # every pair of the resampled systems, copies of one system included
+        agreed = compared = np.zeros(len(names))
+        for gold, scores, draw in zip(golds, metrics, draws):
+            for a in range(len(draw)):
+                for b in range(a + 1, len(draw)):
+                    g = np.sign(gold[draw[a]] - gold[draw[b]])
+                    m = np.sign(scores[:, draw[a]] - scores[:, draw[b]])
+                    agreed = agreed + (m == g)
+                    compared = compared + 1
+        return agreed / compared
+
+    # compare_accuracy draws the resamples of every language pair in turn
+    rng = np.random.default_rng(5)
+    draws = [bootstrap_indices(rng, len(gold), k) for gold in golds]
+    scores = accuracy([np.arange(len(gold)) for gold in golds])
+    samples = np.array([accuracy([draw[i] for draw in draws]) for i in range(k)])
+    np.testing.assert_allclose([results[name][0] for name in names], scores)
+    np.testing.assert_array_equal(sig_matrix, scalar_p_values(scores, samples))
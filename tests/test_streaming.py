@@ -0,0 +1,129 @@
+import threading
+import pytest
+from gemba.cache import ResponseStore
+from gemba.gpt_api import GptApi
+from gemba.prompt import validate_number
+from gemba.retry_scheduler import RetrySchedule
+from gemba.shards import shard_of
+from gemba.utils import iter_scores
+
+
+def fake_api(monkeypatch, answer, num_workers=4):
+    """GptApi answering every request with answer(prompt, temperature), recording the requests in order"""
+    api = GptApi(api_key="test", num_workers=num_workers, retry_schedule=RetrySchedule((0, 0.5, 1)))
+    requests = []
+    lock = threading.Lock()
+
+    def request_api(prompt, model, temperature=0, max_tokens=None):
+        with lock:
+            requests.append((prompt, temperature))
+        return [{"answer": answer(prompt, temperature), "finish_reason": "end_turn"}]
+
+    monkeypatch.setattr(api, "request_api", request_api)
+    return api, requests
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_output_order(monkeypatch, ordered):
+    # the first prompt is answered last: once the others were requested (ordered) or yielded (unordered)
+    release = threading.Event()
+
+    def answer(prompt, temperature):
+        if prompt == "0":
+            assert release.wait(5)
+        elif ordered and sum(1 for other, _ in requests if other != "0") == 3:
+            release.set()
+        return prompt
+
+    api, requests = fake_api(monkeypatch, answer)
+    results = []
+    for i, answers in api.iter_request(["0", "1", "2", "3"], "model", validate_number, None, ordered=ordered):
+        results.append(i)
+        assert answers[0]["answer"] == i
+        if len(results) == 3:
+            release.set()
+
+    if ordered:
+        assert results == [0, 1, 2, 3]
+    else:
+        assert sorted(results[:3]) == [1, 2, 3] and results[3] == 0
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_window_bounds_the_read_ahead(monkeypatch, ordered):
+    api, requests = fake_api(monkeypatch, lambda prompt, temperature: prompt, num_workers=2)
+    read = []
+
+    def prompts():
+        for i in range(50):
+            read.append(i)
+            yield str(i)
+
+    yielded = 0
+    for i, answers in api.iter_request(prompts(), "model", validate_number, None, window=5, ordered=ordered):
+        assert len(read) - yielded <= 5
+        yielded += 1
+    assert yielded == 50 and len(requests) == 50
+
+
+def test_duplicates_are_fanned_out(monkeypatch):
+    api, requests = fake_api(monkeypatch, lambda prompt, temperature: (prompt if isinstance(prompt, str) else prompt[0]["content"])[-1])
+    prompts = ["Score: 1", "Score: 2", "Score: 1", [{"role": "user", "content": "Score: 3"}], "Score: 1", [{"role": "user", "content": "Score: 3"}]]
+    results = dict(api.iter_request(prompts, "model", validate_number, None))
+
+    assert [results[i][0]["answer"] for i in range(6)] == [1, 2, 1, 3, 1, 3]
+    assert len(requests) == 3
+    # followers get copies of the answers of the prompt that was requested
+    assert results[2][0] is not results[0][0] and results[2][0] == results[0][0]
+    assert api.dedup_summary().startswith("6 prompts, 3 unique")
+
+
+def test_unparsed_answers_are_requeued_at_the_next_temperature(monkeypatch):
+    # a single worker runs the attempts in the order they were queued
+    api, requests = fake_api(monkeypatch, lambda prompt, temperature: "no idea" if (prompt, temperature) == ("x", 0) else "50", num_workers=1)
+    results = list(api.iter_request(["x", "y", "z"], "model", validate_number, None, ordered=False))
+
+    assert requests == [("x", 0), ("y", 0), ("z", 0), ("x", 0.5)]
+    assert [i for i, answers in results] == [1, 2, 0]
+    assert results[2][1][0]["temperature"] == 0.5
+
+    api, requests = fake_api(monkeypatch, lambda prompt, temperature: "no idea" if prompt == "x" else "50", num_workers=1)
+    results = dict(api.iter_request(["x", "y"], "model", validate_number, None))
+    assert requests == [("x", 0), ("y", 0), ("x", 0.5), ("x", 1)]
+    assert (results[0][0]["answer"], results[0][0]["temperature"]) == (None, 1)
+
+
+SOURCES = [f"Source {i}." for i in range(20)]
+HYPOTHESES = [f"Hypothesis {i}." for i in range(20)]
+
+
+@pytest.fixture
+def scored(tmp_path, monkeypatch):
+    requested = []
+
+    def request_api(self, prompt, model, temperature=0, max_tokens=None):
+        requested.append(next(i for i in range(len(SOURCES)) if f'"{HYPOTHESES[i]}"' in prompt))
+        return [{"answer": "80", "finish_reason": "end_turn"}]
+
+    monkeypatch.setattr(GptApi, "request_api", request_api)
+
+    def score(**kwargs):
+        requested.clear()
+        store = ResponseStore(str(tmp_path / "cache"))
+        scores = list(iter_scores(SOURCES, HYPOTHESES, "English", "German", "GEMBA-DA", "model", store=store, **kwargs))
+        return scores, sorted(requested)
+    return score
+
+
+def test_iter_scores_skip_and_shard(scored):
+    scores, requested = scored(skip={1, 3})
+    assert [index for index, *_ in scores] == requested == [i for i in range(20) if i not in (1, 3)]
+    assert all((SOURCES[index], HYPOTHESES[index], 80) == (source, hypothesis, answer) for index, source, hypothesis, answer in scores)
+
+    shards = [[index for index, *_ in scored(shard=(i, 3))[0]] for i in range(3)]
+    assert sorted(sum(shards, [])) == list(range(20))
+    for i, indices in enumerate(shards):
+        assert all(shard_of(f"{SOURCES[index]}\t{HYPOTHESES[index]}", 3) == i for index in indices)
+
+    scores, requested = scored(skip={0}, shard=(0, 3))
+    assert [index for index, *_ in scores] == [index for index in shards[0] if index != 0]
@@ -0,0 +1,77 @@
+import json
+import threading
+import urllib.request
+from types import SimpleNamespace
+from gemba.telemetry import Samples, Telemetry
+
+
+def parse_a(answer):
+    return answer
+
+
+def parse_b(answer):
+    return answer
+
+
+def test_samples_quantiles_and_reservoir():
+    samples = Samples(size=10)
+    for value in range(100):
+        samples.add(float(value))
+    assert samples.count == 100 and samples.sum == sum(range(100))
+    assert len(samples.reservoir) == 10
+
+    samples = Samples()
+    for value in range(100):
+        samples.add(float(value))
+    assert [samples.quantile(q) for q in (0.5, 0.95, 0.99)] == [50.0, 95.0, 99.0]
+    assert Samples().quantile(0.5) == 0.0
+
+
+def test_events_are_labelled_by_method_in_every_thread(tmp_path):
+    telemetry = Telemetry(path=str(tmp_path / "events.jsonl"), method="GEMBA-DA")
+    telemetry.name_method(parse_b, "GEMBA-ESA_ranking")
+
+    def work(parse):
+        with telemetry.scope(parse):
+            for _ in range(50):
+                telemetry.count("model", "attempts")
+                telemetry.observe("model", "latency", 0.5)
+
+    threads = [threading.Thread(target=work, args=(parse,)) for parse in [parse_a, parse_b, parse_a]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    telemetry.record_usage("model", SimpleNamespace(input_tokens=10, output_tokens=2, cache_read_input_tokens=None))
+    telemetry.close()
+
+    assert telemetry.counters[("model", "GEMBA-DA")] == {"attempts": 100, "input_tokens": 10, "output_tokens": 2}
+    assert telemetry.counters[("model", "GEMBA-ESA_ranking")] == {"attempts": 50}
+    assert telemetry.samples[("model", "GEMBA-ESA_ranking")]["latency"].count == 50
+
+    with open(tmp_path / "events.jsonl") as f:
+        events = [json.loads(line) for line in f]
+    assert len(events) == 302
+    assert {(event["method"], event["event"]) for event in events} >= {("GEMBA-DA", "attempts"), ("GEMBA-ESA_ranking", "latency"), ("GEMBA-DA", "input_tokens")}
+
+    lines = telemetry.summary().split("\n")
+    assert lines[0].startswith("model GEMBA-DA: 100 attempts, 0 cache hits")
+    assert "latency p50 0.50s p95 0.50s p99 0.50s" in lines[0]
+    assert lines[0].endswith("tokens 10 input, 2 output, 0 cache read, 0 cache creation")
+
+
+def test_metrics_endpoint():
+    telemetry = Telemetry(method='GEMBA-"DA"')
+    telemetry.count("model", "api_calls", 3)
+    telemetry.observe("model", "queue_wait", 1.0)
+    server = telemetry.serve(0)
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response:
+            text = response.read().decode("utf-8")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert text == telemetry.prometheus_text()
+    assert 'gemba_events_total{model="model",method="GEMBA-\\"DA\\"",event="api_calls"} 3' in text
+    assert 'gemba_queue_wait_seconds_count{model="model",method="GEMBA-\\"DA\\""} 1' in text
@@ -0,0 +1,70 @@
+import pandas as pd
+import pytest
+from gemba.gemba_esa import TEMPLATE_GEMBA_ESA_ERROR_SPANS, TEMPLATE_GEMBA_ESA_RANKING
+from gemba.gemba_mqm_utils import TEMPLATE_GEMBA_MQM, apply_template, compile_template
+from gemba.prompt import prompts
+
+
+def baseline_apply_template(template, data):
+    # apply_template before templates were compiled
+    if isinstance(template, str):
+        return template.format(**data)
+    elif isinstance(template, list):
+        prompt = []
+        for conversation_turn in template:
+            p = conversation_turn.copy()
+            p['content'] = p['content'].format(**data)
+            prompt.append(p)
+        return prompt
+    else:
+        raise ValueError(f"Unknown template type {type(template)}")
+
+
+TEMPLATES = {"GEMBA-MQM": TEMPLATE_GEMBA_MQM, "GEMBA-ESA error spans": TEMPLATE_GEMBA_ESA_ERROR_SPANS, "GEMBA-ESA ranking": TEMPLATE_GEMBA_ESA_RANKING}
+TEMPLATES.update({method: entry["prompt"] for method, entry in prompts.items()})
+
+ROWS = [
+    {"source_lang": "English", "target_lang": "German", "source_seg": "A plain sentence.", "target_seg": "Ein einfacher Satz.",
+     "reference_seg": "Ein schlichter Satz.", "error_spans": "Minor:\nfluency/grammar - \"einfacher\""},
+    {"source_lang": "English", "target_lang": "Czech", "source_seg": "Braces {source_lang} {0} {} }{ {{x}}", "target_seg": "json {\"a\": [1, 2]} }",
+     "reference_seg": "{target_seg}", "error_spans": "{"},
+]
+
+
+def without_cache_control(prompt):
+    if isinstance(prompt, str):
+        return prompt
+    return [{key: value for key, value in turn.items() if key != "cache_control"} for turn in prompt]
+
+
+@pytest.mark.parametrize("name", list(TEMPLATES))
+def test_compiled_template_matches_baseline(name):
+    template = TEMPLATES[name]
+    expected = [baseline_apply_template(template, row) for row in ROWS]
+    compiled = compile_template(template)
+    rendered = [compiled.render(row) for row in ROWS]
+    columns = compiled.render_columns(pd.DataFrame(ROWS))
+
+    assert [without_cache_control(prompt) for prompt in rendered] == expected
+    assert columns == rendered
+    assert [apply_template(template, row) for row in ROWS] == rendered
+
+
+@pytest.mark.parametrize("name", [name for name, template in TEMPLATES.items() if isinstance(template, list)])
+def test_static_prefix_is_shared(name):
+    template = TEMPLATES[name]
+    compiled = compile_template(template)
+    first, second = compiled.render(ROWS[0]), compiled.render(ROWS[1])
+    prefix = len(compiled.static)
+    assert prefix > 0
+    # the few-shot turns are the same objects in every prompt, the cache mark sits on the last of them
+    assert all(a is b for a, b in zip(first[:prefix], second[:prefix]))
+    assert [i for i, turn in enumerate(first) if "cache_control" in turn] == ([prefix - 1] if first[prefix - 1]["role"] != "system" else [])
+    assert first[prefix:] != second[prefix:]
+
+
+def test_templates_are_cached_by_content():
+    template = [dict(turn) for turn in TEMPLATE_GEMBA_MQM]
+    assert compile_template(template) is compile_template(TEMPLATE_GEMBA_MQM)
+    template[-1]["content"] = "Edited: " + template[-1]["content"]
+    assert compile_template(template).render(ROWS[0])[-1]["content"].startswith("Edited: ")
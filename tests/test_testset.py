@@ -0,0 +1,50 @@
+import os
+import pytest
+from gemba.testset import SegmentFile
+from gemba import testset as testset_module
+
+
+@pytest.mark.parametrize("content", ["a \nb\n\nc\n", "a\nb\nc", "", "ü\n€ \n"])
+def test_segment_file_matches_readlines(tmp_path, content):
+    path = tmp_path / "file.txt"
+    path.write_bytes(content.encode("utf-8"))
+    with open(path) as f:
+        expected = [line.rstrip() for line in f]
+
+    segments = SegmentFile(str(path), str(tmp_path / "offsets"))
+    assert list(segments) == expected
+    assert [segments[i] for i in range(len(segments))] == expected
+    assert segments[-1:] == expected[-1:]
+    with pytest.raises(IndexError):
+        segments[len(expected)]
+
+
+def test_offsets_are_cached_outside_the_data(tmp_path):
+    data = tmp_path / "data"
+    data.mkdir()
+    path = data / "file.txt"
+    path.write_text("a\nb\n")
+    assert list(SegmentFile(str(path), str(tmp_path / "offsets"))) == ["a", "b"]
+    assert os.listdir(data) == ["file.txt"]
+    assert len(os.listdir(tmp_path / "offsets")) == 1
+
+    # an index directory that cannot be created keeps the offsets in memory
+    assert list(SegmentFile(str(path), str(path / "offsets"))) == ["a", "b"]
+
+    # a changed file gets a new index
+    path.write_text("a\nb\nc\n")
+    assert list(SegmentFile(str(path), str(tmp_path / "offsets"))) == ["a", "b", "c"]
+    assert len(os.listdir(tmp_path / "offsets")) == 2
+
+
+def test_testset_lists_and_filters_systems(make_testset, tmp_path):
+    testset = make_testset(["sysB", "sysA", "sysC"], 5)
+    assert list(testset.systems) == ["sysA", "sysB", "sysC"]
+    assert testset.main_ref == "refA" and testset.segments_count() == 15
+    rows = list(testset.iterate_over_all("refA"))
+    assert rows[6] == ("sources/en-de.txt segment 1", "system-outputs/en-de/sysB.txt segment 1", "references/en-de.refA.txt segment 1", "sysB")
+
+    subset = testset_module.Testset(testset.basepath, "test", "en-de", systems=["sysC"], index_dir=str(tmp_path / "offsets"))
+    assert list(subset.systems) == ["sysC"]
+    with pytest.raises(Exception, match="System sysD"):
+        testset_module.Testset(testset.basepath, "test", "en-de", systems=["sysD"], index_dir=str(tmp_path / "offsets"))
@@ -0,0 +1,48 @@
+import pytest
+from gemba.gpt_api import GptApi, build_parameters
+from gemba.prompt import prompts, validate_number
+from gemba.tokens import MESSAGE_OVERHEAD, REQUEST_OVERHEAD, estimate_input_tokens, estimate_text_tokens, output_budget
+
+
+def test_output_budget_of_every_method():
+    for method, entry in prompts.items():
+        assert output_budget(method) == entry["max_tokens"]
+    assert output_budget("GEMBA-MQM") == 500
+    assert output_budget("GEMBA-ESA") == 1024
+    with pytest.raises(Exception, match="GEMBA-XYZ"):
+        output_budget("GEMBA-XYZ")
+
+
+@pytest.mark.parametrize("text, tokens", [
+    ("", 0),
+    ("translation", 2),
+    ("Score 100 of 1000.", 6),
+    ("Übersetzung", 3),
+    ("日本語", 3),
+])
+def test_estimate_text_tokens(text, tokens):
+    assert estimate_text_tokens(text) == tokens
+
+
+def test_estimate_input_tokens_counts_system_and_messages():
+    prompt = [
+        {"role": "system", "content": "Rate the translation."},
+        {"role": "user", "content": "Hello world", "cache_control": {"type": "ephemeral"}},
+        {"role": "assistant", "content": "ok"},
+        {"role": "user", "content": "Hallo Welt"},
+    ]
+    parameters = build_parameters(prompt, "model", 0, None)
+    system = sum(estimate_text_tokens(block["text"]) for block in parameters["system"])
+    messages = sum(estimate_text_tokens(text) for text in ["Hello world", "ok", "Hallo Welt"])
+    assert estimate_input_tokens(parameters) == REQUEST_OVERHEAD + system + messages + 3 * MESSAGE_OVERHEAD
+    # a plain string system prompt counts the same as a block
+    assert estimate_input_tokens({"system": "Rate the translation.", "messages": []}) == REQUEST_OVERHEAD + estimate_text_tokens("Rate the translation.")
+
+
+def test_truncated_answers_are_counted(monkeypatch):
+    api = GptApi(api_key="test")
+    monkeypatch.setattr(api, "request_api", lambda prompt, model, temperature=0, max_tokens=None: [{"answer": "Score: 85 - the translation", "finish_reason": "max_tokens"}])
+    answer, = api.request("Score: ", "model", validate_number, max_tokens=output_budget("GEMBA-DA"))
+    assert answer["answer"] == 85
+    assert api.telemetry.counters[("model", "unknown")]["truncated"] == 1
+    assert "1 truncated" in api.telemetry.summary()